@@ -31,10 +31,33 @@
     cli (source | current_source) -> get_current_source
     cli sources -> get all sources
     cli source (<source name, id, or keywords)
+
+    cli scenes -> list stored scenes
+    cli scene <scene name> -> apply stored scene
+    cli scene <scene name> '<scene json>' -> store scene
+
+    cli script <file> -> run the commands in file, one per line, in one process
+    cli script -> run the commands read from stdin
+        # commands until a line that only holds 'wait SEC' run at the same time. each line can name its own
+        # speakers and its own instance with -n|-i|-p, and every instance's speakers are read only once.
+        -n office kitchen connect volume 40%
+        -n living_room all mute
+        wait 2
+        -n office kitchen fade 10% 5
+
+    cli watch -> print Airfoil's notifications as they arrive, over a table of the speakers that is redrawn on each one
+    cli <speaker> watch [<notification type>...] [json | list]
+        # json prints one JSON object per line and list one line per notification, for piping into other programs.
+        # types filter by notification type, like speakerVolumeChanged or part of one: watch connectedchanged
+        # the view survives Airfoil restarts and network drops, and starts over with a resynced event after them
+
+    cli daemon -> keep found instances and their speakers in a background process; while it runs, other cli
+     commands are sent to it, which saves looking them up for every command
     -------------------------------------------
     cli ...cmd... --> act on first remoteFoil we find
     cli -n|--name airfoil_name ...cmd... --> act on remoteFoil by name
     cli -i|--ip airfoil_ip ...cmd... --> act on remoteFoil by ip
+    cli -i|--ip airfoil_ip -p|--port airfoil_port ...cmd... --> act on remoteFoil at ip:port without mdns
     flag value pair position in cmd does not matter as long as
     value follows flag
 
@@ -43,6 +66,9 @@
      [keywords])  -> return state of selected speakers
     cli (<speaker name,id, or keywords> | speakers | all | comma separated list of names, ids or
      [keywords]) ...speaker_cmd...
+        # speakers followed by names acts on just the speakers named, and all followed by names on every connected
+        # speaker and the ones named. speakers or all alone act on every connected speaker, and with
+        # -id|--include_disconnected on every speaker. all speakers are read once, whatever is named.
     cli speaker connect
     cli speaker disconnect
     cli speaker toggle
@@ -56,11 +82,19 @@
     cli sources
     cli source (name, id, or keywords of source)"
 """
-import sys, time, json
-from remoteFoil.utils import nones, bools, print_table
-from remoteFoil.airfoil import OFF, ON, MIDDLE
-from remoteFoil.airfoil_finder import AirfoilFinder
-args = [arg.lstrip('-\/\\').lower() for arg in sys.argv]
+import sys, time, threading
+from remoteFoil.utils import nones, bools, print_table, LiveTable, TableWriter
+from remoteFoil.airfoil import Airfoil, AirfoilTimeoutError, OFF, ON, MIDDLE, RESYNCED
+# discovery, json, scenes and script mode are imported where they are used, so commands that do not need them, and
+# commands forwarded to the daemon, start faster
+
+
+def parse_args(argv):
+    # JSON documents, like the scene in 'scene <name> <scene json>', are kept as they were given
+    return [arg if arg.lstrip().startswith('{') else arg.lstrip('-\/\\').lower() for arg in argv]
+
+
+args = parse_args(sys.argv)
 
 DEFAULT_TIMEOUT = 3
 DEFAULT_SECONDS = 3
@@ -75,6 +109,11 @@ NEXT = ['skip', 'next', 'next_track']
 LAST = ['prev', 'last', 'back', 'prev_track', 'last_track']
 CURR_SOURCE = ['source', 'current_source', 'current', 'src']
 SOURCES = ['sources', 'all_sources', 'srcs']
+SCENE = ['scene']
+SCENES = ['scenes']
+DAEMON = ['daemon']
+SCRIPT = ['script', 'batch']
+WATCH = ['watch']
 
 CONNECT = ['on', 'yes', 'true', 'connect', 'enable', 'enabled']
 DISCONNECT = ['off', 'no', 'false', 'disconnect', 'disable', 'disabled']
@@ -93,10 +132,23 @@ LIST = ['list', 'sequence']
 
 AIRFOIL_NAME = ['name', 'n']
 AIRFOIL_IP = ['ip', 'i']
+AIRFOIL_PORT = ['port', 'p']
 ALL_ARGS = HELP + PLAY + NEXT + LAST + CURR_SOURCE + SOURCES + CONNECT + DISCONNECT + TOGGLE + TIMEOUT + \
-           MUTE + UNMUTE + VOLUME + FADE + ALL_SPEAKERS + AIRFOIL_IP + AIRFOIL_NAME + WAIT
+           MUTE + UNMUTE + VOLUME + FADE + ALL_SPEAKERS + AIRFOIL_IP + AIRFOIL_NAME + AIRFOIL_PORT + WAIT + \
+           SCENE + SCENES + WATCH
 ALL_ACTIONS = PLAY + NEXT + LAST + CURR_SOURCE + SOURCES + CONNECT + DISCONNECT + TOGGLE + MUTE + \
-              UNMUTE + VOLUME + FADE + WAIT
+              UNMUTE + VOLUME + FADE + WAIT + SCENE + SCENES + WATCH
+
+SPEAKER_HEADERS = ['#', 'name', 'type', 'volume', 'connected', 'password', 'keywords', 'id']
+SPEAKER_SIZES = (10, 30, 20, 6, 9, 10, 40, 70)
+EVENT_HEADERS = ['time', 'event', 'speaker', 'change']
+EVENT_SIZES = (8, 27, 18, 24)
+
+
+def speaker_row(n, s):
+    return [str(n+1), s.name, s.type, str(round(s.volume, 2)), bools(s.connected), bools(s.password),
+            str(s.keywords), s.id]
+
 
 help_text = {
      'fade':
@@ -120,7 +172,9 @@ help_text = {
         ' # Mute all connected speakers (all of these work)\n' 
         f'  {args[0]} mute\n'
         f'  {args[0]} all mute\n'
-        f'  {args[0]} everywhere mute\n',
+        f'  {args[0]} everywhere mute\n'
+        ' # Mute all connected speakers and \'Patio\', which is not connected\n'
+        f'  {args[0]} all patio mute\n',
      'volume':
         'usage volume:volume <volume>\n'
         '             <volume>  # volume keyword is optional for volume action\n'
@@ -141,6 +195,22 @@ help_text = {
         '\t- any volume between 1 and 100 will be treated as a percentage\n'
         '\t- any volume < 0 will be rounded up to 0\n'
         '\t- any volume > 100 will be rounded to 1\n',
+     'scene':
+        'usage scene: scene <scene name> [<scene json>]\n'
+        '\t# store a scene named dinner. speakers are matched by name, id, or keywords.\n'
+        '\t  scene dinner \'{"source": "spotify", "speakers": {"kitchen": {"connected": true, "volume": "40%"},\n'
+        '\t                                                    "office": {"connected": false}}}\'\n'
+        '\t# apply the scene named dinner\n'
+        '\t  scene dinner\n'
+        '\t# scenes are stored in ~/.remotefoil/scenes.json, or the file named by REMOTEFOIL_SCENES\n',
+     'watch':
+        'usage watch: watch [<notification type>...]\n'
+        '\t# redraw a table of the speakers whenever Airfoil reports a change, until ctrl-c\n'
+        '\t  watch\n'
+        '\t# print the volume changes of the kitchen speaker as JSON lines\n'
+        '\t  kitchen watch speakervolumechanged json\n'
+        '\t# print connects and disconnects of all speakers, one line each\n'
+        '\t  watch connectedchanged list\n',
      'mute':
         'usage mute: mute\n'
         '\t# mute speaker named \'Living Room Google Home\'\n'
@@ -161,9 +231,17 @@ help_text = {
 
 
 class AirfoilCli:
-    def __init__(self):
+    def __init__(self, argv=None, new_airfoil=Airfoil):
+        """
+        :param argv:        list of command line arguments, sys.argv if None
+        :param new_airfoil: callable taking the same arguments as Airfoil and returning an Airfoil object. The daemon
+                            passes one that returns the Airfoil objects it keeps.
+        """
+        self.args = parse_args(sys.argv if argv is None else argv)
+        self.new_airfoil = new_airfoil
         self.airfoil, self.airfoil_ip, self.airfoil_name, self.finder, self.source, self.speakers = nones(6)
-        self.volume, self.json, self.table, self.silent, self.help, self.wait_time = nones(6)
+        self.airfoil_port = None
+        self.volume, self.json, self.table, self.silent, self.wait_time = nones(5)
         self.print_mode = 'table'  # or 'list' or 'json'
         self.include_disconnected = False
         self.seconds, self.ticks = DEFAULT_SECONDS, DEFAULT_TICKS
@@ -177,34 +255,26 @@ class AirfoilCli:
               'with up to 8 digits after the decimal point, or a percentage. values greater than 1 or less than',
               '0 will be constrained to valid values. valid values for volume include 0, 1, 0.75432111, 35%, 100%')
 
-    def get_airfoil(self, name=None, ip=None):
-        if name:
+    def get_airfoil(self):
+        if self.airfoil_name:
             try:
-                self.airfoil_name = args[name + 1]
-                args.pop(name + 1)
-                args.pop(name)
-                self.airfoil = AirfoilFinder.get_airfoil_by_name(self.airfoil_name)
+                self.airfoil = self.new_airfoil(name=self.airfoil_name)
             except TimeoutError:
                 print('Timed out waiting for remoteFoil instance with name "' + self.airfoil_name + '".')
                 sys.exit(1)
-            except IndexError:
-                print('Please specify a name after -n|--name.')
-                sys.exit(1)
-        elif ip:
+        elif self.airfoil_ip:
+            # with an ip (and optionally a port) the host is asked directly instead of browsing for it
             try:
-                self.airfoil_ip = args[ip + 1]
-                args.pop(ip + 1)
-                args.pop(ip)
-                self.airfoil = AirfoilFinder.get_airfoil_by_ip(self.airfoil_ip)
+                self.airfoil = self.new_airfoil(ip=self.airfoil_ip, port=self.airfoil_port)
             except TimeoutError:
                 print('Timed out waiting for remoteFoil instance with ip "' + self.airfoil_ip + '".')
                 sys.exit(1)
-            except IndexError:
-                print('Please specify an IPv4 address after -i|--ip')
+            except ConnectionError as e:
+                print(e)
                 sys.exit(1)
         else:
             try:
-                self.airfoil = AirfoilFinder.get_first_airfoil()
+                self.airfoil = self.new_airfoil()
             except TimeoutError:
                 print('Timed out waiting for an remoteFoil instance to appear on the network.')
                 sys.exit(1)
@@ -212,6 +282,7 @@ class AirfoilCli:
     def show_airfoils(self):
         print('  <Run with h or help to see usage information.>')
         print('Looking for instances of Airfoil on the network. Press ctrl-c to exit.')
+        from remoteFoil.airfoil_finder import AirfoilFinder
         self.finder = AirfoilFinder()
         timeout = self.timeout
         try:
@@ -257,6 +328,7 @@ class AirfoilCli:
     def current_source(self, source=None):
         s = source if source else self.airfoil.get_current_source()
         if self.print_mode == 'json':
+            import json
             print(json.dumps(dict(s._asdict())))
             return
 
@@ -278,9 +350,10 @@ class AirfoilCli:
                 print(f' {k}: {v}')
 
     def get_sources(self):
-        # print all sources
-        sources = self.airfoil.get_sources()
+        # print all sources, from the catalog the daemon keeps if it was loaded recently
+        sources = self.airfoil.get_sources(cached=True)
         if self.print_mode == 'json':
+            import json
             print(json.dumps([dict(s._asdict()) for s in sources]))
 
         sizes = (3, 30, 60, 50)
@@ -296,7 +369,69 @@ class AirfoilCli:
                       f' id: {r[3]}')
 
     def set_source(self):
-        self.source = self.airfoil.set_source(id=self.source.id)
+        # read back, since the source's remote control and track metadata support is printed
+        self.source = self.airfoil.set_source(id=self.source.id, confirm=True)
+
+    def watch(self, types):
+        """
+        print the notifications Airfoil sends until interrupted, reconnecting when the connection drops. Only
+        notifications about the speakers in self.speakers are printed if any were named, and only those whose type
+        contains one of types if any were given. The first event, and every resynced event after a reconnect, holds
+        all of the speakers.
+        - json prints every notification as one JSON object per line
+        - list prints every notification as one line of text
+        - table redraws a table of the speakers in place after every notification, or when printing to something
+          other than a terminal, prints every notification as a row of a table
+        :param types:   list of notification types or parts of them, not case-sensitive
+        """
+        import json
+        from remoteFoil.airfoil_state import AirfoilState
+        ids = [s.id for s in self.speakers] if self.speakers else []
+        types = [t.replace('_', '') for t in types]
+        state = AirfoilState()
+        view = events = None
+        if self.print_mode == 'table' and sys.stdout.isatty():
+            print(f'{self.airfoil.name} at {self.airfoil.ip}:{self.airfoil.port}  (ctrl-c to exit)')
+            view = LiveTable(SPEAKER_HEADERS, SPEAKER_SIZES)
+        elif self.print_mode == 'table':
+            events = TableWriter(EVENT_HEADERS, EVENT_SIZES)
+        for message in self.airfoil.watch():
+            state.handle(message)
+            kind = 'snapshot' if 'replyID' in message else message.get('request', '')
+            data = message.get('data') or {}
+            id = data.get('longIdentifier')
+            speaker = state.speakers.get(id)
+            if kind not in ['snapshot', RESYNCED]:
+                if types and not any(t in kind.lower() for t in types):
+                    continue
+                if ids and id and id not in ids:
+                    continue
+            speakers = [s for s in state.speakers.values() if not ids or s.id in ids]
+            if self.print_mode == 'json':
+                event = {'event': kind, 'time': round(time.time(), 3)}
+                if kind in ['snapshot', RESYNCED]:
+                    event['speakers'] = [s._asdict() for s in speakers]
+                else:
+                    event['data'] = data
+                    if speaker:
+                        event['speaker'] = speaker._asdict()
+                print(json.dumps(event), flush=True)
+                continue
+            changes = ', '.join(f'{k}: {v}' for k, v in data.items() if k not in ['longIdentifier', 'speakers'])
+            if kind in ['snapshot', RESYNCED]:
+                changes = f'{len(speakers)} speakers'
+            now = time.strftime("%H:%M:%S")
+            line = f'{now} {kind}' + (f' {speaker.name}' if speaker else '') + f' -> {changes}'
+            if self.print_mode == 'list':
+                print(line, flush=True)
+                if kind in ['snapshot', RESYNCED]:
+                    self.print_speakers(speakers)
+            elif view:
+                view.update([speaker_row(n, s) for n, s in enumerate(speakers)], line)
+            else:
+                events.write([now, kind, speaker.name if speaker else '', changes])
+        # only a deadline ends the watch without an error; the speakers were printed already
+        self.speakers = None
 
     def connect(self):
         self.speakers = self.airfoil.connect_some(ids=[s.id for s in self.speakers])
@@ -321,6 +456,40 @@ class AirfoilCli:
         self.speakers = self.airfoil.fade_some(self.volume, seconds=self.seconds, ticks=self.ticks,
                                                ids=[s.id for s in self.speakers])
 
+    def scene(self, name, doc=None):
+        import json
+        from remoteFoil.airfoil_state import AirfoilState
+        from remoteFoil.scenes import SceneStore
+        store = SceneStore()
+        if doc:
+            try:
+                store.save(name, json.loads(doc))
+            except ValueError as e:
+                print(f'Error: scene \'{name}\' was not saved: {e}')
+                sys.exit(1)
+            return
+        state = AirfoilState()
+        state.load_speakers(self.airfoil.get_speakers())
+        try:
+            scene, targets = store.resolve(name, self.airfoil.name, state)
+            steps, self.speakers, missed = self.airfoil.apply_scene(scene, targets, state)
+        except ValueError as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        if missed:
+            print(f'speakers did not reach their targets: {", ".join(s.name for s in missed)}', end=' ')
+
+    def list_scenes(self):
+        from remoteFoil.scenes import SceneStore
+        names = SceneStore().names()
+        if self.print_mode == 'json':
+            import json
+            print(json.dumps(names))
+            return
+        print()
+        for name in names:
+            print(f' {name}')
+
     def parse_source(self, source):
         match = None
         try:
@@ -345,34 +514,32 @@ class AirfoilCli:
             default = [default]
         for i in range(num_params, 0, -1):
             try:
-                params.append(args[index+i])
-                args.pop(index + i)
+                params.append(self.args[index+i])
+                self.args.pop(index + i)
             except IndexError:
                 d = default[i-1]
                 raise d if issubclass(type(d), Exception) else params.append(d)
-        args.pop(index)
+        self.args.pop(index)
         return params[0] if len(params) == 1 else params[::-1]
 
     def parse_volume(self, volume):
         self.volume = self.airfoil._parse_volume(volume)
         return self.volume
 
-    def print_speakers(self):
+    def print_speakers(self, speakers=None):
+        speakers = self.speakers if speakers is None else speakers
         if self.print_mode == 'json':
-            print(json.dumps([s._asdict() for s in self.speakers]))
+            import json
+            print(json.dumps([s._asdict() for s in speakers]))
             return
 
-        headers = ['#', 'name', 'type', 'volume', 'connected', 'password', 'keywords', 'id']
-        sizes = (10, 30, 20, 6, 9, 10, 40, 70)
-        fields = lambda n, s: [str(n+1), s.name, s.type, str(round(s.volume, 2)), bools(s.connected),
-                               bools(s.password), str(s.keywords), s.id]
-        rows = [fields(n, s) for n, s in enumerate(self.speakers)]
+        rows = [speaker_row(n, s) for n, s in enumerate(speakers)]
         if self.print_mode == 'table':
-            print_table(headers, rows, sizes)
+            print_table(SPEAKER_HEADERS, rows, SPEAKER_SIZES)
         else:
             for row in rows:
-                for h, r in zip(headers, row):
-                    if h == headers[0]:
+                for h, r in zip(SPEAKER_HEADERS, row):
+                    if h == SPEAKER_HEADERS[0]:
                         print(f'({h}{r})')
                     else:
                         print(f' {h}: {r}')
@@ -388,7 +555,7 @@ class AirfoilCli:
             topics = [topics]
         for topic in topics:
             print(help_text[topic])
-        sys.exit(status=status)
+        sys.exit(status)
 
     def parse_cmd_line(self):
         """
@@ -396,16 +563,16 @@ class AirfoilCli:
         :return:
         """
         def in_args(check):
-            for arg in args:
+            for arg in self.args:
                 if arg in check:
-                    return args.index(arg)
+                    return self.args.index(arg)
             return None
 
         if in_args(HELP):   # if 'help' in cmd, show help topics for all actions specified in cmd
-            topics = [arg for arg in args if arg in ALL_ACTIONS]
+            topics = [arg for arg in self.args if arg in ALL_ACTIONS]
             return self.help(topics)
 
-        if len(args) == 1:  # show airfoils on network with no arguments
+        if len(self.args) == 1:  # show airfoils on network with no arguments
             self.show_airfoils()
             return
 
@@ -419,7 +586,7 @@ class AirfoilCli:
                     else:
                         print('Starting with timeout disabled.')
                 except ValueError:
-                    print(f'Error: \'{args[timeout]}\' requires a positive number as an argument.')
+                    print(f'Error: \'{self.args[timeout]}\' requires a positive number as an argument.')
                     return False
             else:
                 self.timeout = DEFAULT_TIMEOUT
@@ -427,7 +594,7 @@ class AirfoilCli:
         def get_disconnected():
             include_disconnected = in_args(INCLUDE_DISCONNECTED)
             if include_disconnected:
-                args.pop(include_disconnected)
+                self.args.pop(include_disconnected)
                 self.include_disconnected = True
 
         def get_airfoil():
@@ -436,15 +603,26 @@ class AirfoilCli:
                 try:
                     self.airfoil_name = self.get_param(airfoil_name, [ValueError('parameter requires name')])
                 except ValueError:
-                    print(f'Error: \'{args[airfoil_name]}\' requires a name.')
+                    print(f'Error: \'{self.args[airfoil_name]}\' requires a name.')
 
             airfoil_ip = in_args(AIRFOIL_IP)
             if airfoil_ip:
                 try:
                     self.airfoil_ip = self.get_param(airfoil_ip, [ValueError('parameter requires ip')])
                 except ValueError:
-                    print(f'Error: \'{args[airfoil_ip]}\' requires an ip.')
-            self.get_airfoil(in_args(AIRFOIL_NAME), in_args(AIRFOIL_IP))
+                    print(f'Error: \'{self.args[airfoil_ip]}\' requires an ip.')
+
+            airfoil_port = in_args(AIRFOIL_PORT)
+            if airfoil_port:
+                try:
+                    self.airfoil_port = int(self.get_param(airfoil_port, [ValueError('parameter requires port')]))
+                except ValueError:
+                    print(f'Error: \'{self.args[airfoil_port]}\' requires a port number.')
+                    sys.exit(1)
+                if not self.airfoil_ip:
+                    print('Error: a port can only be given together with -i|--ip.')
+                    sys.exit(1)
+            self.get_airfoil()
 
         def get_print_mode():
             table = in_args(TABLE)
@@ -454,54 +632,85 @@ class AirfoilCli:
                 if table:
                     print('Specify only one print method from these options: table, list, json. Showing table.')
                     self.print_mode = 'table'
-                    args.pop(table)
+                    self.args.pop(table)
                 elif list:
                     print('Specify only one print method from these options: table, list, json. Showing list.')
                     self.print_mode = 'list'
 
                 if list:
-                    args.pop(list)
+                    self.args.pop(list)
                 if json:
-                    args.pop(json)
+                    self.args.pop(json)
             else:
                 if table:
                     self.print_mode = 'table'
-                    args.pop(table)
+                    self.args.pop(table)
                 if json:
                     self.print_mode = 'json'
-                    args.pop(json)
+                    self.args.pop(json)
                 if list:
                     self.print_mode = 'list'
-                    args.pop(list)
+                    self.args.pop(list)
 
-        def get_speakers():
-            requested_speakers = []
-            for arg in args[1:]:
+        def speaker_args():
+            # one speaker per argument, or a comma separated list of them, where [keywords] groups are matched by
+            # keywords. a group the shell split at its spaces, like [living room], is joined back together
+            joined = []
+            for arg in self.args[1:]:
                 if arg in ALL_ACTIONS:
                     break
+                if joined and joined[-1].count('[') > joined[-1].count(']'):
+                    joined[-1] += ' ' + arg
+                else:
+                    joined.append(arg)
+            for arg in joined:
+                part = ''
+                for ch in arg + ',':
+                    if ch == ',' and part.count('[') <= part.count(']'):
+                        if part.strip():
+                            yield part.strip()
+                        part = ''
+                    else:
+                        part += ch
+
+        def get_speakers():
+            # every argument is looked up in one read of the speakers, instead of reading them again for each one
+            requested, every = [], None
+            for arg in speaker_args():
                 if arg in ALL_SPEAKERS:
-                    self.speakers = 'all'
+                    every = every or arg
+                    continue
                 try:
                     self.parse_volume(arg)
                     self.actions.append(['volume', float(self.volume)])
-                    return
+                    break
                 except ValueError:
-                    arg = arg.replace('_', ' ')
-                    found = self.airfoil.find_speaker(unknown=arg)
-                    if found:
-                        requested_speakers.append(found)
-                    elif arg not in ALL_SPEAKERS:
-                        print(f'Error: \'{arg}\' is not a recognized speaker or action ')
-                        sys.exit(1)
-            if self.speakers in ALL_SPEAKERS:
-                    speakers = self.airfoil.get_speakers()
-                    self.speakers = [s for s in speakers if s.connected or self.include_disconnected]
-                    if requested_speakers:
-                        self.speakers += requested_speakers
+                    requested.append(arg)
+            if not requested and not every:
+                return
+            speakers = self.airfoil.get_speakers()
+            found = []
+            for arg in requested:
+                if arg.startswith('[') and arg.endswith(']'):
+                    try:
+                        match = self.airfoil.find_speaker(keywords=self.airfoil.get_keywords(arg[1:-1]),
+                                                          speakers=speakers)
+                    except ValueError:
+                        match = None
+                else:
+                    match = self.airfoil.find_speaker(unknown=arg.replace('_', ' '), speakers=speakers)
+                if not match:
+                    print(f'Error: \'{arg}\' is not a recognized speaker or action ')
+                    sys.exit(1)
+                found.append(match)
+            # 'all' adds every connected speaker to the ones named, while 'speakers' only introduces a list of them
+            if every == 'all' or not found:
+                found = [s for s in speakers if s.connected or self.include_disconnected] + found
+            self.speakers = list({s.id: s for s in found}.values())
 
         def get_actions():
             action = []
-            for arg in args:
+            for arg in self.args:
                 if arg in ALL_ACTIONS:
                     if action:
                         self.actions.append(action)
@@ -526,6 +735,10 @@ class AirfoilCli:
 
         for action in self.actions:
             cmd = action[0]
+            if cmd in WATCH:
+                # watch runs until interrupted and its output is meant for other programs, so it is not logged
+                self.watch(action[1:])
+                continue
             action_str = " ".join([str(a) for a in action])
             log_entry = f'Starting command: \'{action_str}\''.ljust(ACTION_LOG_WIDTH)
             print(log_entry, end='', flush=True)
@@ -582,32 +795,40 @@ class AirfoilCli:
                         self.help(cmd)
             if cmd in SOURCES:
                 self.get_sources()
+            if cmd in SCENE:
+                too_many_params(action, 3)
+                if len(action) == 1:
+                    print('scene requires the name of a scene')
+                    self.help(cmd, status=1)
+                self.scene(action[1], action[2] if len(action) == 3 else None)
+            if cmd in SCENES:
+                too_many_params(action, 1)
+                self.list_scenes()
             if cmd in FADE:
                 too_many_params(action, 4)
                 if len(action) == 1:
                     self._level_error('fade')
-                    self.help('fade')
-                    sys.exit(1, status=1)
+                    self.help('fade', status=1)
                 try:
                     self.parse_volume(action[1])
                 except ValueError:
                     print(f'Error in action: {action_str}\n'
                           f' \'{action[1]}\' is not a valid value for volume')
-                    self.help(cmd, status=1)
+                    self.help('fade', status=1)
                 if len(action) > 2:
                     try:
                         self.seconds = abs(float(action[2]))
                     except ValueError:
                         print(f'Error in action: {action_str}\n'
                               f' \'{action[2]}\' is not a valid value for seconds parameter.')
-                        self.help(cmd, status=1)
+                        self.help('fade', status=1)
                 if len(action) == 4:
                     try:
                         self.ticks = abs(int(action[3]))
                     except ValueError:
                         print(f'Error: \'{action[3]}\' is not a valid value for ticks parameter. '
                               f'Ticks must be a whole number.')
-                        self.help(cmd, status=1)
+                        self.help('fade', status=1)
                 self.fade()
             print('[complete]')
         if self.source:
@@ -616,9 +837,204 @@ class AirfoilCli:
             self.print_speakers()
 
 
-if __name__ == '__main__':
+def main(argv=None, new_airfoil=Airfoil):
+    """
+    run one cli command.
+    :return:    exit status
+    """
     try:
-        a = AirfoilCli()
+        AirfoilCli(argv, new_airfoil)
     except KeyboardInterrupt:
         pass
-    # print(a.__dict__)
+    except AirfoilTimeoutError as e:
+        # ends the 'Starting command' line of the command that was running
+        print(f'[timed out]\nError: {e}')
+        return 1
+    return 0
+
+
+class ScriptOutput(object):
+    """
+    stands in for sys.stdout while script steps, or daemon commands, run, so what each thread prints goes to its own
+    buffer. Threads without a buffer print to stream.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffers = {}
+
+    def write(self, text):
+        self.buffers.get(threading.get_ident(), self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+# words of a step that name neither a speaker nor an instance
+STEP_WORDS = set(ALL_ARGS + INCLUDE_DISCONNECTED + TABLE + JSON + LIST + ['speaker'])
+# commands that act on the whole instance rather than on the speakers they name
+HOST_CMDS = set(PLAY + NEXT + LAST + CURR_SOURCE + SOURCES + SCENE + SCENES + WATCH + ['all'])
+
+
+def step_targets(argv):
+    """
+    step_targets tells which instance and speakers a script step acts on, so steps that share any can be run in order.
+    :param argv:    list of the step's command line arguments, without the program name
+    :return:        tuple of (host, speakers). host is a tuple of the name, ip and port given, or None for the instance
+                    found first. speakers is a set of the words that can name a speaker, or None if the step acts on
+                    the whole instance, or on speakers it does not name.
+    """
+    import re
+    args, host, words = parse_args(argv), {}, set()
+    skip = False
+    for i, arg in enumerate(args):
+        if skip:
+            skip = False
+        elif arg in AIRFOIL_NAME + AIRFOIL_IP + AIRFOIL_PORT:
+            flag = 'name' if arg in AIRFOIL_NAME else 'ip' if arg in AIRFOIL_IP else 'port'
+            host[flag] = args[i + 1] if i + 1 < len(args) else None
+            skip = True
+        elif arg in TIMEOUT:
+            skip = True
+        elif arg in HOST_CMDS:
+            words = None
+        elif words is not None and arg not in STEP_WORDS:
+            # speaker lists are comma separated, and keywords may be in brackets
+            words.update(w for w in re.split(r'[\s,\[\]]+', arg) if w and not re.fullmatch(r'[\d.]+%?', w))
+    host = tuple(host.get(flag) for flag in ('name', 'ip', 'port')) if host else None
+    return host, (words or None)
+
+
+def step_chains(steps):
+    """
+    step_chains splits the steps of a script into chains that can run at the same time. Steps that act on the same
+    speaker, or on an instance another step acts on as a whole, are in the same chain, in the order of the script.
+    Steps that don't say which instance they are for may be for any of them.
+    :param steps:   list of argv lists
+    :return:        list of lists of indexes into steps, each in ascending order
+    """
+    def overlap(a, b):
+        (host_a, speakers_a), (host_b, speakers_b) = a, b
+        if host_a is not None and host_b is not None and host_a != host_b:
+            return False
+        return speakers_a is None or speakers_b is None or bool(speakers_a & speakers_b)
+
+    chains = []  # list of (indexes, targets of those steps)
+    for i, step in enumerate(steps):
+        targets = step_targets(step)
+        joined = [chain for chain in chains if any(overlap(targets, other) for other in chain[1])]
+        chains = [chain for chain in chains if chain not in joined]
+        indexes = sorted(index for chain in joined for index in chain[0]) + [i]
+        chains.append((indexes, [t for chain in joined for t in chain[1]] + [targets]))
+    return sorted((indexes for indexes, _ in chains), key=lambda indexes: indexes[0])
+
+
+def run_script(lines, new_airfoil=Airfoil):
+    """
+    run a script of cli commands in one process. Steps are run in parallel until a line that only holds a wait
+    command, which waits for them all to finish and then sleeps. Steps that act on the same speakers, or on an instance
+    as a whole, run one after the other in the order of the script, see step_chains. Each instance is found once and
+    its speakers are read once; after that, every step updates the speakers it changed in Airfoil.state for the steps
+    after it.
+    If a step fails, the steps after it in its chain are skipped, the other chains finish, and the script stops.
+    :param lines:       iterable of command lines, without the program name. blank lines and lines starting with #
+                        are skipped.
+    :param new_airfoil: callable taking the same arguments as Airfoil and returning an Airfoil object
+    :return:            exit status, the first non-zero status of a step
+    """
+    import io, shlex
+    from concurrent.futures import ThreadPoolExecutor
+    from remoteFoil.airfoil_state import AirfoilState
+    airfoils = {}
+    lock = threading.Lock()
+
+    def kept_airfoil(**kwargs):
+        key = tuple(sorted(kwargs.items()))
+        with lock:
+            if key not in airfoils:
+                airfoil = new_airfoil(**kwargs)
+                airfoil.state = AirfoilState()
+                airfoil.state.load_speakers(airfoil.get_speakers(fresh=True))
+                airfoil.state.live = True
+                airfoils[key] = airfoil
+        return airfoils[key]
+
+    def run_step(argv):
+        status, cli = 0, None
+        try:
+            cli = AirfoilCli([sys.argv[0]] + argv, kept_airfoil)
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 1
+        except (AirfoilTimeoutError, OSError, ValueError) as e:
+            print(f'Error: {e}')
+            status = 1
+        if cli and cli.airfoil and type(cli.speakers) is list:
+            for speaker in cli.speakers:
+                cli.airfoil.state.update_speaker(speaker.id, connected=speaker.connected, volume=speaker.volume)
+        return status or 0
+
+    def run_steps(steps):
+        output = ScriptOutput(sys.stdout)
+
+        def run(step):
+            output.buffers[threading.get_ident()] = buffer = io.StringIO()
+            try:
+                return run_step(step), buffer.getvalue()
+            finally:
+                del output.buffers[threading.get_ident()]
+        def run_chain(chain):
+            # a failed step ends its chain, like it ends the script
+            for i in chain:
+                results[i] = run(steps[i])
+                if results[i][0]:
+                    return
+
+        chains = step_chains(steps)
+        results = [(0, None)] * len(steps)
+        stdout, sys.stdout = sys.stdout, output
+        try:
+            with ThreadPoolExecutor(max_workers=len(chains)) as pool:
+                list(pool.map(run_chain, chains))
+        finally:
+            sys.stdout = stdout
+        for step, (status, printed) in zip(steps, results):
+            if printed is None:
+                continue
+            print(f'> {" ".join(step)}')
+            print(printed, end='' if printed.endswith('\n') else '\n')
+        return next((status for status, _ in results if status), 0)
+
+    steps = []
+    for line in lines:
+        argv = shlex.split(line, comments=True)
+        if not argv:
+            continue
+        if len(argv) == 2 and argv[0].lower() in WAIT:
+            status = run_steps(steps) if steps else 0
+            if status:
+                return status
+            steps = []
+            try:
+                time.sleep(float(argv[1]))
+            except ValueError:
+                print(f'Error: \'{line.strip()}\' requires a positive number of seconds to wait.')
+                return 1
+            continue
+        steps.append(argv)
+    return run_steps(steps) if steps else 0
+
+
+if __name__ == '__main__':
+    import airfoil_daemon
+    if len(args) > 1 and args[1] in DAEMON:
+        airfoil_daemon.start()
+        sys.exit(0)
+    if len(args) > 1 and args[1] in SCRIPT:
+        # scripts run here, where their file and stdin are, and are one process already
+        if len(sys.argv) > 2 and sys.argv[2] != '-':
+            with open(sys.argv[2]) as f:
+                sys.exit(run_script(f.readlines()))
+        sys.exit(run_script(sys.stdin))
+    # with no arguments the cli browses for instances until interrupted, and watch streams until interrupted, which
+    # only make sense in this process
+    status = airfoil_daemon.forward(sys.argv) if len(args) > 1 and not set(args) & set(WATCH) else None
+    sys.exit(main() if status is None else status)
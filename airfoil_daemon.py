@@ -0,0 +1,168 @@
+"""
+    cli daemon -> keep running, and answer cli commands sent over a unix socket
+
+    While the daemon runs, airfoil_cli.py sends its commands to it instead of running them itself. The daemon keeps
+    the Airfoil instances it has found and a live copy of their speakers, kept current from Airfoil's notifications,
+    so commands skip the network discovery and speaker list reads that would otherwise start every one of them.
+    The socket is ~/.remotefoil/cli.sock, or the path in REMOTEFOIL_SOCKET. Set REMOTEFOIL_SOCKET to an empty string
+    to always run commands in the cli itself.
+"""
+import io, os, socket, sys, threading
+
+SOCKET_FILE = os.environ.get('REMOTEFOIL_SOCKET', os.path.join(os.path.expanduser('~'), '.remotefoil', 'cli.sock'))
+MAX_MESSAGE = 1 << 20
+
+
+def _send(sock, message):
+    # json is imported here, so a cli that finds no daemon running does not pay for it
+    import json
+    sock.sendall(json.dumps(message).encode() + b'\n')
+
+
+def _receive(sock):
+    import json
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = sock.recv(65536)
+        if not chunk or len(data) > MAX_MESSAGE:
+            raise ConnectionError('connection closed before a whole message was received')
+        data += chunk
+    return json.loads(data)
+
+
+def forward(argv, path=SOCKET_FILE):
+    """
+    forward sends a cli command to a running daemon and prints what it printed.
+    :param argv:    list of command line arguments, as in sys.argv
+    :param path:    path of the daemon's socket
+    :return:        the exit status of the command, or None if no daemon is running, in which case the cli should
+                    run the command itself
+    """
+    if not path or not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return None
+    with socket.socket(socket.AF_UNIX) as sock:
+        try:
+            sock.connect(path)
+        except OSError:
+            return None
+        _send(sock, {'argv': argv})
+        reply = _receive(sock)
+    print(reply['output'], end='', flush=True)
+    return reply['status']
+
+
+class AirfoilDaemon(object):
+    """
+    AirfoilDaemon runs cli commands sent to it over a unix socket, with Airfoil objects it keeps between commands.
+    Each Airfoil object gets an AirfoilState as Airfoil.state, kept current by a thread following Airfoil.watch, so
+    speaker lookups are answered from memory. What a command prints is sent back to the cli that sent it, and
+    commands run one at a time, since they share the Airfoil objects.
+    """
+    def __init__(self, path=SOCKET_FILE):
+        self.path = path
+        self.airfoils = {}
+        self.lock = threading.Lock()
+        self.running = threading.Lock()
+        self.output = None
+
+    def airfoil(self, **kwargs):
+        """
+        AirfoilDaemon.airfoil is passed to the cli as its way to create Airfoil objects. It returns the Airfoil object
+        created for the same arguments before, or creates one and starts mirroring its state.
+        """
+        from remoteFoil.airfoil import Airfoil
+        from remoteFoil.airfoil_state import AirfoilState
+        key = tuple(sorted(kwargs.items()))
+        with self.lock:
+            airfoil = self.airfoils.get(key)
+            if airfoil is None:
+                airfoil = self.airfoils[key] = Airfoil(**kwargs)
+                airfoil.state = AirfoilState()
+                threading.Thread(target=self._watch, args=(key, airfoil), daemon=True).start()
+        return airfoil
+
+    def _watch(self, key, airfoil):
+        try:
+            for message in airfoil.watch():
+                airfoil.state.handle(message)
+                airfoil.state.live = True
+        except OSError:
+            pass
+        finally:
+            # the next command for this instance starts over
+            airfoil.state.live = False
+            with self.lock:
+                if self.airfoils.get(key) is airfoil:
+                    del self.airfoils[key]
+
+    def run(self, argv):
+        """
+        run one cli command the way airfoil_cli.py would.
+        :param argv:    list of command line arguments, as in sys.argv
+        :return:        tuple of everything the command printed and its exit status
+        """
+        import airfoil_cli
+        output = io.StringIO()
+        with self.running:
+            if self.output is None:
+                # only the thread running a command prints into its buffer, not the threads following Airfoil.watch
+                self.output = sys.stdout = airfoil_cli.ScriptOutput(sys.stdout)
+            self.output.buffers[threading.get_ident()] = output
+            try:
+                status = airfoil_cli.main(argv, self.airfoil)
+            except SystemExit as e:
+                status = e.code if isinstance(e.code, int) else 1
+            except Exception as e:
+                print(f'Error: {e!r}')
+                status = 1
+            finally:
+                del self.output.buffers[threading.get_ident()]
+        return output.getvalue(), status or 0
+
+    def _client(self, conn):
+        with conn:
+            try:
+                argv = _receive(conn)['argv']
+                output, status = self.run(argv)
+                _send(conn, {'output': output, 'status': status})
+            except (OSError, ValueError, KeyError):
+                pass
+
+    def serve(self):
+        """listen on the socket and run the commands sent to it until interrupted."""
+        if os.path.exists(self.path):
+            with socket.socket(socket.AF_UNIX) as sock:
+                try:
+                    sock.connect(self.path)
+                    raise OSError(f'a daemon is already listening on {self.path}')
+                except ConnectionRefusedError:
+                    os.unlink(self.path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with socket.socket(socket.AF_UNIX) as server:
+            server.bind(self.path)
+            os.chmod(self.path, 0o600)
+            server.listen()
+            print(f'Listening for cli commands on {self.path}. Press ctrl-c to exit.')
+            try:
+                while True:
+                    conn, _ = server.accept()
+                    threading.Thread(target=self._client, args=(conn,), daemon=True).start()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os.unlink(self.path)
+
+
+def start(path=SOCKET_FILE):
+    if not hasattr(socket, 'AF_UNIX'):
+        print('Error: the daemon needs unix sockets, which this system does not have.')
+        sys.exit(1)
+    try:
+        AirfoilDaemon(path).serve()
+    except OSError as e:
+        print(f'Error: {e}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    start()
@@ -1,369 +1,813 @@
-from flask import Flask, jsonify, request, g
+import asyncio, base64, contextlib, hashlib, json, math, re, sys, time
+from urllib.parse import urlsplit, parse_qsl, unquote
+from remoteFoil.airfoil import AirfoilTimeoutError, RESYNCED, deadline
+from remoteFoil.airfoil_async import AsyncAirfoil
 from remoteFoil.airfoil_finder import AirfoilFinder
-import sys
+from remoteFoil.scenes import SceneStore
+
 finder = None
-app = Flask(__name__)
+scenes = None
+airfoils = {}
+routes = []
 TRUTHIES = ['true', 'yes', 'y', 't', '1', 'on', 'enabled']
+FALSIES = ['', 'false', 'no', 'n', 'f', '0', 'off', 'disabled']
+STATUS_TEXT = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error',
+               503: 'Service Unavailable', 504: 'Gateway Timeout'}
+MAX_HEADER_LINES = 100
+EVENT_BACKLOG = 1000
+EVENT_KEEPALIVE = 15
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+class Request(object):
+    """
+    A parsed HTTP request. The query parameters shared by the speaker routes are parsed into attributes, the same way
+    for every request, so the route handlers can read them directly.
+    """
+    def __init__(self, method, target, headers, body=b''):
+        self.method = method
+        self.target = target
+        self.headers = headers
+        self.body = body
+        url = urlsplit(target)
+        self.path = unquote(url.path)
+        self.args = dict(parse_qsl(url.query, keep_blank_values=True))
+        self.disconnected = False
+        self.names = []
+        self.ids = []
+        self.volume = None
+        self.seconds = 3
+        self.ticks = 10
+        self.action = None
+        for k, v in self.args.items():
+            newk = k.lower()
+            newv = v.lower()
+            if newk == 'ids':
+                self.ids = [i for i in newv.split(',') if i]
+            if newk == 'names':
+                self.names = [n for n in newv.split(',') if n]
+            if newk in ['disconnected', 'all']:
+                self.disconnected = newv in TRUTHIES
+            if newk in ['end_volume', 'level', 'volume']:
+                self.volume = newv
+            if newk == 'seconds':
+                self.seconds = newv
+            if newk == 'ticks':
+                self.ticks = newv
+            if newk == 'action':
+                self.action = newv
+
+
+class Response(object):
+    def __init__(self, payload, status=200, headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self.body = json.dumps(payload).encode() if status != 304 else b''
+
+    async def send(self, writer, keep_alive):
+        headers = {'Content-Length': str(len(self.body)), 'Connection': 'keep-alive' if keep_alive else 'close'}
+        if self.body:
+            headers['Content-Type'] = 'application/json'
+        headers.update(self.headers)
+        head = f'HTTP/1.1 {self.status} {STATUS_TEXT.get(self.status, "")}\r\n' + \
+               ''.join(f'{k}: {v}\r\n' for k, v in headers.items()) + '\r\n'
+        writer.write(head.encode('latin-1') + self.body)
+        await writer.drain()
+
+
+class EventStream(object):
+    """
+    A response that keeps the client connection open and pushes the notifications Airfoil sends to the client, as
+    server-sent events, or as websocket text messages if the request asked to upgrade to a websocket. Every stream for
+    an Airfoil instance is fed from the one subscribed connection its AsyncAirfoil keeps open, so streams cost nothing
+    on the Airfoil host.
+
+    - the first event is a snapshot of the speakers and current source, so a client does not miss changes made between
+      reading the state and opening the stream.
+    - types limits the stream to the given notification types, and speakers to notifications about the given speaker
+      ids. Notifications that are not about one speaker, like sourceMetadataChanged, are not limited by speakers.
+    - when the connection to Airfoil drops and is restored, notifications may have been missed, so every client gets
+      a resynced event with a new snapshot, whatever its types.
+    - a client that falls more than EVENT_BACKLOG notifications behind is disconnected.
+    """
+    def __init__(self, req, airfoil, types=[], speakers=[]):
+        self.airfoil = airfoil
+        self.types = [t.lower() for t in types]
+        self.speakers = speakers
+        self.websocket = req.headers.get('upgrade', '').lower() == 'websocket'
+        self.key = req.headers.get('sec-websocket-key', '')
+        self.queue = asyncio.Queue(EVENT_BACKLOG)
+        self.closed = False
+
+    def wants(self, message):
+        id = (message.get('data') or {}).get('longIdentifier')
+        if message.get('request') == RESYNCED:
+            return True
+        return (not self.types or message.get('request', '').lower() in self.types) and \
+               (not self.speakers or not id or id in self.speakers)
+
+    def listener(self, message):
+        if self.closed or not self.wants(message):
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.closed = True
+
+    def _event(self, message):
+        if message.get('request') == RESYNCED:
+            return dict(self._snapshot(), event=RESYNCED)
+        data = message.get('data') or {}
+        event = {'event': message.get('request'), 'data': data}
+        speaker = self.airfoil.state.speakers.get(data.get('longIdentifier'))
+        if speaker:
+            event['speaker'] = speaker._asdict()
+        return event
+
+    def _snapshot(self):
+        state = self.airfoil.state
+        speakers = [s for s in state.speakers.values() if not self.speakers or s.id in self.speakers]
+        source = state.current_source._asdict() if state.current_source else None
+        return {'event': 'snapshot', 'data': {'speakers': [s._asdict() for s in speakers], 'current_source': source}}
+
+    @staticmethod
+    def _frame(payload, opcode=0x1):
+        # server frames are never masked
+        size = len(payload)
+        if size < 126:
+            head = bytes([0x80 | opcode, size])
+        elif size < 65536:
+            head = bytes([0x80 | opcode, 126]) + size.to_bytes(2, 'big')
+        else:
+            head = bytes([0x80 | opcode, 127]) + size.to_bytes(8, 'big')
+        return head + payload
+
+    @staticmethod
+    async def _read_frame(reader):
+        first, second = await reader.readexactly(2)
+        size = second & 0x7f
+        if size == 126:
+            size = int.from_bytes(await reader.readexactly(2), 'big')
+        elif size == 127:
+            size = int.from_bytes(await reader.readexactly(8), 'big')
+        mask = await reader.readexactly(4) if second & 0x80 else b''
+        payload = await reader.readexactly(size)
+        if mask:
+            payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        return first & 0x0f, payload
+
+    async def _open(self, writer):
+        if self.websocket:
+            accept = base64.b64encode(hashlib.sha1((self.key + WEBSOCKET_GUID).encode()).digest()).decode()
+            head = f'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n' \
+                   f'Sec-WebSocket-Accept: {accept}\r\n\r\n'
+        else:
+            head = 'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n' \
+                   'Connection: keep-alive\r\n\r\n'
+        writer.write(head.encode('latin-1'))
 
+    async def _send(self, writer, event):
+        if self.websocket:
+            writer.write(self._frame(json.dumps(event).encode()))
+        else:
+            writer.write(f'id: {self.airfoil.state.version}\nevent: {event["event"]}\n'
+                         f'data: {json.dumps(event)}\n\n'.encode())
+        await writer.drain()
+
+    async def _keepalive(self, writer):
+        writer.write(self._frame(b'', 0x9) if self.websocket else b': keepalive\n\n')
+        await writer.drain()
+        if not self.airfoil.state.live:
+            try:
+                await self.airfoil.connect()
+            except OSError:
+                pass
 
-def _error(name, caller, reason):
-    url = request.url.replace(request.url_root[:-1], '')
-    return {'status': 'fail', 'action': caller, 'url': url, 'name': name, 'reason': reason}
-
-def _success(name, caller):
-    url = request.url.replace(request.url_root[:-1], '')
-    return {'status': 'success', 'action': caller, 'url': url, 'name': name}
-
-
-@app.route('/')
-def get_airfoils():
-    airfoils = []
-    for af in finder.airfoils.values():
-        airfoils.append({'name': af.name, 'ip': af.ip})
-    return jsonify({'airfoils': airfoils})
-
-@app.before_request
-def _get_args():
-    g.disconnected = False
-    g.names = []
-    g.ids = []
-    g.volume = None
-    g.seconds = 3
-    g.ticks = 10
-    g.action = None
-    for k, v in request.args.items():
-        newk = k.lower()
-        newv = v.lower()
-        if newk == 'ids':
-            g.ids = [i for i in newv.split(',') if i]
-        if newk == 'names':
-            g.names = [n for n in newv.split(',') if n]
-        if newk in ['disconnected', 'all']:
-            g.disconnected = newv in TRUTHIES
-        if newk in ['end_volume', 'level', 'volume']:
-            g.volume = newv
-        if newk == 'seconds':
-            g.seconds = newv
-        if newk == 'ticks':
-            g.ticks = newv
-        if newk == 'action':
-            g.action = newv
-
-
-def _parse_speaker_cmd(name, speaker, functions):
-    if speaker == 'speakers':
-        speakers = [c._asdict() for c in _airfoil_cmd(name, functions['multi'])]
-    else:
-        speakers = [c._asdict() for c in _airfoil_cmd(name, functions['specific'], speaker=speaker)]
+    async def _read_client(self, reader, writer):
+        # the only thing read from the client is whether it is still there, and for websockets, pings and closes
+        try:
+            while True:
+                if not self.websocket:
+                    if not await reader.read(1024):
+                        break
+                    continue
+                opcode, payload = await self._read_frame(reader)
+                if opcode == 0x8:
+                    writer.write(self._frame(payload[:2], 0x8))
+                    break
+                if opcode == 0x9:
+                    writer.write(self._frame(payload, 0xa))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.closed = True
+            try:
+                self.queue.put_nowait(None)
+            except asyncio.QueueFull:
+                pass
+
+    async def run(self, reader, writer):
+        """send events to the client until it goes away or falls too far behind."""
+        await self._open(writer)
+        self.airfoil.state.listeners.append(self.listener)
+        client = asyncio.ensure_future(self._read_client(reader, writer))
+        try:
+            await self._send(writer, self._snapshot())
+            while not self.closed:
+                try:
+                    message = await asyncio.wait_for(self.queue.get(), EVENT_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    await self._keepalive(writer)
+                    continue
+                if message is not None and not self.closed:
+                    await self._send(writer, self._event(message))
+        except ConnectionError:
+            pass
+        finally:
+            self.airfoil.state.listeners.remove(self.listener)
+            client.cancel()
+
+
+class GatewayError(Exception):
+    def __init__(self, payload, status=404, headers=None):
+        super().__init__(payload.get('reason'))
+        self.payload = payload
+        self.status = status
+        self.headers = headers
+
+
+def route(*patterns):
+    """
+    register a coroutine as the handler for the given url patterns. <arg> matches one path segment, which is passed
+    to the handler as a keyword argument. A trailing slash is always optional.
+    """
+    def register(handler):
+        for pattern in patterns:
+            regex = re.sub(r'<(\w+)>', r'(?P<\1>[^/]+)', pattern.rstrip('/'))
+            routes.append((re.compile(f'^{regex}/?$'), handler))
+        return handler
+    return register
+
+
+def jsonify(payload, status=200):
+    return Response(payload, status)
+
+
+def cached(req, payload):
+    """
+    jsonify for the read routes. The response carries an ETag for its content, and if the request's If-None-Match
+    header already holds that tag, an empty 304 response is returned instead.
+    """
+    response = Response(payload)
+    etag = '"' + hashlib.sha1(response.body).hexdigest()[:20] + '"'
+    response.headers.update({'ETag': etag, 'Cache-Control': 'no-cache'})
+    tags = [t.strip().replace('W/', '') for t in req.headers.get('if-none-match', '').split(',')]
+    if etag in tags or '*' in tags:
+        return Response(None, 304, response.headers)
+    return response
+
+
+def _stale(req, loaded):
+    """
+    the read routes are answered from the live state mirror, which is kept current by notifications. Passing
+    ?max_age=<seconds> asks for the state to be read from Airfoil again if it was last read in full longer ago than
+    that; max_age=0 always reads it again.
+    """
+    if 'max_age' not in req.args:
+        return False
+    try:
+        return time.time() - loaded > float(req.args['max_age'])
+    except ValueError:
+        raise GatewayError(_error(req, req.path.split('/')[1], 'max_age',
+                                  f'max_age must be a number of seconds, not \'{req.args["max_age"]}\''), 400)
+
+
+def _error(req, name, caller, reason):
+    return {'status': 'fail', 'action': caller, 'url': req.target, 'name': name, 'reason': reason}
+
+
+def _success(req, name, caller):
+    return {'status': 'success', 'action': caller, 'url': req.target, 'name': name}
+
+
+def _airfoil(req, name, contact=True):
     caller = sys._getframe(1).f_code.co_name
-    result = _success(name, caller)
-    result['speakers'] = speakers
-    return jsonify(result)
+    airfoil = airfoils.get(name.lower(), None)
+    if not airfoil:
+        raise GatewayError(_error(req, name, caller, f'No remoteFoil instance found with name \'{name}\''))
+    if contact and not airfoil.health.available():
+        # the host failed its last calls; answer right away instead of waiting on it until it recovers
+        retry_in = max(1, math.ceil(airfoil.health.retry_in()))
+        raise GatewayError(dict(_error(req, name, caller, f'remoteFoil instance \'{name}\' is not answering'),
+                                health=airfoil.health.as_dict()), 503, {'Retry-After': str(retry_in)})
+    return airfoil
+
+
+@route('/')
+async def get_airfoils(req):
+    return jsonify({'airfoils': [{'name': af.name, 'ip': af.ip, 'health': af.health.as_dict()}
+                                 for af in airfoils.values()]})
 
 
-def _airfoil_cmd(name, cmd, speaker=None):
+async def _parse_speaker_cmd(req, name, speaker, functions):
     caller = sys._getframe(1).f_code.co_name
-    name = name.lower()
-    airfoil = finder.airfoils.get(name, None)
-    if airfoil:
-        if not speaker:
-            return cmd(airfoil)
-        else:
-            match = airfoil.find_speaker(unknown=speaker)
-            if match:
-                return cmd(airfoil, match)
-            else:
-                return _error(name, caller, f'No speaker found with name, id, or keywords: \'{speaker}\'')
+    airfoil = _airfoil(req, name)
+    await airfoil.connect()
+    if speaker == 'speakers':
+        speakers = await functions['multi'](airfoil)
     else:
-        return _error(name, caller, f'No remoteFoil instance found with name \'{name}\'')
+        match = airfoil.state.find_speaker(unknown=speaker)
+        if not match:
+            return jsonify(_error(req, name, caller, f'No speaker found with name, id, or keywords: \'{speaker}\''))
+        speakers = await functions['specific'](airfoil, match)
+    result = _success(req, name, caller)
+    result['speakers'] = [s._asdict() for s in speakers]
+    return jsonify(result)
 
 
-def _media_button(name, cmd):
+async def _media_button(req, name, cmd):
     caller = sys._getframe(1).f_code.co_name
     cmds = {
         'play': lambda airfoil: airfoil.play_pause(),
         'next': lambda airfoil: airfoil.next_track(),
         'back': lambda airfoil: airfoil.last_track()
     }
-    source = _airfoil_cmd(name, lambda airfoil: airfoil.get_current_source())
+    airfoil = _airfoil(req, name)
+    source = await airfoil.get_current_source()
     if not source.source_controllable:
-        response = _error(name, caller, 'current source does not support remote control by Airfoil')
+        response = _error(req, name, caller, 'current source does not support remote control by Airfoil')
     else:
-        result = _airfoil_cmd(name, cmds[cmd])
-        if result:
-            response = _success(name, caller)
-            source = _airfoil_cmd(name, lambda airfoil: airfoil.get_current_source())
+        if await cmds[cmd](airfoil):
+            response = _success(req, name, caller)
+            source = await airfoil.get_current_source()
         else:
-            response = _error(name, caller, 'unknown')
+            response = _error(req, name, caller, 'unknown')
     response['current_source'] = source._asdict()
     return jsonify(response)
 
 
-@app.route('/<name>/')
-@app.route('/<name>')
-def get_airfoil(name):
-    return jsonify(_airfoil_cmd(name, lambda airfoil: {'remoteFoil': {'name': airfoil.name, 'ip': airfoil.ip}}))
-
-
-@app.route('/<name>/pause/')
-@app.route('/<name>/pause')
-@app.route('/<name>/play/')
-@app.route('/<name>/play')
-@app.route('/<name>/play_pause/')
-@app.route('/<name>/play_pause')
-def play_pause(name):
-    return _media_button(name, 'play')
-
-
-@app.route('/<name>/skip/')
-@app.route('/<name>/skip')
-@app.route('/<name>/next/')
-@app.route('/<name>/next')
-@app.route('/<name>/next_track/')
-@app.route('/<name>/next_track')
-def next_track(name):
-    return _media_button(name, 'next')
-
-
-@app.route('/<name>/prev/')
-@app.route('/<name>/prev')
-@app.route('/<name>/last/')
-@app.route('/<name>/last')
-@app.route('/<name>/back/')
-@app.route('/<name>/back')
-@app.route('/<name>/prev_track/')
-@app.route('/<name>/prev_track')
-@app.route('/<name>/last_track/')
-@app.route('/<name>/last_track')
-def last_track(name):
-    return _media_button(name, 'back')
-
-
-@app.route('/<name>/sources/')
-@app.route('/<name>/sources')
-def get_sources(name):
-    source_icon = request.args.get('source_icon', '').lower() in TRUTHIES
-    sources = _airfoil_cmd(name, lambda airfoil: airfoil.get_sources(source_icon))
+@route('/<name>')
+async def get_airfoil(req, name):
+    airfoil = _airfoil(req, name)
+    return jsonify({'remoteFoil': {'name': airfoil.name, 'ip': airfoil.ip}})
+
+
+@route('/<name>/pause', '/<name>/play', '/<name>/play_pause')
+async def play_pause(req, name):
+    return await _media_button(req, name, 'play')
+
+
+@route('/<name>/skip', '/<name>/next', '/<name>/next_track')
+async def next_track(req, name):
+    return await _media_button(req, name, 'next')
+
+
+@route('/<name>/prev', '/<name>/last', '/<name>/back', '/<name>/prev_track', '/<name>/last_track')
+async def last_track(req, name):
+    return await _media_button(req, name, 'back')
+
+
+@route('/<name>/sources')
+async def get_sources(req, name):
+    source_icon = req.args.get('source_icon', '').lower() in TRUTHIES
+    sources = await _airfoil(req, name).get_sources(source_icon)
     return jsonify([s._asdict() for s in sources])
 
 
-@app.route('/<name>/current_source/')
-@app.route('/<name>/current_source')
-@app.route('/<name>/source/')
-@app.route('/<name>/source')
-def get_current_source(name):
-    source_name = request.args.get('name', '')
-    source_id = request.args.get('id', '')
-    keywords = [kw for kw in request.args.get('keywords', '').split(',') if kw]
+@route('/<name>/current_source', '/<name>/source')
+async def get_current_source(req, name):
+    source_name = req.args.get('name', '')
+    source_id = req.args.get('id', '')
+    keywords = [kw for kw in req.args.get('keywords', '').split(',') if kw]
     if source_name or source_id or keywords:
-        return set_source(source_name=source_name, source_id=source_id, keywords=keywords)
+        return await set_source(req, name, source_name=source_name, source_id=source_id, keywords=keywords)
 
-    machine_icon = request.args.get('machine_icon', '').lower() == 'true'
-    album_art = request.args.get('album_art', '').lower() == 'true'
-    source_icon = request.args.get('source_icon', '').lower() == 'true'
-    track_meta = request.args.get('track_meta', '').lower() == 'true'
+    machine_icon = req.args.get('machine_icon', '').lower() == 'true'
+    album_art = req.args.get('album_art', '').lower() == 'true'
+    source_icon = req.args.get('source_icon', '').lower() == 'true'
+    track_meta = req.args.get('track_meta', '').lower() == 'true'
 
-    source = _airfoil_cmd(name, lambda airfoil: airfoil.get_current_source(
-        machine_icon=machine_icon, album_art=album_art, source_icon=source_icon, track_meta=track_meta))
-    return jsonify(source._asdict())
+    airfoil = _airfoil(req, name)
+    await airfoil.connect()
+    source = await airfoil.get_current_source(machine_icon=machine_icon, album_art=album_art, source_icon=source_icon,
+                                              track_meta=track_meta, fresh=_stale(req, airfoil.state.source_loaded))
+    return cached(req, source._asdict())
 
 
-@app.route('/<name>/source/<source>/')
-@app.route('/<name>/source/<source>')
-def set_source(name, source='', source_name='', source_id='', keywords=[]):
+@route('/<name>/source/<source>')
+async def set_source(req, name, source='', source_name='', source_id='', keywords=[]):
     if [bool(source), bool(source_name), bool(source_id), bool(keywords)].count(True) > 1:
-        return jsonify(_error(name, 'More than one parameter was specified for set_source'))
+        return jsonify(_error(req, name, 'set_source', 'More than one parameter was specified for set_source'))
 
-    airfoil = finder.airfoils.get(name, None)
+    airfoil = _airfoil(req, name)
     match = None
-    if airfoil:
-        try:
-            if source_name or source_id or keywords:
-                match = airfoil.find_source(name=source_name, id=source_id, keywords=keywords)
-        except ValueError:
-            return jsonify(_error(name, 'no source was found with the specified url keyword parameter'))
-        if source:
-            try:
-                match = airfoil.find_source(name=source)
-            except ValueError:
-                try:
-                    match = airfoil.find_source(id=source)
-                except ValueError:
-                    keywords = airfoil.get_keywords(source)
-                    try:
-                        match = airfoil.find_source(keywords=keywords)
-                    except ValueError:
-                        pass
-        response = {'action': 'set_source', 'status': 'success', 'current_source': None}
-        if match:
-            source = airfoil.set_source(id=match.id)._asdict()
-            if source['source_name'] != match.name:
-                response['status'] = 'fail'
-                response['reason'] = 'source was not successfully changed. check Airfoil.'
-        else:
-            source = airfoil.get_current_source()._asdict()
+    if source_name or source_id:
+        match = await airfoil.find_source(source_name or source_id)
+    elif keywords:
+        match = await airfoil.find_source(' '.join(keywords))
+    elif source:
+        match = await airfoil.find_source(source)
+
+    response = {'action': 'set_source', 'status': 'success', 'current_source': None}
+    if match:
+        current = (await airfoil.set_source(match))._asdict()
+        if current['source_name'] != match.name:
             response['status'] = 'fail'
-            response['reason'] = 'no source was found with the given name.'
-        response['current_source'] = source
-        return jsonify(response)
+            response['reason'] = 'source was not successfully changed. check Airfoil.'
+    else:
+        current = (await airfoil.get_current_source())._asdict()
+        response['status'] = 'fail'
+        response['reason'] = 'no source was found with the given name.'
+    response['current_source'] = current
+    return jsonify(response)
 
 
+@route('/<name>/events')
+async def events(req, name):
+    """
+    stream notifications from Airfoil as server-sent events, or over a websocket if the request asks to upgrade.
+    ?types=speakerVolumeChanged,speakerConnectedChanged limits the stream to those notification types, and
+    ?speakers=<name, id, or keywords>,... to notifications about those speakers.
+    """
+    airfoil = _airfoil(req, name)
+    await airfoil.connect()
+    if req.headers.get('upgrade', '').lower() == 'websocket' and not req.headers.get('sec-websocket-key'):
+        raise GatewayError(_error(req, name, 'events', 'websocket upgrade requires a Sec-WebSocket-Key header'), 400)
+    types = [t for t in req.args.get('types', '').split(',') if t]
+    speakers = []
+    for speaker in [s for s in req.args.get('speakers', '').split(',') if s]:
+        match = airfoil.state.find_speaker(unknown=speaker)
+        if not match:
+            raise GatewayError(_error(req, name, 'events', f'No speaker found with name, id, or keywords: '
+                                                           f'\'{speaker}\''))
+        speakers.append(match.id)
+    return EventStream(req, airfoil, types, speakers)
+
+
+@route('/<name>/scene')
+async def scene(req, name):
+    """
+    POST a scene document (see remoteFoil.scenes.Scene) to bring Airfoil to that state in one batch of commands.
+    """
+    if req.method != 'POST':
+        raise GatewayError(_error(req, name, 'scene', 'a scene must be sent as the body of a POST request'), 400)
+    airfoil = _airfoil(req, name)
+    doc = _scene_doc(req, name)
+    try:
+        steps, speakers, missed = await airfoil.apply_scene(doc)
+    except ValueError as e:
+        raise GatewayError(_error(req, name, 'scene', str(e)), 400)
+    return await _scene_result(req, name, airfoil, steps, speakers, missed)
 
-    else:
-        return _error(name, f'No remoteFoil instance found with name \'{name}\'')
-
-
-@app.route('/<name>/<speaker>/')
-@app.route('/<name>/<speaker>')
-@app.route('/<name>/<speaker>/<action>/')
-@app.route('/<name>/<speaker>/<action>')
-@app.route('/<name>/<speaker>/<action>/<arg1>/')
-@app.route('/<name>/<speaker>/<action>/<arg1>')
-@app.route('/<name>/<speaker>/<action>/<arg1>/<arg2>/')
-@app.route('/<name>/<speaker>/<action>/<arg1>/<arg2>')
-@app.route('/<name>/<speaker>/<action>/<arg1>/<arg2>/<arg3>/')
-@app.route('/<name>/<speaker>/<action>/<arg1>/<arg2>/<arg3>')
-def speaker_uri(name, speaker, action=None, arg1=None, arg2=None, arg3=None):
-    g.action = action = action.lower() if action else g.action
-    g.volume = arg1 if arg1 else g.volume
-    level_error = f'{g.action} requires an end volume in the following formats: A number between 0 and 1 inclusive ' \
-                  f'with up to 8 digits after the decimal point, or a percentage. values greater than 1 or less than ' \
-                  f'0 will be constrained to valid values. valid values for volume include 0, 1, 0.75432111, 35%, 100%'
+
+def _scene_doc(req, name):
+    caller = sys._getframe(1).f_code.co_name
+    try:
+        return json.loads(req.body or b'null')
+    except ValueError as e:
+        raise GatewayError(_error(req, name, caller, f'scene is not valid JSON: {e}'), 400)
+
+
+async def _scene_result(req, name, airfoil, steps, speakers, missed):
+    caller = sys._getframe(1).f_code.co_name
+    result = _success(req, name, caller)
+    if missed:
+        result = _error(req, name, caller, 'speakers did not reach their targets: ' +
+                        ', '.join(s.name for s in missed))
+    result['changes'] = [{'action': s.action, 'speaker': s.speaker.name, 'value': s.value} for s in steps]
+    result['speakers'] = [s._asdict() for s in speakers]
+    source = await airfoil.get_current_source()
+    result['current_source'] = source._asdict()
+    return jsonify(result)
+
+
+@route('/<name>/scenes')
+async def get_scenes(req, name):
+    _airfoil(req, name, contact=False)
+    return jsonify({'scenes': scenes.names()})
+
+
+@route('/<name>/scenes/<scene_name>', '/<name>/scenes/<scene_name>/<action>')
+async def stored_scene(req, name, scene_name, action=None):
+    """
+    GET returns a stored scene, PUT saves the scene document in the body under scene_name, and DELETE removes it.
+    POST, or any request to /<name>/scenes/<scene_name>/apply, applies it.
+    """
+    apply = action == 'apply' or (req.method == 'POST' and not action)
+    airfoil = _airfoil(req, name, contact=apply)
+    try:
+        if apply:
+            await airfoil.connect()
+            scene, targets = scenes.resolve(scene_name, airfoil.name, airfoil.state)
+            steps, speakers, missed = await airfoil.apply_scene(scene, targets)
+            return await _scene_result(req, name, airfoil, steps, speakers, missed)
+        if action:
+            raise GatewayError(_error(req, name, 'scene', f'action for scene is not recognized: \'{action}\''))
+        if req.method == 'PUT':
+            scenes.save(scene_name, _scene_doc(req, name))
+        elif req.method == 'DELETE':
+            scenes.delete(scene_name)
+            return jsonify(_success(req, name, 'delete_scene'))
+        result = _success(req, name, 'scene')
+        scenes.get(scene_name)  # raises ValueError for unknown scenes
+        result['scene'] = scenes.scenes[scene_name.lower()]
+        return jsonify(result)
+    except ValueError as e:
+        raise GatewayError(_error(req, name, 'scene', str(e)), 400 if req.method == 'PUT' else 404)
+
+
+@route('/<name>/<speaker>', '/<name>/<speaker>/<action>', '/<name>/<speaker>/<action>/<arg1>',
+       '/<name>/<speaker>/<action>/<arg1>/<arg2>', '/<name>/<speaker>/<action>/<arg1>/<arg2>/<arg3>')
+async def speaker_uri(req, name, speaker, action=None, arg1=None, arg2=None, arg3=None):
+    req.action = action = action.lower() if action else req.action
+    req.volume = arg1 if arg1 else req.volume
+    airfoil = _airfoil(req, name)
+    level_error = f'{req.action} requires an end volume in the following formats: A number between 0 and 1 ' \
+                  f'inclusive with up to 8 digits after the decimal point, or a percentage. values greater than 1 or ' \
+                  f'less than 0 will be constrained to valid values. valid values for volume include 0, 1, ' \
+                  f'0.75432111, 35%, 100%'
     try:  # make sure given volume is a valid value
-        if g.volume is not None:
-            g.volume = _airfoil_cmd(name, lambda airfoil: airfoil._parse_volume(g.volume))
+        if req.volume is not None:
+            req.volume = airfoil._parse_volume(req.volume)
     except ValueError:
-        return jsonify(_error(name, action, level_error))
+        return jsonify(_error(req, name, action, level_error))
 
     if not any([action, arg1, arg2, arg3]):
         if speaker == 'speakers':               # get list of all speakers /remoteFoil/speakers
-            return get_speakers(name)
+            return await get_speakers(req, name)
         else:
-            return get_speaker(name, speaker)   # get specific speaker info /remoteFoil/my_speaker
+            return await get_speaker(req, name, speaker)   # get specific speaker info /remoteFoil/my_speaker
 
     if action in ['on', 'yes', 'true', 'connect', 'enable', 'enabled']:
-        return connect(name, speaker)
+        return await connect(req, name, speaker)
     if action in ['off', 'no', 'false', 'disconnect', 'disable', 'disabled']:
-        return disconnect(name, speaker)
+        return await disconnect(req, name, speaker)
     if action in ['toggle', 'reset', 'cycle']:
-        return toggle(name, speaker)
+        return await toggle(req, name, speaker)
     if action in ['mute', 'silence', 'silent', 'quiet']:
-        return mute(name, speaker)
+        return await mute(req, name, speaker)
     if action == 'unmute':
-        return unmute(name, speaker)
+        return await unmute(req, name, speaker)
     if action in ['volume', 'level']:
-        return volume(name, speaker)
+        return await volume(req, name, speaker)
     if action in ['source', 'current_source']:
-        return get_current_source(name)
+        return await get_current_source(req, name)
     if action in ['play', 'pause', 'play_pause']:
-        return play_pause(name)
+        return await play_pause(req, name)
     if action in ['skip', 'next', 'next_track']:
-        return next_track(name)
+        return await next_track(req, name)
     if action in ['prev', 'last', 'back', 'prev_track', 'last_track']:
-        return last_track(name)
+        return await last_track(req, name)
 
     if action in ['fade', 'ramp', 'transition']:
-        g.seconds = arg2 if arg2 else g.seconds
+        req.seconds = arg2 if arg2 else req.seconds
         try:
-            g.seconds = abs(float(g.seconds))
+            req.seconds = abs(float(req.seconds))
         except ValueError:
-            return jsonify(_error(name, g.action, f'seconds must be a positive numeric value like 5, 3.25, 15.021, not '
-                                                  f'\'{g.seconds}\''))
-        g.ticks = arg3 if arg3 else g.ticks
+            return jsonify(_error(req, name, req.action, f'seconds must be a positive numeric value like 5, 3.25, '
+                                                         f'15.021, not \'{req.seconds}\''))
+        req.ticks = arg3 if arg3 else req.ticks
         try:
-            g.ticks = int(g.ticks)
+            req.ticks = int(req.ticks)
         except ValueError:
-            return jsonify(_error(name, g.action, f'ticks must be a positive numeric value like 4 or 20, not '
-                                                  f'\'{g.ticks}\''))
-        return fade(name, speaker)
+            return jsonify(_error(req, name, req.action, f'ticks must be a positive numeric value like 4 or 20, not '
+                                                         f'\'{req.ticks}\''))
+        return await fade(req, name, speaker)
 
     try:
-        g.volume = _airfoil_cmd(name, lambda airfoil: airfoil._parse_volume(action))
-        return volume(name, speaker)
+        req.volume = airfoil._parse_volume(action)
+        return await volume(req, name, speaker)
     except ValueError:
         pass
-    return jsonify(_error(name, action, f'action for speaker is not recognized: \'{action}\''))
+    return jsonify(_error(req, name, action, f'action for speaker is not recognized: \'{action}\''))
 
 
-def get_speakers(name):
-    speakers = _airfoil_cmd(name, lambda airfoil: airfoil.get_speakers())
-    return jsonify([s._asdict() for s in speakers])
+async def get_speakers(req, name):
+    airfoil = _airfoil(req, name)
+    await airfoil.connect()
+    speakers = await airfoil.get_speakers(fresh=_stale(req, airfoil.state.speakers_loaded))
+    return cached(req, [s._asdict() for s in speakers])
 
 
-def get_speaker(name, speaker):
-    return jsonify(_airfoil_cmd(name, lambda _, match: match._asdict(), speaker=speaker))
+async def get_speaker(req, name, speaker):
+    airfoil = _airfoil(req, name)
+    await airfoil.connect()
+    if _stale(req, airfoil.state.speakers_loaded):
+        await airfoil.get_speakers(fresh=True)
+    match = await airfoil.find_speaker(unknown=speaker)
+    if not match:
+        return jsonify(_error(req, name, 'get_speaker', f'No speaker found with name, id, or keywords: \'{speaker}\''))
+    return cached(req, match._asdict())
 
 
-def connect(name, speaker):
+async def connect(req, name, speaker):
     functions = {'multi':
-         lambda airfoil: airfoil.connect_some(names=g.names, ids=g.ids),
+         lambda airfoil: airfoil.connect_speakers(airfoil.state.select(names=req.names, ids=req.ids,
+                                                                       include_disconnected=True)),
                  'specific':
-         lambda airfoil, match: airfoil.disconnect_speaker(id=match.id)
+         lambda airfoil, match: airfoil.connect_speakers([match])
                  }
-    return _parse_speaker_cmd(name, speaker, functions)
+    return await _parse_speaker_cmd(req, name, speaker, functions)
 
 
-def disconnect(name, speaker):
+async def disconnect(req, name, speaker):
     functions = {'multi':
-         lambda airfoil: airfoil.disconnect_some(names=g.names, ids=g.ids),
+         lambda airfoil: airfoil.disconnect_speakers(airfoil.state.select(names=req.names, ids=req.ids)),
                  'specific':
-         lambda airfoil, match: airfoil.disconnect_speaker(id=match.id)
+         lambda airfoil, match: airfoil.disconnect_speakers([match])
                  }
-    return _parse_speaker_cmd(name, speaker, functions)
+    return await _parse_speaker_cmd(req, name, speaker, functions)
 
 
-def toggle(name, speaker):
+async def toggle(req, name, speaker):
     functions = {'multi':
-         lambda airfoil: airfoil.toggle_some(names=g.names, ids=g.ids, include_disconnected=g.disconnected),
+         lambda airfoil: airfoil.toggle_speakers(airfoil.state.select(names=req.names, ids=req.ids,
+                                                                      include_disconnected=req.disconnected)),
                  'specific':
-         lambda airfoil, match: airfoil.toggle_speaker(id=match.id)
+         lambda airfoil, match: airfoil.toggle_speakers([match])
                  }
-    return _parse_speaker_cmd(name, speaker, functions)
+    return await _parse_speaker_cmd(req, name, speaker, functions)
 
 
-def mute(name, speaker):
+async def mute(req, name, speaker):
     functions = {'multi':
-         lambda airfoil: airfoil.mute_some(names=g.names, ids=g.ids, include_disconnected=g.disconnected),
+         lambda airfoil: airfoil.mute_some(airfoil.state.select(names=req.names, ids=req.ids,
+                                                                include_disconnected=req.disconnected)),
                  'specific':
-         lambda airfoil, match: airfoil.mute(id=match.id)
+         lambda airfoil, match: airfoil.mute_some([match])
                  }
-    return _parse_speaker_cmd(name, speaker, functions)
+    return await _parse_speaker_cmd(req, name, speaker, functions)
 
 
-def unmute(name, speaker):
+async def unmute(req, name, speaker):
+    default_volume = req.volume if req.volume is not None else 1.0
     functions = {'multi':
-         lambda airfoil: airfoil.unmute_some(names=g.names, ids=g.ids, default_volume=g.volume,
-                                             include_disconnected=g.disconnected),
+         lambda airfoil: airfoil.unmute_some(airfoil.state.select(names=req.names, ids=req.ids,
+                                                                  include_disconnected=req.disconnected),
+                                             default_volume=default_volume),
                  'specific':
-         lambda airfoil, match: airfoil.unmute(id=match.id, default_volume=g.volume)
+         lambda airfoil, match: airfoil.unmute_some([match], default_volume=default_volume)
                  }
-    return _parse_speaker_cmd(name, speaker, functions)
+    return await _parse_speaker_cmd(req, name, speaker, functions)
 
 
-def fade(name, speaker):
+async def fade(req, name, speaker):
     functions = {'multi':
-        lambda airfoil: airfoil.fade_some(names=g.names, ids=g.ids, end_volume=g.volume, seconds=g.seconds,
-                                          ticks=g.ticks, include_disconnected=g.disconnected),
+         lambda airfoil: airfoil.fade_volumes(req.volume, req.seconds, airfoil.state.select(
+             names=req.names, ids=req.ids, include_disconnected=req.disconnected), ticks=req.ticks),
                  'specific':
-        lambda airfoil, match: airfoil.fade_volume(id=match.id, end_volume=g.volume, seconds=g.seconds, ticks=g.ticks)}
-    return _parse_speaker_cmd(name, speaker, functions)
+         lambda airfoil, match: airfoil.fade_volumes(req.volume, req.seconds, [match], ticks=req.ticks)
+                 }
+    return await _parse_speaker_cmd(req, name, speaker, functions)
 
 
-def volume(name, speaker):
+def _coalesce(value):
+    """
+    parse the coalesce argument of volume requests.
+    :param value:   string, true or false in any of the forms TRUTHIES and FALSIES hold, or a number of seconds
+    :return:        True, False, or float
+    """
+    value = value.lower()
+    coalesce = True if value in TRUTHIES else False if value in FALSIES else float(value)
+    if coalesce < 0:
+        raise ValueError(value)
+    return coalesce
+
+
+async def volume(req, name, speaker):
+    # ?coalesce=true (or a number of seconds) collapses bursts of volume requests for a speaker, like the ones a
+    # slider sends, into one write of the latest volume
+    try:
+        coalesce = _coalesce(req.args.get('coalesce', ''))
+    except ValueError:
+        return jsonify(_error(req, name, 'volume', f'coalesce must be true, false, or a number of seconds, not '
+                                                   f'\'{req.args["coalesce"]}\''))
     functions = {'multi':
-         lambda airfoil: airfoil.set_volumes(g.volume, names=g.names, ids=g.ids, include_disconnected=g.disconnected),
+         lambda airfoil: airfoil.set_volumes(req.volume, airfoil.state.select(names=req.names, ids=req.ids,
+                                                                              include_disconnected=req.disconnected),
+                                             coalesce=coalesce),
                  'specific':
-         lambda airfoil, match: airfoil.set_volume(g.volume, id=match.id)
+         lambda airfoil, match: airfoil.set_volumes(req.volume, [match], coalesce=coalesce)
                  }
-    return _parse_speaker_cmd(name, speaker, functions)
+    return await _parse_speaker_cmd(req, name, speaker, functions)
 
-def start():
-    cli = sys.modules['flask.cli']
-    cli.show_server_banner = lambda *x: None
-    finder = AirfoilFinder()
-    app.run(host='0.0.0.0', port='80', threaded=True)
 
-if __name__=='__main__':
-    start()
+def _deadline(req):
+    """
+    every call to Airfoil made for a request is limited by the request timeout of its AsyncAirfoil. Passing
+    ?timeout=<seconds> also limits all of them together, so a request answers with 504 after at most that long.
+    """
+    if 'timeout' not in req.args:
+        return contextlib.nullcontext()
+    try:
+        seconds = float(req.args['timeout'])
+    except ValueError:
+        seconds = -1
+    if seconds <= 0:
+        raise GatewayError(_error(req, req.path.split('/')[1], 'timeout',
+                                  f'timeout must be a positive number of seconds, not \'{req.args["timeout"]}\''), 400)
+    return deadline(seconds)
 
 
+async def dispatch(req):
+    for regex, handler in routes:
+        match = regex.match(req.path)
+        if match:
+            try:
+                with _deadline(req):
+                    return await handler(req, **match.groupdict())
+            except GatewayError as e:
+                return Response(e.payload, e.status, e.headers)
+            except AirfoilTimeoutError as e:
+                return jsonify(_error(req, req.path.split('/')[1], handler.__name__, str(e)), 504)
+            except (OSError, ValueError) as e:
+                return jsonify(_error(req, req.path.split('/')[1], handler.__name__, str(e)), 500)
+            except Exception as e:
+                # a bug in a handler still gets the client an answer instead of a dropped connection
+                return jsonify(_error(req, req.path.split('/')[1], handler.__name__, f'unexpected error: {e!r}'), 500)
+    return jsonify({'status': 'fail', 'url': req.target, 'reason': 'not found'}, 404)
+
+
+async def handle_client(reader, writer):
+    """serve HTTP/1.1 requests on one client connection, keeping it open between requests unless asked not to."""
+    try:
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            try:
+                method, target, version = line.decode('latin-1').split()
+            except ValueError:
+                await jsonify({'status': 'fail', 'reason': 'bad request'}, 400).send(writer, False)
+                break
+            headers = {}
+            for _ in range(MAX_HEADER_LINES):
+                header = await reader.readline()
+                if header in [b'\r\n', b'\n', b'']:
+                    break
+                k, _, v = header.decode('latin-1').partition(':')
+                headers[k.strip().lower()] = v.strip()
+            try:
+                length = int(headers.get('content-length', 0) or 0)
+                if length < 0:
+                    raise ValueError(length)
+            except ValueError:
+                # without a length, where the body ends is unknown, so the connection can't be used again
+                response = jsonify({'status': 'fail', 'reason': 'bad request: invalid Content-Length'}, 400)
+                await response.send(writer, False)
+                break
+            body = await reader.readexactly(length)
+            keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+            response = await dispatch(Request(method, target, headers, body))
+            if isinstance(response, EventStream):
+                await response.run(reader, writer)
+                break
+            await response.send(writer, keep_alive)
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+def _add_airfoil(name, ip, port):
+    if name not in airfoils:
+        airfoils[name] = AsyncAirfoil(ip, port, name)
+        airfoils[name].state.listeners.append(scenes.listener(name))
+        # start mirroring the instance right away so the first request does not wait for the subscription. if that
+        # fails, the first request will try again
+        task = asyncio.ensure_future(airfoils[name].connect())
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+def _remove_airfoil(name):
+    airfoil = airfoils.pop(name, None)
+    if airfoil:
+        asyncio.ensure_future(airfoil.close())
+
+
+async def serve(host='0.0.0.0', port=80):
+    global finder, scenes
+    loop = asyncio.get_running_loop()
+    scenes = SceneStore()
+    # the finder calls back on its own threads, so changes to airfoils are handed to the event loop
+    finder = AirfoilFinder(on_add=lambda *a: loop.call_soon_threadsafe(_add_airfoil, *a),
+                           on_remove=lambda *a: loop.call_soon_threadsafe(_remove_airfoil, *a))
+    server = await asyncio.start_server(handle_client, host, port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        finder.close()
+
+
+def start(host='0.0.0.0', port=80):
+    try:
+        asyncio.run(serve(host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    start()
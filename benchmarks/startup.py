@@ -0,0 +1,49 @@
+"""
+    startup benchmark -> how long a fresh python process takes to import remoteFoil and start the cli
+
+    python benchmarks/startup.py [RUNS]
+
+    Every case runs RUNS times (default 20) in its own interpreter, and the median wall time is printed next to the
+    time of an empty interpreter, so the difference is what the import or command itself costs. Each case also lists
+    the heavy modules it ended up importing, which should stay empty for plain imports and for help: discovery
+    (zeroconf, netifaces), json and the thread pool are only meant to load when a command uses them.
+    The cli runs with REMOTEFOIL_SOCKET set to an empty string, so a running daemon does not answer for it.
+"""
+import os, statistics, subprocess, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ['remoteFoil.airfoil_finder', 'remoteFoil._zeroconf', 'netifaces', 'json', 'concurrent.futures', 'logging']
+REPORT = f'import sys; print(",".join(m for m in {HEAVY!r} if m in sys.modules), file=sys.stderr)'
+CASES = [
+    ('python', ['-c', 'pass']),
+    ('import remoteFoil', ['-c', f'import remoteFoil; {REPORT}']),
+    ('import airfoil_cli', ['-c', f'import airfoil_cli; {REPORT}']),
+    ('cli help fade', ['-c', f'import sys, runpy; sys.argv = ["airfoil_cli.py", "help", "fade"]\n'
+                             f'try:\n    runpy.run_path("airfoil_cli.py", run_name="__main__")\n'
+                             f'except SystemExit:\n    pass\n{REPORT}']),
+]
+
+
+def run(args):
+    """:return: tuple of the seconds the process took and the heavy modules it imported"""
+    started = time.perf_counter()
+    done = subprocess.run([sys.executable] + args, cwd=ROOT, env=dict(os.environ, REMOTEFOIL_SOCKET=''),
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    return time.perf_counter() - started, done.stderr.strip().splitlines()[-1:] or ['']
+
+
+def main(runs=20):
+    print(f'{"case":<20}{"median ms":>10}{"over python":>13}  heavy modules imported')
+    base = None
+    for name, args in CASES:
+        times, heavy = [], ''
+        for _ in range(runs):
+            seconds, (heavy,) = run(args)
+            times.append(seconds)
+        median = statistics.median(times) * 1000
+        base = median if base is None else base
+        print(f'{name:<20}{median:>10.1f}{median - base:>13.1f}  {heavy or "-"}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -1,4 +1,5 @@
-from remoteFoil.airfoil import Airfoil, OFF, ON, MIDDLE
-from remoteFoil.utils import nones, bools, print_table
+from remoteFoil.airfoil import Airfoil, AirfoilTimeoutError, AirfoilCancelledError, deadline, OFF, ON, MIDDLE
+from remoteFoil.utils import nones, bools, print_table, TableWriter, LiveTable
 
-__all__ = ['Airfoil', 'nones', 'bools', 'print_table', 'OFF', 'ON', 'MIDDLE']
+__all__ = ['Airfoil', 'AirfoilTimeoutError', 'AirfoilCancelledError', 'deadline', 'nones', 'bools', 'print_table',
+           'TableWriter', 'LiveTable', 'OFF', 'ON', 'MIDDLE']
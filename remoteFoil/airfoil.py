@@ -1,10 +1,236 @@
-import socket, json, random, sys, time, copy
+import socket, random, sys, time, copy, threading, contextvars
 from collections import namedtuple
-from remoteFoil.airfoil_finder import AirfoilFinder
+from contextlib import contextmanager
+from remoteFoil.mute_store import MuteStore
+from remoteFoil.source_catalog import SourceCatalog
+from remoteFoil.coalescer import VolumeCoalescer
 
 ON = ['full', 'on', 'unmute', 'enable', 'enabled', 'true', 'high', 'hi']
 OFF = ['none', 'off', 'mute', 'disable', 'disabled', 'false', 'low', 'lo']
 MIDDLE = ['half', 'mid', 'middle']
+MAX_CONCURRENCY = 4
+REQUEST_TIMEOUT = 10
+RECONNECT_BACKOFF = 0.5
+RECONNECT_MAX_BACKOFF = 30
+NOTIFICATION_POLL = 0.2
+# a subscription can be quiet for hours, so a dead peer is found by TCP keepalive probes instead of a read timeout:
+# the first after KEEPALIVE_IDLE quiet seconds, then every KEEPALIVE_INTERVAL seconds, KEEPALIVE_COUNT times
+KEEPALIVE_IDLE = 15
+KEEPALIVE_INTERVAL = 5
+KEEPALIVE_COUNT = 3
+CONFIRM_TIMEOUT = 30
+# type of the synthetic notification sent after a dropped subscription has been restored, see Airfoil.watch
+RESYNCED = 'resynced'
+# absolute time.time() by which every Slipstream call made in the current context must have finished, see deadline()
+_deadline = contextvars.ContextVar('remotefoil_deadline', default=None)
+
+
+class AirfoilTimeoutError(TimeoutError):
+    """raised when Airfoil does not connect or reply before the request timeout or the current deadline."""
+
+
+class AirfoilCancelledError(ConnectionAbortedError):
+    """raised by requests that were waiting for Airfoil when Airfoil.cancel was called."""
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    deadline is a context manager that limits how long all the Slipstream calls made inside it may take together,
+    including the ones group methods send from their own threads and the ones made by AsyncAirfoil. Calls that are
+    still waiting when it passes raise AirfoilTimeoutError. Deadlines nest; the earliest one applies.
+        with deadline(5):
+            airfoil.connect_all()
+    :param seconds: int or float, number of seconds from now
+    """
+    at = time.time() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(at, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def _finder():
+    # discovery pulls in zeroconf and netifaces, which instances given an ip and port never need, so it is only
+    # imported when it is used. json and the thread pool are imported where they are used for the same reason
+    from remoteFoil.airfoil_finder import AirfoilFinder
+    return AirfoilFinder
+
+
+def time_left(timeout):
+    """
+    time_left returns the number of seconds the next step of a Slipstream call may take: the smaller of timeout and
+    the time until the current deadline, or None if neither is set.
+    :param timeout: int, float, or None, request timeout of the client making the call
+    """
+    at = _deadline.get()
+    if at is None:
+        return timeout
+    left = at - time.time()
+    if left <= 0:
+        raise AirfoilTimeoutError('deadline passed before Airfoil replied')
+    return left if timeout is None else min(left, timeout)
+
+
+def keepalive(sock):
+    """
+    keepalive turns on TCP keepalive for a long-lived connection to Airfoil, so a connection whose other end went away
+    without closing it, like after a network change or Airfoil's host sleeping, fails instead of waiting forever.
+    Options the platform does not have are left at its defaults.
+    :param sock:    socket.socket
+    """
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for option, value in [('TCP_KEEPIDLE', KEEPALIVE_IDLE), ('TCP_KEEPALIVE', KEEPALIVE_IDLE),
+                          ('TCP_KEEPINTVL', KEEPALIVE_INTERVAL), ('TCP_KEEPCNT', KEEPALIVE_COUNT)]:
+        if hasattr(socket, option):
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+            except OSError:
+                pass
+
+
+def relocate(ip, name, timeout):
+    """
+    relocate looks up the address of an Airfoil instance again, since Airfoil listens on a new port after it restarts.
+    The instance's entry in AirfoilFinder.airfoils is dropped first, so the old port is not read back from it.
+    :param ip:      ipv4 address of the instance
+    :param name:    name of the instance. instances created with an ip and port use the ip as their name, and are
+                    looked up by ip
+    :param timeout: int or float, seconds to look for
+    :return:        tuple of ip and port, or None if the instance was not found
+    """
+    finder = _finder()
+    for key, airfoil in list(finder.airfoils.items()):
+        if airfoil[0] == ip or airfoil[2] == name.lower():
+            finder.airfoils.pop(key, None)
+    try:
+        if name == ip:
+            ip, port, _ = finder.get_airfoil_by_ip(ip, timeout)
+        else:
+            ip, port, _ = finder.get_airfoil_by_name(name, timeout)
+        return ip, int(port)
+    except (TimeoutError, OSError):
+        return None
+
+
+def _deadline_passed():
+    at = _deadline.get()
+    return at is not None and at <= time.time()
+
+
+def reconnect_delay(attempt):
+    """
+    reconnect_delay returns how long to wait before reconnecting attempt times in a row: RECONNECT_BACKOFF, doubled
+    for every attempt up to RECONNECT_MAX_BACKOFF, less up to half of it at random so clients do not retry in step.
+    """
+    return min(RECONNECT_MAX_BACKOFF, RECONNECT_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1)
+
+
+class _Confirmations(object):
+    """
+    _Confirmations resolves the futures of Airfoil.connect_future and friends. While any of them is pending, a
+    background thread keeps a subscription to Airfoil open, and resolves a future when Airfoil reports its speaker
+    connected or disconnected with speakerConnectedChanged. The thread ends once nothing is pending.
+    - pending maps speaker ids to lists of [connected, future, speaker, expires], where connected is the state the
+      future waits for and expires the time.time() it fails with AirfoilTimeoutError.
+    """
+    def __init__(self, airfoil):
+        self.airfoil = airfoil
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.thread = None
+        self.ready = None
+
+    def expect(self, speakers, connected, timeout):
+        """
+        start waiting for speakers to reach a connected state, and return once the subscription is open, so commands
+        sent after this returns can not be missed.
+        :return:    list of concurrent.futures.Future objects, in the order of speakers
+        """
+        from concurrent.futures import Future
+        futures, expires = [], None if timeout is None else time.time() + timeout
+        with self.lock:
+            for speaker in speakers:
+                futures.append(Future())
+                if speaker.connected == connected:
+                    futures[-1].set_result(speaker)
+                else:
+                    self.pending.setdefault(speaker.id, []).append([connected, futures[-1], speaker, expires])
+            if self.pending and self.thread is None:
+                self.ready = threading.Event()
+                self.thread = threading.Thread(target=self._follow, args=(self.ready,), daemon=True)
+                self.thread.start()
+            ready = self.ready
+        if ready and not ready.wait(self.airfoil.request_timeout):
+            self.resolve([(f, None, AirfoilTimeoutError(f'Airfoil at {self.airfoil.ip}:{self.airfoil.port} did not '
+                                                        f'reply within {self.airfoil.request_timeout} seconds'))
+                          for f in futures])
+        return futures
+
+    def resolve(self, outcomes):
+        """
+        resolve futures that no longer wait for a notification, like when Airfoil did not accept the command.
+        :param outcomes:    list of tuples of a future, its speaker, and an exception or None
+        """
+        futures = [o[0] for o in outcomes]
+        self._take(lambda id, wait: wait[1] in futures)
+        for future, speaker, error in outcomes:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(speaker)
+
+    def _take(self, match):
+        # remove the pending waits that match, and return them
+        taken = []
+        with self.lock:
+            for id in list(self.pending):
+                taken += [w for w in self.pending[id] if match(id, w)]
+                self.pending[id] = [w for w in self.pending[id] if not match(id, w)]
+                if not self.pending[id]:
+                    del self.pending[id]
+        return taken
+
+    def _follow(self, ready):
+        subscription, cmd = self.airfoil._create_cmd(self.airfoil._subscribe_cmd())
+        responses = self.airfoil._get_responses(cmd, stream=True, idle=NOTIFICATION_POLL)
+        error = None
+        try:
+            for message in responses:
+                data = (message or {}).get('data') or {}
+                if message and message.get('replyID') == subscription:
+                    ready.set()
+                elif message and message.get('request') == 'speakerConnectedChanged':
+                    id, connected = data.get('longIdentifier'), data.get('connected')
+                    for wait in self._take(lambda i, w: i == id and w[0] == connected):
+                        wait[1].set_result(wait[2]._replace(connected=connected))
+                now = time.time()
+                for wait in self._take(lambda i, w: w[3] is not None and w[3] <= now):
+                    wait[1].set_exception(AirfoilTimeoutError(f'speaker \'{wait[2].name}\' was not reported '
+                                                              f'{"connected" if wait[0] else "disconnected"} in time'))
+                with self.lock:
+                    if not self.pending:
+                        self.thread = None
+                        return
+        except OSError as e:
+            error = e
+        finally:
+            responses.close()
+            waits = []
+            with self.lock:
+                # after a normal stop, a new thread may already be following the waits that came in since
+                if self.thread is threading.current_thread():
+                    waits = [w for ws in self.pending.values() for w in ws]
+                    self.pending, self.thread = {}, None
+            for wait in waits:
+                wait[1].set_exception(error or ConnectionError(f'Airfoil at {self.airfoil.ip}:{self.airfoil.port} '
+                                                               f'ended the subscription'))
+            ready.set()
+
 
 class Airfoil(object):
     """
@@ -29,6 +255,23 @@ class Airfoil(object):
     - ``Airfoil.set_source`` will return an Airfoil.current_source object (not in a list)
       (``type(source) is Airfoil.current_source``)
 
+    Methods that act on a group of speakers read the speakers once, and only send commands to the speakers that are
+    not already in the requested state. The commands are sent over up to max_concurrency connections at a time, each
+    carrying a single command, so slow commands like connecting a Chromecast do not wait for each other. What
+    happened to each speaker is saved to Airfoil.results as a list of Airfoil.result objects:
+    result(speaker, action, status), where speaker is the speaker after the command and status is 'changed',
+    'skipped' (it was already in the requested state), or 'failed' (Airfoil did not accept the command).
+
+    The state returned by methods that change speakers or the source is derived from Airfoil's replies to the commands:
+    changes that Airfoil accepted are applied to the state read before the command was sent, so no second request is
+    needed to read it back. Pass confirm=True to any of these methods to read the state from Airfoil after the command
+    instead. A source selected this way is returned with source_has_track_metadata and source_controllable set to None,
+    since Airfoil only reports those when asked for the current source.
+
+    Airfoil accepts a connect or disconnect command before the speaker has actually connected or disconnected. To wait
+    for that, Airfoil.connect_future, Airfoil.disconnect_future and their group versions return futures that are
+    resolved by the notification Airfoil sends when it is done.
+
     Airfoil.speaker
         speaker(name='Bedroom speaker', type='chromecast',
         id='Chromecast-Audio-99130c4733fa2bbff26b770eda819eff@Bedroom speaker', volume=0.81, connected=False,
@@ -75,30 +318,62 @@ class Airfoil(object):
     """
     speaker = namedtuple('speaker', ['name', 'type', 'id', 'volume', 'connected', 'password', 'keywords'])
     source = namedtuple('source', ['name', 'id', 'type', 'keywords', 'icon'])
+    result = namedtuple('result', ['speaker', 'action', 'status'])
     current_source = namedtuple('current_source', ['source_name', 'source_has_track_metadata', 'source_controllable',
                                                    'track_album', 'track_artist', 'track_title', 'track_album_art',
                                                    'source_icon', 'system_icon'])
 
-    def __init__(self, ip=None, name=None, timeout=10):
-        port = None
+    def __init__(self, ip=None, name=None, timeout=10, port=None, max_concurrency=MAX_CONCURRENCY,
+                 request_timeout=REQUEST_TIMEOUT):
+        """
+        When the ip address of the Airfoil instance is known, the host is asked for its port and name directly with a
+        unicast query instead of waiting for a multicast browse. If the port is also known, pass it with the ip to
+        skip mdns entirely, in which case ip is also used as the name. Either way, an instance given by ip is checked
+        with the Slipstream handshake and ConnectionError is raised if it does not answer.
+        :param ip:      string, ipv4 address of the computer running Airfoil
+        :param name:    string, name of the Airfoil instance, usually the hostname of the computer
+        :param timeout: int, float, or None, number of seconds to wait until timing out, or None for no timeout.
+        :param port:    int, Slipstream port of the Airfoil instance. only used together with ip.
+        :param max_concurrency: int, number of commands group methods send at the same time, each on its own
+                                connection. 1 sends them one after another.
+        :param request_timeout: int, float, or None, number of seconds every Slipstream call may take, from opening
+                                the connection to the reply, before AirfoilTimeoutError is raised. None waits forever.
+        """
         if name and ip:
             # print('name', name)
             # print('ip')
             raise ValueError('Cannot create remoteFoil instance with both name & ip. Choose one or the other, or neither.')
-        if not name and not ip:
-            ip, port, name = AirfoilFinder.get_first_airfoil(timeout)
-
-        if name:
-            ip, port, name = AirfoilFinder.get_airfoil_by_name(name, timeout)
-        if ip:
-            ip, port, name = AirfoilFinder.get_airfoil_by_ip(ip, timeout)
+        if port and not ip:
+            raise ValueError('port can only be used together with ip.')
+        direct = bool(ip)
+        if ip and port:
+            name = ip
+        elif ip:
+            ip, port, name = _finder().get_airfoil_by_ip(ip, timeout)
+        elif name:
+            ip, port, name = _finder().get_airfoil_by_name(name, timeout)
+        else:
+            ip, port, name = _finder().get_first_airfoil(timeout)
 
         self.ip = ip
-        self.port = port
+        self.port = int(port)
         self.name = name
         self.sources = []
+        self.catalog = SourceCatalog()
         self.speakers = []
-        self.muted_speakers = {}
+        self.results = []
+        self.muted_speakers = MuteStore(self.ip)
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.request_timeout = request_timeout
+        self.state = None
+        self.sockets = set()
+        self.cancelled = set()
+        self.waiters = set()
+        self.lock = threading.Lock()
+        self.confirmations = _Confirmations(self)
+        self.coalescer = VolumeCoalescer(self)
+        if direct and not self._handshake(timeout):
+            raise ConnectionError(f'No Airfoil instance answered at {self.ip}:{self.port}.')
 
     @classmethod
     def get_first(cls, timeout=10):
@@ -109,15 +384,15 @@ class Airfoil(object):
         :param timeout:  int, float, or None, number of seconds to wait until timing out, or None for no timeout.
         :return:    instance of the remoteFoil.Airfoil class
         """
-        return AirfoilFinder.get_first_airfoil(timeout)
+        return _finder().get_first_airfoil(timeout)
 
     @classmethod
     def get_by_ip(cls, ip, timeout=10):
-        return AirfoilFinder.get_airfoil_by_ip(ip, timeout)
+        return _finder().get_airfoil_by_ip(ip, timeout)
 
     @classmethod
     def get_by_name(cls, name, timeout=10):
-        return AirfoilFinder.get_airfoil_by_name(name, timeout)
+        return _finder().get_airfoil_by_name(name, timeout)
 
 
 
@@ -129,15 +404,74 @@ class Airfoil(object):
         data = sock.recv(128)
         return acceptable_version in data.decode()
 
-    def _get_responses(self, cmd):
+    def _handshake(self, timeout=None):
+        """
+        open a connection to the Airfoil instance and check that it speaks a compatible version of Slipstream.
+        :param timeout: int, float, or None, number of seconds to wait for the connection and the reply
+        :return:        True if the handshake succeeded, False if Airfoil refused it or could not be reached.
+        """
+        with socket.socket() as sock:
+            sock.settimeout(timeout)
+            try:
+                return self._connect(sock)
+            except OSError:
+                return False
+
+    def _get_responses(self, cmd, stream=False, idle=None):
+        """
+        send cmd on a new connection and yield the messages Airfoil sends back. The connection, handshake and every
+        reply must arrive within self.request_timeout of the call and before the current deadline, except that with
+        stream=True, only the connection and handshake are limited by request_timeout.
+        With stream=True and idle set, None is yielded whenever no message starts arriving for idle seconds, so the
+        caller gets to stop waiting without closing the connection.
+        """
+        import json
         max_bytes = 4096
+        started = time.time()
+
+        def limit(sock, streaming=False, wait=None):
+            timeout = self.request_timeout
+            if timeout is not None:
+                timeout = None if streaming else timeout - (time.time() - started)
+                if timeout is not None and timeout <= 0:
+                    raise AirfoilTimeoutError(f'Airfoil at {self.ip}:{self.port} did not reply within '
+                                              f'{self.request_timeout} seconds')
+            timeout = time_left(timeout)
+            idling = wait is not None and (timeout is None or wait < timeout)
+            sock.settimeout(wait if idling else timeout)
+            return idling
+
+        def recv(sock, num_bytes, wait=None):
+            idling = limit(sock, stream, wait)
+            try:
+                data = sock.recv(num_bytes)
+            except socket.timeout:
+                if idling:
+                    return None
+                raise
+            if not data:
+                raise ConnectionError(f'Airfoil at {self.ip}:{self.port} closed the connection')
+            return data
+
         with socket.socket() as sock:
-            if self._connect(sock):
+            with self.lock:
+                self.sockets.add(sock)
+            if stream:
+                keepalive(sock)
+            try:
+                limit(sock)
+                if not self._connect(sock):
+                    # raised as AirfoilCancelledError below if the handshake was cut short by cancel
+                    raise ConnectionError(f'Airfoil at {self.ip}:{self.port} refused the handshake')
                 sock.send(cmd)
                 while True:
                     num_bytes = ''
                     while True:
-                        data = sock.recv(1)
+                        # only wait idle seconds for a message that has not started arriving yet
+                        data = recv(sock, 1, idle if stream and not num_bytes else None)
+                        if data is None:
+                            yield None
+                            continue
                         data = data.decode()
                         if data == ';':
                             num_bytes = int(num_bytes)
@@ -147,11 +481,39 @@ class Airfoil(object):
                     buffer = b''
                     while num_bytes > 1:
                         get_bytes = max_bytes if num_bytes > max_bytes else num_bytes - 1
-                        data = sock.recv(get_bytes)
+                        data = recv(sock, get_bytes)
                         buffer += data
                         num_bytes = num_bytes - len(data)
                     buffer += b'}'
                     yield json.loads(buffer)
+            except AirfoilTimeoutError:
+                raise
+            except socket.timeout:
+                raise AirfoilTimeoutError(f'timed out waiting for Airfoil at {self.ip}:{self.port}')
+            except OSError:
+                if sock in self.cancelled:
+                    raise AirfoilCancelledError('request to Airfoil was cancelled')
+                raise
+            finally:
+                with self.lock:
+                    self.sockets.discard(sock)
+                    self.cancelled.discard(sock)
+
+    def cancel(self):
+        """
+        Airfoil.cancel stops every request this object is waiting on, from any thread, by closing their connections.
+        Those requests raise AirfoilCancelledError. Commands Airfoil already received may still take effect.
+        """
+        with self.lock:
+            sockets = list(self.sockets)
+            self.cancelled.update(sockets)
+            for waiter in self.waiters:
+                waiter.set()
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
 
     def _create_cmd(self, base_cmd):
         request_id = str(random.randint(1, 1000))
@@ -181,6 +543,81 @@ class Airfoil(object):
             if 'replyID' in response and response['replyID'] == request_id:
                 return response['data']['success']
 
+    def _changed(self, speaker, success, **changes):
+        # the speaker as it is after a command: with the changes applied if Airfoil accepted it, as it was if not
+        return speaker._replace(**changes) if success else speaker
+
+    def _speaker_state(self, speakers, confirm):
+        """
+        return the state of speakers after a command, derived from the command replies, or read from Airfoil with
+        confirm=True. Either way it is also saved to self.speakers.
+        """
+        if confirm:
+            return self.get_speakers(ids=[s.id for s in speakers], fresh=True)
+        self.speakers = list(speakers)
+        return self.speakers
+
+    def _speaker(self, s):
+        # a speaker as Airfoil sends it, as an Airfoil.speaker object
+        return self.speaker(s.get('name'), s.get('type'), s.get('longIdentifier'), s.get('volume'),
+                            s.get('connected'), s.get('password'), self.get_keywords(s.get('name')))
+
+    def _subscribe_cmd(self):
+        # the reply to a subscription holds every speaker, and later commands on the connection get their replies
+        return {"data": {"notifications":
+                         ["speakerListChanged", "speakerConnectedChanged", "speakerPasswordChanged",
+                          "speakerVolumeChanged", "speakerNameChanged", "remoteControlChangedRequest"]},
+                "_replyTypes": ["subscribe", "getSourceMetadata", "connectToSpeaker", "disconnectSpeaker",
+                                "setSpeakerVolume", "getSourceList", "remoteCommand", "selectSource"],
+                "request": "subscribe", "requestID": "-1"}
+
+    def _select(self, ids, names, include_disconnected=True, speakers=None):
+        """
+        read the speakers once and return the ones a group command acts on: speakers matching ids or names (not
+        case-sensitive), or if neither is given, every speaker, or only connected ones with include_disconnected=False.
+        Passing speakers selects from that list instead of reading them.
+        """
+        if type(ids) is not list:
+            raise ValueError(f'ids must be a list of speaker ids, not \'{type(ids)}\'')
+        if type(names) is not list:
+            raise ValueError(f'names must be a list of speaker names, not \'{type(names)}\'')
+        ids = [i.lower() for i in ids]
+        names = [n.lower() for n in names]
+        return [s for s in (self.get_speakers() if speakers is None else speakers)
+                if (ids and s.id.lower() in ids) or (names and s.name.lower() in names) or
+                (not ids and not names and (s.connected or include_disconnected))]
+
+    def _group_cmd(self, speakers, action, target, request, confirm):
+        """
+        send a command to each of speakers that is not already in its target state, and save what happened to each
+        speaker to self.results.
+        :param speakers:    Airfoil.speaker objects from one read of the speakers
+        :param action:      name of the action, for self.results
+        :param target:      callable returning a dict of the speaker properties the command sets, for a speaker
+        :param request:     callable returning the Slipstream request to send, for a speaker and its target
+        :return:            list of Airfoil.speaker objects after the commands
+        """
+        def send(speaker):
+            changes = target(speaker)
+            if all(getattr(speaker, k) == v for k, v in changes.items()):
+                return self.result(speaker, action, 'skipped')
+            success = self._get_result(request(speaker, changes))
+            return self.result(self._changed(speaker, success, **changes), action, 'changed' if success else 'failed')
+
+        with self._pool(len(speakers)) as pool:
+            self.results = self._map(pool, send, speakers)
+        return self._speaker_state([r.speaker for r in self.results], confirm)
+
+    def _pool(self, jobs):
+        # every command opens its own connection, so commands for different speakers can be sent from several threads
+        from concurrent.futures import ThreadPoolExecutor
+        return ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, jobs)))
+
+    def _map(self, pool, fn, items):
+        # run fn on the pool with the caller's context, so a deadline set by the caller applies in the pool threads
+        contexts = [contextvars.copy_context() for _ in items]
+        return list(pool.map(lambda context, item: context.run(fn, item), contexts, items))
+
     def _parse_volume(self, vol):
         """
             Airfoil._parse_volume will parse percent or numeric input to a valid value for Airfoil volume.
@@ -222,7 +659,7 @@ class Airfoil(object):
             else:
                 return parse_num(float(vol))
 
-    def find_speaker(self, id=None, name=None, keywords=[], unknown=None):
+    def find_speaker(self, id=None, name=None, keywords=[], unknown=None, speakers=None):
         """
             Airfoil.find_speaker will find and return an Airfoil.speaker object matching the given parameters. None of the
             parameters are case-sensitive.
@@ -236,16 +673,19 @@ class Airfoil(object):
                 2. try with parameter as an id
                 3. turn parameter into keywords if it's not already a list and does a search by keywords.
               If no match is made using all three methods, None is returned
+            - Passing speakers searches that list instead of reading the speakers from Airfoil, so many lookups can
+              share one Airfoil.get_speakers call.
 
 
         :param id:          speaker id as string, not case-sensitive
         :param name:        speaker name as string, not case-sensitive
         :param keywords:    speaker keywords as list of strings, not case-sensitive
         :param unknown:     one of the above, not case-sensitive
+        :param speakers:    list of Airfoil.speaker objects to search, default None reads them from Airfoil
         :return:            either an Airfoil.speaker object or None
         """
         caller = sys._getframe(1).f_code.co_name
-        speakers = self.get_speakers()
+        speakers = self.get_speakers() if speakers is None else speakers
         selected_speaker = None
         if not name and not id and not keywords and not unknown:
             raise ValueError(f'{caller} called with no parameters.'
@@ -276,14 +716,14 @@ class Airfoil(object):
         elif unknown:
             unknown = unknown.lower()
             try:
-                return self.find_speaker(id=unknown)
+                return self.find_speaker(id=unknown, speakers=speakers)
             except ValueError:
                 try:
-                    return self.find_speaker(name=unknown)
+                    return self.find_speaker(name=unknown, speakers=speakers)
                 except ValueError:
                     keywords = self.get_keywords(unknown)
                     try:
-                        return self.find_speaker(keywords=keywords)
+                        return self.find_speaker(keywords=keywords, speakers=speakers)
                     except ValueError:
                         return None
         return selected_speaker
@@ -304,52 +744,123 @@ class Airfoil(object):
                 :return:            an Airfoil.source object
                 """
         caller = sys._getframe(1).f_code.co_name
-        sources = self.get_sources()
-        selected_source = None
         if not name and not id and not keywords:
             raise ValueError(f'{caller} called with no parameters.'
                              '\n\t\t\tmust pass one of the following: id, name, or keywords')
         elif [bool(name), bool(id), bool(keywords)].count(True) > 1:
             raise ValueError(f'only one keyword parameter can be passed to {caller}.'
                              '\n\t\t\tmust pass only one: id, name, or keywords')
-        elif id:
-            for source in sources:
-                if source.id.lower() == id.lower():
-                    selected_source = source
-            if not selected_source:
-                raise ValueError(f'no sources were found with the specified id:\n\t\t\t{id}')
-        elif name:
-            for source in sources:
-                if source.name.lower() == name.lower():
-                    selected_source = source
-            if not selected_source:
-                raise ValueError(f'no sources were found with the specified name:\n\t\t\t{name}')
-        elif keywords:
-            if type(keywords) is not list:
-                keywords = [keywords]
-                # raise ValueError('keywords parameter must be a list')
-            for source in sources:
-                if all(kw.lower() in source.keywords for kw in keywords):
-                    selected_source = source
-            if not selected_source:
-                raise ValueError(f'no sources were found with the specified keywords:\n\t\t\t{keywords}')
-        return selected_source
+        if keywords and type(keywords) is not list:
+            keywords = [keywords]
+        selected_source = self._lookup_source(id, name, keywords)
+        if selected_source:
+            return selected_source
+        if id:
+            raise ValueError(f'no sources were found with the specified id:\n\t\t\t{id}')
+        if name:
+            raise ValueError(f'no sources were found with the specified name:\n\t\t\t{name}')
+        raise ValueError(f'no sources were found with the specified keywords:\n\t\t\t{keywords}')
+
+    def _catalog(self):
+        """
+        :return:    self.catalog, loaded from Airfoil first if it is stale. A catalog that is due for a refresh is
+                    returned as it is, and reloaded by a background thread.
+        """
+        if self.catalog.stale:
+            self.get_sources()
+        elif self.catalog.refresh_due:
+            self.catalog.refreshing = True
+            threading.Thread(target=self._refresh_sources, daemon=True).start()
+        return self.catalog
+
+    def _refresh_sources(self):
+        try:
+            self.get_sources()
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.catalog.refreshing = False
+
+    def _lookup_source(self, id=None, name=None, keywords=[], unknown=None):
+        # a miss reloads the catalog once, unless it was just loaded, for sources added since it was loaded
+        loaded = self.catalog.loaded
+        source = self._catalog().find(id, name, keywords, unknown)
+        if source is None and self.catalog.loaded == loaded:
+            self.get_sources()
+            source = self.catalog.find(id, name, keywords, unknown)
+        return source
 
-    def watch(self):
+    def watch(self, reconnect=True):
         """
             Airfoil.watch is a Python generator that will yield all activity that occurs from Airfoil as changes occur.
             The following categories of events will be yielded from this generator as they occur, regardless of where
             they were initiated from:
                 "sourceMetadataChanged", "remoteControlChangedRequest", "speakerConnectedChanged",
                 "speakerListChanged",  "speakerNameChanged", "speakerPasswordChanged", "speakerVolumeChanged"
+            Only opening the subscription is limited by request_timeout.
+
+            With reconnect=True, a dropped connection, like when Airfoil restarts or the network blips, does not end
+            the generator. It reconnects with backoff (see reconnect_delay), looking up the port again if the old one
+            refuses connections, and subscribes again. Notifications sent while it was disconnected are lost, so
+            instead of the reply to the new subscription it yields a synthetic event holding the full speaker list:
+                {"request": "resynced", "data": {"speakers": [...]}}
+            The current source may also have changed in the meantime. Airfoil.state, if set, is marked not live
+            until the resynced event has been handled by whoever keeps it.
+
+            Subscribed connections use TCP keepalive (see keepalive), so a connection that went dead without being
+            closed is noticed within about a minute and handled like any other dropped connection.
+
+            The generator ends when the current deadline passes, and with reconnect=False, also when the connection
+            drops. Airfoil.cancel called from another thread makes it raise AirfoilCancelledError.
+        :param reconnect:   boolean, default True, reconnect and resubscribe when the connection drops
         """
         base_cmd = {"request": "subscribe", "requestID": "-1", "data": {
             "notifications": ["sourceMetadataChanged", "remoteControlChangedRequest", "speakerConnectedChanged",
                               "speakerListChanged",  "speakerNameChanged", "speakerPasswordChanged",
                               "speakerVolumeChanged"]}}
-        _, cmd = self._create_cmd(base_cmd)
-        for response in self._get_responses(cmd):
-            yield response
+        waiter = threading.Event()
+        with self.lock:
+            self.waiters.add(waiter)
+        subscribed, attempt = False, 0
+        try:
+            while True:
+                _, cmd = self._create_cmd(base_cmd)
+                error = None
+                try:
+                    for response in self._get_responses(cmd, stream=True):
+                        if subscribed and attempt and 'replyID' in response:
+                            response = {"request": RESYNCED, "data": {
+                                "speakers": (response.get('data') or {}).get('speakers', [])}}
+                        subscribed, attempt = True, 0
+                        yield response
+                except AirfoilCancelledError:
+                    raise
+                except OSError as e:
+                    if _deadline_passed():
+                        return
+                    if not reconnect:
+                        raise
+                    error = e
+                if self.state is not None:
+                    # notifications are missed until the subscription is back, so the mirror can't be trusted
+                    self.state.live = False
+                if not reconnect or _deadline_passed():
+                    return
+                if isinstance(error, ConnectionRefusedError) and attempt:
+                    self._relocate()
+                delay, left = reconnect_delay(attempt), _deadline.get()
+                left = None if left is None else max(0, left - time.time())
+                if waiter.wait(delay if left is None else min(delay, left)):
+                    raise AirfoilCancelledError('watching Airfoil was cancelled')
+                attempt += 1
+        finally:
+            with self.lock:
+                self.waiters.discard(waiter)
+
+    def _relocate(self):
+        located = relocate(self.ip, self.name, self.request_timeout or REQUEST_TIMEOUT)
+        if located:
+            self.ip, self.port = located
 
     def _media_cmd(self, kind):
         base_cmd = {"data": {"commandName": kind},
@@ -385,7 +896,7 @@ class Airfoil(object):
         """
         return self._media_cmd("PreviousTrack")
 
-    def get_speakers(self, ids=[], names=[]):
+    def get_speakers(self, ids=[], names=[], fresh=False):
         """
             Airfoil.get_speakers returns a list of Airfoil.speaker objects matching any ids or names that were passed
             as parameters. You can call this method with zero, one, or both parameters.
@@ -394,26 +905,23 @@ class Airfoil(object):
             -  no checks are performed to ensure that all ids and names match, so verify that the number of speakers
                returned matches what you expected.
             -  list of returned speakers is also saved to self.speakers
+            -  if self.state is set to an AirfoilState that is live, like one kept up to date from Airfoil.watch in
+               another thread, the speakers are read from it instead of from Airfoil.
         :param ids:     list of speaker ids, not case-sensitive
         :param names:   list of speaker names, not case-sensitive
+        :param fresh:   boolean, default False, always read the speakers from Airfoil
         :return:        list of Airfoil.speaker objects matching request
         """
-        base_cmd = {"data": { "notifications":
-            ["speakerListChanged", "speakerConnectedChanged", "speakerPasswordChanged",
-             "speakerVolumeChanged", "speakerNameChanged", "remoteControlChangedRequest"]},
-                    "_replyTypes": ["subscribe", "getSourceMetadata", "connectToSpeaker", "disconnectSpeaker",
-                                    "setSpeakerVolume", "getSourceList", "remoteCommand", "selectSource"],
-                    "request": "subscribe", "requestID": "-1"}
-
-        request_id, cmd = self._create_cmd(base_cmd)
+        if self.state is not None and self.state.live and not fresh:
+            self.speakers = self.state.get_speakers(ids=ids, names=names)
+            return self.speakers
+        request_id, cmd = self._create_cmd(self._subscribe_cmd())
         for response in self._get_responses(cmd):
             if 'data' in response:
                 if 'speakers' in response['data']:
                     speakers = []
                     for s in response['data']['speakers']:
-                        keywords = self.get_keywords(s.get('name'))
-                        spk = self.speaker(s.get('name'), s.get('type'), s.get('longIdentifier'), s.get('volume'),
-                                           s.get('connected'), s.get('password'), keywords)
+                        spk = self._speaker(s)
                         if ids or names:
                             if spk.id in ids or spk.name in names:
                                 speakers.append(spk)
@@ -422,7 +930,7 @@ class Airfoil(object):
                     self.speakers = speakers
                     return speakers
 
-    def connect_speaker(self, *, id=None, name=None, keywords=[]):
+    def connect_speaker(self, *, id=None, name=None, keywords=[], confirm=False):
         """
         Airfoil.connect_speaker will tell Airfoil to connect one speaker based on the id, name, or keywords given as a
          parameter. Only one parameter is required; passing multiple parameters here will raise a ValueError exception.
@@ -431,6 +939,7 @@ class Airfoil(object):
         :param id:          speaker id, string, not case-sensitive
         :param name:        speaker name, string, not case-sensitive
         :param keywords:    speaker keywords, list of strings, not case-sensitive
+        :param confirm:     boolean, default False, read the state back from Airfoil instead of deriving it
         :return:            list with Airfoil.speaker object representing the speaker that was connected.
         """
         base_cmd = {"request": "connectToSpeaker", "requestID": "-1",
@@ -440,10 +949,10 @@ class Airfoil(object):
         if selected_speaker.connected:
             print(f'speaker \'{selected_speaker.name}\' is already connected')
         else:
-            self._get_result(base_cmd)
-        return self.get_speakers(ids=[selected_speaker.id])
+            selected_speaker = self._changed(selected_speaker, self._get_result(base_cmd), connected=True)
+        return self._speaker_state([selected_speaker], confirm)
 
-    def connect_speakers(self, *, ids=[], names=[]):
+    def connect_speakers(self, *, ids=[], names=[], confirm=False):
         """
         Airfoil.connect_speakers will tell Airfoil to connect multiple speakers based on the names or ids that are
         given as parameters. You can call this method with zero, one, or both parameters.
@@ -462,37 +971,34 @@ class Airfoil(object):
             [speaker.id for speaker in Airfoil.speakers if not speaker.connected] -> list of speakers not connected
         :param ids:     list of speaker ids, not case-sensitive
         :param names:   list of speaker names, not case-sensitive
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:        list of Airfoil.speaker objects matching request
         """
-        self.get_speakers()
-        to_change = []
-        for speaker in self.speakers:
-            if (ids and speaker.id.lower() in [id.lower() for id in ids]) or \
-                    (names and speaker.name.lower() in [name.lower() for name in names]) or \
-                    (not ids and not names):
-                to_change.append(speaker.id)
-        for id in to_change:
-            self.connect_speaker(id=id)
-        return self.get_speakers(ids=to_change)
+        return self._group_cmd(self._select(ids, names), 'connect', lambda s: {'connected': True},
+                               lambda s, changes: {"request": "connectToSpeaker", "requestID": "-1",
+                                                   "data": {"longIdentifier": s.id}},
+                               confirm)
 
-    def connect_some(self, *, ids=[], names=[]):
+    def connect_some(self, *, ids=[], names=[], confirm=False):
         """
         Airfoil.connect_some is an alias for Airfoil.connect_speakers. See documentation for Airfoil.connect_speakers.
         :param ids:     list of speaker ids, not case-sensitive
         :param names:   list of speaker names, not case-sensitive
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:        list of Airfoil.speaker objects matching request
         """
-        return self.connect_speakers(ids=ids, names=names)
+        return self.connect_speakers(ids=ids, names=names, confirm=confirm)
 
-    def connect_all(self):
+    def connect_all(self, confirm=False):
         """
         Airfoil.connect_all is an alias for Airfoil.connect_speakers() called with no parameters. This method will tell
         Airfoil to connect every speaker that it can see. See documentation for Airfoil.connect_speakers.
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:        list of Airfoil.speaker objects matching request
         """
-        return self.connect_speakers()
+        return self.connect_speakers(confirm=confirm)
 
-    def disconnect_speaker(self, *, id=None, name=None, keywords=[]):
+    def disconnect_speaker(self, *, id=None, name=None, keywords=[], confirm=False):
         """
         Airfoil.disconnect_speaker will tell Airfoil to disconnect one speaker based on the id, name, or keywords given
          as a parameter. Only one parameter is required; passing multiple parameters will raise a ValueError exception.
@@ -500,6 +1006,7 @@ class Airfoil(object):
         :param id:          speaker id, string, not case-sensitive
         :param name:        speaker name, string, not case-sensitive
         :param keywords:    speaker keywords, list of strings, not case-sensitive
+        :param confirm:     boolean, default False, read the state back from Airfoil instead of deriving it
         :return:            list with Airfoil.speaker object representing the speaker that was connected.
         """
         base_cmd = {"request": "disconnectSpeaker", "requestID": "-1",
@@ -509,10 +1016,10 @@ class Airfoil(object):
         if not selected_speaker.connected:
             print(f'speaker \'{selected_speaker.name}\' is already disconnected')
         else:
-            self._get_result(base_cmd)
-        return self.get_speakers(ids=[selected_speaker.id])
+            selected_speaker = self._changed(selected_speaker, self._get_result(base_cmd), connected=False)
+        return self._speaker_state([selected_speaker], confirm)
 
-    def disconnect_speakers(self, *, ids=[], names=[]):
+    def disconnect_speakers(self, *, ids=[], names=[], confirm=False):
         """
             Airfoil.disconnect_speakers will tell Airfoil to disconnect multiple speakers based on the names or ids that
             are given as parameters. You can call this method with zero, one, or both parameters.
@@ -531,38 +1038,112 @@ class Airfoil(object):
                 [speaker.id for speaker in Airfoil.speakers if speaker.connected] -> list of speakers still connected
             :param ids:     list of speaker ids, not case-sensitive
             :param names:   list of speaker names, not case-sensitive
+            :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
             :return:        list of Airfoil.speaker objects matching request
             """
-        self.get_speakers()
-        to_change = []
-        for speaker in self.speakers:
-            if (ids and speaker.id.lower() in [id.lower() for id in ids]) or \
-                    (names and speaker.name.lower() in [name.lower() for name in names]) or \
-                    (not ids and not names):
-                to_change.append(speaker.id)
-        for id in to_change:
-            self.disconnect_speaker(id=id)
-        return self.get_speakers(ids=to_change)
-
-    def disconnect_some(self, *, ids=[], names=[]):
+        return self._group_cmd(self._select(ids, names), 'disconnect', lambda s: {'connected': False},
+                               lambda s, changes: {"request": "disconnectSpeaker", "requestID": "-1",
+                                                   "data": {"longIdentifier": s.id}},
+                               confirm)
+
+    def disconnect_some(self, *, ids=[], names=[], confirm=False):
         """
         Airfoil.disconnect_some is an alias for Airfoil.disconnect_speakers.
          See documentation for Airfoil.disconnect_speakers.
         :param ids:     list of speaker ids, not case-sensitive
         :param names:   list of speaker names, not case-sensitive
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:        list of Airfoil.speaker objects matching request
         """
-        return self.disconnect_speakers(ids=ids, names=names)
+        return self.disconnect_speakers(ids=ids, names=names, confirm=confirm)
 
-    def disconnect_all(self):
+    def disconnect_all(self, confirm=False):
         """
         Airfoil.disconnect_all is an alias for Airfoil.disconnect_speakers() called with no parameters. This method will
          tell Airfoil to disconnect all currently connected speakers. See documentation for Airfoil.disconnect_speakers.
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:        list of Airfoil.speaker objects matching request
         """
-        return self.disconnect_speakers()
+        return self.disconnect_speakers(confirm=confirm)
+
+    def connect_future(self, *, id=None, name=None, keywords=[], timeout=CONFIRM_TIMEOUT):
+        """
+        Airfoil.connect_future tells Airfoil to connect one speaker like Airfoil.connect_speaker does, but returns a
+        concurrent.futures.Future that is resolved when Airfoil reports the speaker connected. Connecting Chromecast
+        and AirPlay speakers goes on for a while after Airfoil accepted the command, so this tells when the speaker
+        actually connected, without reading the speakers over and over.
+        - the result of the future is the Airfoil.speaker object after the change.
+        - if the speaker is already connected, the future is resolved right away.
+        - if Airfoil does not accept the command, the future is resolved with the speaker as it was.
+        - if Airfoil does not report the speaker connected within timeout seconds, the future raises
+          AirfoilTimeoutError.
+        :param id:          speaker id, string, not case-sensitive
+        :param name:        speaker name, string, not case-sensitive
+        :param keywords:    speaker keywords, list of strings, not case-sensitive
+        :param timeout:     int, float, or None, seconds to wait for Airfoil to report the speaker connected
+        :return:            concurrent.futures.Future
+        """
+        return self._confirmed([self.find_speaker(id, name, keywords)], True, timeout)[0]
+
+    def connect_futures(self, *, ids=[], names=[], timeout=CONFIRM_TIMEOUT):
+        """
+        Airfoil.connect_futures works like Airfoil.connect_future, for the speakers Airfoil.connect_speakers would
+        connect. To wait until all of them are connected:
+            concurrent.futures.wait(airfoil.connect_futures(names=['Kitchen', 'Office']))
+        :param ids:     list of speaker ids, not case-sensitive
+        :param names:   list of speaker names, not case-sensitive
+        :param timeout: int, float, or None, seconds to wait for Airfoil to report each speaker connected
+        :return:        list of concurrent.futures.Future objects, one for each speaker
+        """
+        return self._confirmed(self._select(ids, names), True, timeout)
 
-    def toggle_speaker(self, *, id=None, name=None, keywords=[]):
+    def disconnect_future(self, *, id=None, name=None, keywords=[], timeout=CONFIRM_TIMEOUT):
+        """
+        Airfoil.disconnect_future works like Airfoil.connect_future, but disconnects the speaker.
+         See documentation for Airfoil.connect_future.
+        :param id:          speaker id, string, not case-sensitive
+        :param name:        speaker name, string, not case-sensitive
+        :param keywords:    speaker keywords, list of strings, not case-sensitive
+        :param timeout:     int, float, or None, seconds to wait for Airfoil to report the speaker disconnected
+        :return:            concurrent.futures.Future
+        """
+        return self._confirmed([self.find_speaker(id, name, keywords)], False, timeout)[0]
+
+    def disconnect_futures(self, *, ids=[], names=[], timeout=CONFIRM_TIMEOUT):
+        """
+        Airfoil.disconnect_futures works like Airfoil.connect_futures, but disconnects the speakers.
+         See documentation for Airfoil.connect_future.
+        :param ids:     list of speaker ids, not case-sensitive
+        :param names:   list of speaker names, not case-sensitive
+        :param timeout: int, float, or None, seconds to wait for Airfoil to report each speaker disconnected
+        :return:        list of concurrent.futures.Future objects, one for each speaker
+        """
+        return self._confirmed(self._select(ids, names), False, timeout)
+
+    def _confirmed(self, speakers, connected, timeout):
+        """
+        send connect or disconnect commands to speakers after the subscription that confirms them is open.
+        :return:    list of concurrent.futures.Future objects, in the order of speakers
+        """
+        futures = self.confirmations.expect(speakers, connected, timeout)
+        request = "connectToSpeaker" if connected else "disconnectSpeaker"
+
+        def send(item):
+            speaker, future = item
+            try:
+                base_cmd = {"request": request, "requestID": "-1", "data": {"longIdentifier": speaker.id}}
+                if not self._get_result(base_cmd):
+                    self.confirmations.resolve([(future, speaker, None)])
+            except OSError as e:
+                self.confirmations.resolve([(future, None, e)])
+
+        waiting = [(s, f) for s, f in zip(speakers, futures) if not f.done()]
+        if waiting:
+            with self._pool(len(waiting)) as pool:
+                self._map(pool, send, waiting)
+        return futures
+
+    def toggle_speaker(self, *, id=None, name=None, keywords=[], confirm=False):
         """
         Airfoil.toggle_speaker will tell Airfoil to disconnect and then reconnect one speaker based on the id, name, or
          keywords given as a parameter. This is useful for scenarios where the the sound stops working after changing a
@@ -572,18 +1153,20 @@ class Airfoil(object):
         :param id:          speaker id, string, not case-sensitive
         :param name:        speaker name, string, not case-sensitive
         :param keywords:    speaker keywords, list of strings, not case-sensitive
+        :param confirm:     boolean, default False, read the state back from Airfoil instead of deriving it
         :return:            list with Airfoil.speaker object representing the speaker that was toggled.
         """
-        selected_speaker = self.find_speaker(id, name, keywords)
-        result = None
-        if selected_speaker.connected:
-            result = self.disconnect_speaker(id=selected_speaker.id)[0]
-        if result and not result.connected or not selected_speaker.connected:
-            return self.connect_speaker(id=selected_speaker.id)
-        else:
-            return []
+        was_connected = []
+        def select(speakers):
+            selected_speaker = self.find_speaker(id, name, keywords, speakers=speakers)
+            was_connected.append(selected_speaker.connected)
+            return [selected_speaker]
+
+        speakers = self._toggle(select, confirm)
+        # a speaker that did not disconnect was not toggled
+        return [] if was_connected[0] and self.results[0].status == 'failed' and speakers[0].connected else speakers
 
-    def toggle_speakers(self, *, ids=[], names=[], include_disconnected=False):
+    def toggle_speakers(self, *, ids=[], names=[], include_disconnected=False, confirm=False):
         """
             Airfoil.toggle_speakers will disconnect and then reconnect multiple speakers based on the
             names or ids that are given as parameters. You can call this method with zero, one, or both ids and names
@@ -599,9 +1182,10 @@ class Airfoil(object):
 
             Note on group commands: All commands that work on a collection of speakers like this will parse the given
             parameters into a list of speakers, and then give Airfoil individual commands for each change to each
-            speaker. Calling this method with 10 speaker ids will result in 20 separate commands sent to Airfoil, with
-            all the currently connected speakers disconnected sequentially, and then all speakers will be reconnected
-            sequentially . This may take some time, and the method will not return until all actions have completed.
+            speaker. Calling this method with 10 speaker ids will result in 20 separate commands sent to Airfoil,
+            up to max_concurrency at a time: all the currently connected speakers are disconnected at once, and once
+            Airfoil reports them disconnected, all speakers are reconnected at once. The method will not return until
+            Airfoil reported every speaker connected again, or request_timeout passed in one of the two steps.
             Check the list of speakers that is returned to ensure all its properties have the expected values, such as
             with:
                 [speaker.id for speaker in Airfoil.speakers if not speaker.connected] -> list of speakers that did not
@@ -609,49 +1193,130 @@ class Airfoil(object):
             :param ids:     list of speaker ids, not case-sensitive
             :param names:   list of speaker names, not case-sensitive
             :param include_disconnected:    boolean, default False, also toggle speakers that are disconnected
+            :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
             :return:        list of Airfoil.speaker objects showing their state after your request
             """
-        self.get_speakers()
-        to_change = []
-        for speaker in self.speakers:
-            if (ids and speaker.id.lower() in [id.lower() for id in ids]) or\
-                (names and speaker.name.lower() in [name.lower() for name in names]) or\
-                    (not ids and not names) and\
-                    (include_disconnected or speaker.connected):
-                to_change.append(speaker.id)
-        for id in to_change:
-            self.disconnect_speaker(id=id)
-        for id in to_change:
-            self.connect_speaker(id=id)
-        return self.get_speakers(ids=to_change)
-
-    def toggle_some(self, *, ids=[], names=[], include_disconnected=False):
+        return self._toggle(lambda speakers: self._select(ids, names, include_disconnected, speakers), confirm)
+
+    def _toggle(self, select, confirm):
+        """
+        toggle speakers in two phases, following Airfoil's notifications on one subscribed connection instead of
+        reading the speakers back. The speakers are read from the reply to the subscription. Then every disconnect is
+        sent at once, and only once Airfoil reported each of those speakers disconnected with speakerConnectedChanged,
+        or request_timeout passed, every connect is sent at once and waited for the same way. Connecting a speaker
+        before Airfoil finished disconnecting it can leave it stuck. The outcome for each speaker is saved to
+        self.results.
+        :param select:  callable taking the list of all speakers and returning the ones to toggle
+        :param confirm: boolean, read the state back from Airfoil instead of deriving it
+        :return:        list of Airfoil.speaker objects after the toggle
+        """
+        state = {'speakers': None, 'closed': False}
+        connected = {}
+        subscription, cmd = self._create_cmd(self._subscribe_cmd())
+        responses = self._get_responses(cmd, stream=True, idle=NOTIFICATION_POLL)
+
+        def wait(done):
+            # read messages until done() or until request_timeout passes
+            ends = None if self.request_timeout is None else time.time() + self.request_timeout
+            while not done() and (ends is None or time.time() < ends):
+                if state['closed']:
+                    # no more notifications will come, only the commands still running are waited for
+                    time.sleep(NOTIFICATION_POLL)
+                    continue
+                try:
+                    message = next(responses, False)
+                except AirfoilCancelledError:
+                    raise
+                except ConnectionError:
+                    # once the speakers are read, a dropped subscription only costs the notifications
+                    if state['speakers'] is None:
+                        raise
+                    message = False
+                if message is False:
+                    state['closed'] = True
+                    continue
+                data = (message or {}).get('data') or {}
+                if message and message.get('replyID') == subscription:
+                    state['speakers'] = [self._speaker(s) for s in data.get('speakers', [])]
+                elif message and message.get('request') == 'speakerConnectedChanged':
+                    connected[data.get('longIdentifier')] = data.get('connected')
+
+        def phase(pool, request, speakers, target):
+            # :return: dict of speaker id to whether the speaker reached target. A command that failed or did not
+            #          finish in time counts as not reaching it, unless a notification said otherwise.
+            sent = {}
+            for speaker in speakers:
+                connected.pop(speaker.id, None)
+                sent[speaker.id] = pool.submit(contextvars.copy_context().run, self._get_result,
+                                               {"request": request, "requestID": "-1",
+                                                "data": {"longIdentifier": speaker.id}})
+            wait(lambda: all(f.done() and (f.exception() or not f.result() or state['closed'] or
+                                           connected.get(i) == target) for i, f in sent.items()))
+            return {i: connected.get(i) == target or bool(f.done() and not f.exception() and f.result())
+                    for i, f in sent.items()}
+
+        try:
+            wait(lambda: state['speakers'] is not None)
+            if state['speakers'] is None and state['closed']:
+                raise ConnectionError(f'Airfoil at {self.ip}:{self.port} closed the subscription before replying')
+            if state['speakers'] is None:
+                raise AirfoilTimeoutError(f'Airfoil at {self.ip}:{self.port} did not reply within '
+                                          f'{self.request_timeout} seconds')
+            speakers = select(state['speakers'])
+            with self._pool(len(speakers)) as pool:
+                disconnected = phase(pool, 'disconnectSpeaker', [s for s in speakers if s.connected], False)
+                # a speaker that did not disconnect is not connected again
+                reconnected = phase(pool, 'connectToSpeaker',
+                                    [s for s in speakers if not s.connected or disconnected[s.id]], True)
+        finally:
+            responses.close()
+
+        self.results = []
+        for speaker in speakers:
+            success = reconnected.get(speaker.id, False)
+            if disconnected.get(speaker.id):
+                speaker = speaker._replace(connected=False)
+            speaker = self._changed(speaker, success, connected=True)
+            if speaker.id in connected:
+                speaker = speaker._replace(connected=connected[speaker.id])
+            self.results.append(self.result(speaker, 'toggle', 'changed' if success else 'failed'))
+        return self._speaker_state([r.speaker for r in self.results], confirm)
+
+    def toggle_some(self, *, ids=[], names=[], include_disconnected=False, confirm=False):
         """
         Airfoil.toggle_some is an alias for Airfoil.toggle_speakers.
          See documentation for Airfoil.toggle_speakers.
         :param ids:     list of speaker ids, not case-sensitive
         :param names:   list of speaker names, not case-sensitive
         :param include_disconnected:    boolean, default False, also toggle speakers that are disconnected
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:        list of Airfoil.speaker objects showing their state after your request"""
-        return self.toggle_speakers(ids=ids, names=names, include_disconnected=include_disconnected)
+        return self.toggle_speakers(ids=ids, names=names, include_disconnected=include_disconnected, confirm=confirm)
 
-    def toggle_all(self, include_disconnected=False):
+    def toggle_all(self, include_disconnected=False, confirm=False):
         """
         Airfoil.toggle_all is an alias for Airfoil.toggle_speakers called with no ids or names. This method will toggle
         all currently connected speakers. See documentation for Airfoil.toggle_speakers.
         :param include_disconnected:    boolean, default False, also toggle speakers that are disconnected
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:        list of Airfoil.speaker objects showing their state after your request
         """
-        return self.toggle_speakers(include_disconnected=include_disconnected)
+        return self.toggle_speakers(include_disconnected=include_disconnected, confirm=confirm)
 
-    def get_sources(self, source_icon=False):
+    def get_sources(self, source_icon=False, cached=False):
         """
         Airfoil.get_sources will return all of the current sources that Airfoil can see as a list of Airfoil.source
         objects. By default, the source_icon for sources is not returned, but if you set source_icon=True, a base64
         encoded image will be included in the Airfoil.source objects.
+        Every read also reloads Airfoil.catalog, the SourceCatalog that find_source and set_source look sources up in.
         :param source_icon:
+        :param cached:  boolean, default False, return the sources in Airfoil.catalog, unless it is stale, instead of
+                        reading them from Airfoil. Ignored with source_icon=True, since the catalog holds no icons.
         :return: list of Airfoil.source objects representing a
         """
+        if cached and not source_icon:
+            self.sources = list(self._catalog().sources)
+            return self.sources
         base_cmd = {"request": "getSourceList", "requestID": "-1",
                     "data": {"iconSize": 10, "scaleFactor": 1}}
         request_id, cmd = self._create_cmd(base_cmd)
@@ -672,10 +1337,11 @@ class Airfoil(object):
                     add_to_source(src, type='recent_apps')
                 for src in data.get('systemAudio', []):
                     add_to_source(src, type='system_audio')
+                self.catalog.load([s._replace(icon='') for s in sources] if source_icon else sources)
                 self.sources = sources
                 return sources
 
-    def set_source(self, *, name=None, id=None, keywords=[]):
+    def set_source(self, *, name=None, id=None, keywords=[], confirm=False):
         """
         Airfoil.set_source with set the current source to the source matching the id, name, or keywords given as a
         parameter. Only one parameter is required; passing multiple parameters here will raise a ValueError
@@ -683,6 +1349,7 @@ class Airfoil(object):
         :param name:        source id, string, not case-sensitive
         :param id:          source name, string, not case-sensitive
         :param keywords:    source keywords, string, not case-sensitive
+        :param confirm:     boolean, default False, read the state back from Airfoil instead of deriving it
         :return:            Airfoil.current_source object representing current source after sending command to Airfoil.
         """
         types = {'audio_device': 'audioDevices', 'running_apps': 'runningApplications',
@@ -694,30 +1361,20 @@ class Airfoil(object):
             raise ValueError('only one keyword parameter can be passed to set_source.'
                              '\n\tmust pass only one: name, id, or keywords,'
                              '\n\tor pass no parameters to select system audio.')
-        if not self.sources:
-            self.get_sources()
-        self.get_current_source()
-        selected_source = None
         if not name and not id and not keywords:
-            for source in self.sources:
-                if source.name == 'System Audio':
-                    selected_source = source
+            selected_source = self._lookup_source(name='System Audio')
+            if not selected_source:
+                raise ValueError('no System Audio source was found')
         elif id:
-            for source in self.sources:
-                if source.id.lower() == id.lower():
-                    selected_source = source
+            selected_source = self._lookup_source(id=id)
             if not selected_source:
                 raise ValueError(f'no source with specified id was found: {id}')
         elif name:
-            for source in self.sources:
-                if source.name.lower() == name.lower():
-                    selected_source = source
+            selected_source = self._lookup_source(name=name)
             if not selected_source:
                 raise ValueError(f'no source with specified name was found: {name}')
-        elif keywords:
-            for source in self.sources:
-                if all(kw.lower() in source.keywords for kw in keywords):
-                    selected_source = source
+        else:
+            selected_source = self._lookup_source(keywords=keywords)
             if not selected_source:
                 raise ValueError(f'no source with specified keywords was found: {keywords}')
 
@@ -727,7 +1384,13 @@ class Airfoil(object):
         request_id, cmd = self._create_cmd(base_cmd)
         for response in self._get_responses(cmd):
             if response.get('replyID', None) == request_id:
-                return self.get_current_source()
+                if not response.get('data', {}).get('success', False):
+                    # the source may be gone, like an application that was closed since the catalog was loaded
+                    self.catalog.invalidate()
+                    return self.get_current_source()
+                if confirm:
+                    return self.get_current_source()
+                return self.current_source(selected_source.name, None, None, None, None, None, None, None, None)
                 # try:
                 #     return response['data']['success']
                 # except KeyError as e:
@@ -780,7 +1443,7 @@ class Airfoil(object):
                                              meta.get('machineIconAndScreenshot', None))
                 return result
 
-    def set_volume(self, volume, *, id=None, name=None, keywords=[]):
+    def set_volume(self, volume, *, id=None, name=None, keywords=[], confirm=False, coalesce=False):
         """
         Airfoil.set_volume will set the volume level for one speaker based on the id, name, or
          keywords given as a parameter. Only one parameter is required; passing multiple parameters will
@@ -789,18 +1452,25 @@ class Airfoil(object):
         :param id:          speaker id, string, not case-sensitive
         :param name:        speaker name, string, not case-sensitive
         :param keywords:    speaker keywords, list of strings, not case-sensitive
+        :param coalesce:    boolean or float, default False. collapse this change with other changes to the same
+                            speaker made from other threads within COALESCE_WINDOW, or within this many seconds, so
+                            only the latest volume is sent. See remoteFoil.coalescer.VolumeCoalescer.
         :return:            list with Airfoil.speaker object showing the speaker state after the command was sent
         """
+        if coalesce:
+            window = None if coalesce is True else float(coalesce)
+            return self.coalescer.set_volume(volume, id=id, name=name, keywords=keywords, confirm=confirm,
+                                             window=window)
         volume = self._parse_volume(volume)
         base_cmd = {"request": "setSpeakerVolume", "requestID": "-1", "data":
                     {"longIdentifier": None, "volume": volume}}
 
         selected_speaker = self.find_speaker(id, name, keywords)
         base_cmd['data']['longIdentifier'] = selected_speaker.id
-        self._get_result(base_cmd)
-        return self.get_speakers(ids=[selected_speaker.id])
+        selected_speaker = self._changed(selected_speaker, self._get_result(base_cmd), volume=volume)
+        return self._speaker_state([selected_speaker], confirm)
 
-    def set_volumes(self, volume, *, ids=[], names=[], include_disconnected=False):
+    def set_volumes(self, volume, *, ids=[], names=[], include_disconnected=False, confirm=False):
         """
         Airfoil.set_volumes will set the volume on a group of speakers based on the names and ids that are given as
          parameters, You can call this method with zero, one, or both ids and names parameters.
@@ -823,53 +1493,40 @@ class Airfoil(object):
         :param ids:     list of speaker ids, not case-sensitive
         :param names:   list of speaker names, not case-sensitive
         :param include_disconnected:    boolean, default False, also set volume on speakers that are disconnected
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:        list of affected Airfoil.speaker objects showing their state after your request
         """
-        ids = [i.lower() for i in ids]
-        names = [n.lower() for n in names]
         volume = self._parse_volume(volume)
-        if type(ids) is not list:
-            raise ValueError(f'ids must be a list of speaker ids, not \'{type(ids)}\'')
-        if type(names) is not list:
-            raise ValueError(f'names must be a list of speaker names, not \'{type(names)}\'')
-
-        self.get_speakers()
-        to_change = []
-        base_cmd = {"request": "setSpeakerVolume", "requestID": "-1", "data":
-            {"longIdentifier": None, "volume": volume}}
+        return self._group_cmd(self._select(ids, names, include_disconnected), 'volume', lambda s: {'volume': volume},
+                               lambda s, changes: {"request": "setSpeakerVolume", "requestID": "-1",
+                                                   "data": {"longIdentifier": s.id, "volume": volume}},
+                               confirm)
 
-        for speaker in self.speakers:
-            if (ids and speaker.id.lower() in ids) or\
-                    (names and speaker.name.lower() in names) or\
-                    (not ids and not names and (speaker.connected or include_disconnected)):
-                cmd = copy.deepcopy(base_cmd)
-                cmd['data']['longIdentifier'] = speaker.id
-                to_change.append(speaker.id)
-                self._get_result(cmd)
-        return self.get_speakers(ids=to_change)
-
-    def set_volume_some(self, volume, *, ids=[], names=[], include_disconnected=False):
+    def set_volume_some(self, volume, *, ids=[], names=[], include_disconnected=False, confirm=False):
         """
         Airfoil.set_volume_some is an alias for Airfoil.set_volumes. See documentation for Airfoil.set_volume_some.
         :param volume:  any valid value for volume is accepted
         :param ids:     list of speaker ids, not case-sensitive
         :param names:   list of speaker names, not case-sensitive
         :param include_disconnected:    boolean, default False, also set volume on speakers that are disconnected
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:        list of affected Airfoil.speaker objects showing their state after your request
         """
-        return self.set_volumes(volume, ids=ids, names=names, include_disconnected=include_disconnected)
+        return self.set_volumes(volume, ids=ids, names=names, include_disconnected=include_disconnected,
+                                confirm=confirm)
 
-    def set_volume_all(self, volume, include_disconnected=False):
+    def set_volume_all(self, volume, include_disconnected=False, confirm=False):
         """
         Airfoil.set_volume_all is an alias for Airfoil.set_volumes called with no names or ids. This method will set the
         volume on all currently connected speakers See documentation for Airfoil.set_volume_some.
         :param volume:  any valid value for volume is accepted
         :param include_disconnected:    boolean, default False, also set volume on speakers that are disconnected
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:        list of affected Airfoil.speaker objects showing their state after your request
         """
-        return self.set_volumes(volume, include_disconnected=include_disconnected)
+        return self.set_volumes(volume, include_disconnected=include_disconnected, confirm=confirm)
 
-    def fade_volume(self, end_volume, seconds, *, ticks=10, id=None, name=None, keywords=[]):
+    def fade_volume(self, end_volume, seconds, *, ticks=10, id=None, name=None, keywords=[], confirm=False):
         """
         Airfoil.fade_volume will transition the volume of the specified speaker from it's current volume to the
         specified end volume over a period of time defined by the seconds parameter.
@@ -890,6 +1547,7 @@ class Airfoil(object):
         :param id:          string, speaker id
         :param name:        string, speaker name
         :param keywords:    list of strings, sufficient keywords to uniquely identify speaker
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:    list with affected Airfoil.speaker object showing its state after your request
         """
         base_cmd = {"request": "setSpeakerVolume", "requestID": "-1", "data": {"longIdentifier": None, "volume": None}}
@@ -911,11 +1569,13 @@ class Airfoil(object):
             base_cmd['data']['volume'] = round(current_volume, 6)
             if i == ticks-1:
                 base_cmd['data']['volume'] = end_volume
-            self._get_result(base_cmd)
+            selected_speaker = self._changed(selected_speaker, self._get_result(base_cmd),
+                                             volume=base_cmd['data']['volume'])
             time.sleep(wait)
-        return self.get_speakers(ids=[selected_speaker.id])
+        return self._speaker_state([selected_speaker], confirm)
 
-    def fade_volumes(self, end_volume, seconds, *, ticks=10, ids=[], names=[], include_disconnected=False):
+    def fade_volumes(self, end_volume, seconds, *, ticks=10, ids=[], names=[], include_disconnected=False,
+                     confirm=False):
         """
         Airfoil.fade_volumes will transition the volume of a collection of speakers from their current volume to the
         specified end volume over a period of time defined by the seconds parameter. You can call this method with zero,
@@ -943,6 +1603,7 @@ class Airfoil(object):
         :param ids:     list of speaker ids, not case-sensitive
         :param names:   list of speaker names, not case-sensitive
         :param include_disconnected:    boolean, default False, also set volume on speakers that are disconnected
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:        list of affected Airfoil.speaker objects showing their state after your request
         """
 
@@ -959,39 +1620,44 @@ class Airfoil(object):
         if type(names) is not list:
             raise ValueError(f'names must be a list of speaker names, not \'{type(names)}\'')
 
-        self.get_speakers()
+        selected = self._select(ids, names, include_disconnected)
         speakers = []
         wait = round(seconds / ticks, 4)
         ids = [i.lower() for i in ids]
-        names = [n.lower() for n in names]
+        for id in ids:
+            if not any(speaker.id.lower() == id for speaker in selected):
+                raise ValueError(f'no speaker with id \'{id}\' was found')
 
-        for speaker in self.speakers:
-            if (ids and speaker.id.lower() in ids) \
-                    or (names and speaker.name.lower() in names)\
-                    or (not ids and not names and (speaker.connected or include_disconnected)):
+        skipped = [self.result(speaker, 'fade', 'skipped') for speaker in selected if speaker.volume == end_volume]
+        for speaker in selected:
+            if speaker.volume != end_volume:
                 cmd = copy.deepcopy(base_cmd)
                 cmd['data']['longIdentifier'] = speaker.id
                 increments = round((end_volume - speaker.volume) / ticks, 6)
                 speakers.append({'speaker': speaker,  'increments': increments,
-                                 'cmd': cmd, 'volume': speaker.volume})
-        if len(ids) != len(speakers):
-            for id in ids:
-                if not any([speaker['speaker'].id == id for speaker in speakers]):
-                    raise ValueError(f'no speaker with id \'{id}\' was found')
-
-        for i in range(0, ticks):
-            for speaker in speakers:
-                # print(speaker['speaker'].name)
-                speaker['volume'] += speaker['increments']
-                speaker['cmd']['data']['volume'] = round(speaker['volume'], 6)
-                if i == ticks-1:
-                    speaker['cmd']['data']['volume'] = end_volume
-                # print(speaker['cmd'])
-                self._get_result(speaker['cmd'])
-            time.sleep(wait)
-        return self.get_speakers(ids=[s['speaker'].id for s in speakers])
-
-    def fade_some(self, end_volume, seconds, *, ticks=10, ids=[], names=[], include_disconnected=False):
+                                 'cmd': cmd, 'volume': speaker.volume, 'success': False})
+
+        def tick(speaker, last):
+            speaker['volume'] += speaker['increments']
+            speaker['cmd']['data']['volume'] = round(speaker['volume'], 6)
+            if last:
+                speaker['cmd']['data']['volume'] = end_volume
+            speaker['success'] = self._get_result(speaker['cmd'])
+            speaker['speaker'] = self._changed(speaker['speaker'], speaker['success'],
+                                               volume=speaker['cmd']['data']['volume'])
+
+        with self._pool(len(speakers)) as pool:
+            for i in range(0, ticks):
+                self._map(pool, lambda speaker: tick(speaker, i == ticks - 1), speakers)
+                time.sleep(wait)
+        results = skipped + [self.result(s['speaker'], 'fade', 'changed' if s['success'] else 'failed')
+                             for s in speakers]
+        order = [speaker.id for speaker in selected]
+        self.results = sorted(results, key=lambda r: order.index(r.speaker.id))
+        return self._speaker_state([r.speaker for r in self.results], confirm)
+
+    def fade_some(self, end_volume, seconds, *, ticks=10, ids=[], names=[], include_disconnected=False,
+                  confirm=False):
         """
         Airfoil.fade_some is an alias for Airfoil.fade_volumes.
         See documentation for Airfoil.fade_some
@@ -1001,12 +1667,13 @@ class Airfoil(object):
         :param ids:     list of speaker ids, not case-sensitive
         :param names:   list of speaker names, not case-sensitive
         :param include_disconnected:    boolean, default False, also set volume on speakers that are disconnected
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:        list of affected Airfoil.speaker objects showing their state after your request
         """
         return self.fade_volumes(end_volume, seconds, ticks=ticks, ids=ids, names=names,
-                                 include_disconnected=include_disconnected)
+                                 include_disconnected=include_disconnected, confirm=confirm)
 
-    def fade_all(self, end_volume, seconds, *, ticks=10, include_disconnected=False):
+    def fade_all(self, end_volume, seconds, *, ticks=10, include_disconnected=False, confirm=False):
         """
         Airfoil.fade_all is an alias for Airfoil.fade_volumes called with no parameters. This method will change
         the volume on all currently connected speakers See documentation for Airfoil.fade_volumes.
@@ -1014,21 +1681,26 @@ class Airfoil(object):
         :param seconds:     positive float, length of time to change to take to change volume
         :param ticks:       int, number of increments between current volume and end volume.
         :param include_disconnected:    boolean, default False, also set volume on speakers that are disconnected
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:        list of affected Airfoil.speaker objects showing their state after your request
          """
-        return self.fade_volumes(end_volume, seconds, ticks=ticks, include_disconnected=include_disconnected)
+        return self.fade_volumes(end_volume, seconds, ticks=ticks, include_disconnected=include_disconnected,
+                                 confirm=confirm)
 
-    def mute(self, *, id=None, name=None, keywords=[]):
+    def mute(self, *, id=None, name=None, keywords=[], confirm=False):
         """
         Airfoil.mute will mute one speaker based on the id, name, or keywords given as a parameter. Muting a speaker
         sets the current volume to 0, but before doing so saves the current Airfoil.speaker object so it can be
         referenced when unmute is called.
             Airfoil.muted_speakers[speaker.id] = Airfoil.speaker object before mute; volume property has prior volume
+        Airfoil.muted_speakers is a MuteStore shared by every process on this machine and keyed by Airfoil's ip, so a
+        speaker muted here can be unmuted to its prior volume by another cli call or server worker.
         Only one parameter is required; passing multiple parameters will raise a ValueError exception.
 
         :param id:          speaker id, string, not case-sensitive
         :param name:        speaker name, string, not case-sensitive
         :param keywords:    speaker keywords, list of strings, not case-sensitive
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:            list with Airfoil.speaker object showing the speaker state after the command was sent
         """
         base_cmd = {"request": "setSpeakerVolume", "requestID": "-1", "data": {"longIdentifier": None, "volume": 0}}
@@ -1036,10 +1708,10 @@ class Airfoil(object):
         if selected_speaker.volume:
             self.muted_speakers[selected_speaker.id] = selected_speaker
             base_cmd['data']['longIdentifier'] = selected_speaker.id
-            self._get_result(base_cmd)
-        return self.get_speakers(ids=[selected_speaker.id])
+            selected_speaker = self._changed(selected_speaker, self._get_result(base_cmd), volume=0)
+        return self._speaker_state([selected_speaker], confirm)
 
-    def unmute(self, *, default_volume=1.0, id=None, name=None, keywords=[]):
+    def unmute(self, *, default_volume=1.0, id=None, name=None, keywords=[], confirm=False):
         """
         Airfoil.unmute will unmute one speaker based on the id, name, or keywords given as a parameter.
         - A request to unmute a speaker that is not muted (volume=0) will be ignored
@@ -1054,22 +1726,23 @@ class Airfoil(object):
         :param id:          speaker id, string, not case-sensitive
         :param name:        speaker name, string, not case-sensitive
         :param keywords:    speaker keywords, list of strings, not case-sensitive
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:            list with Airfoil.speaker object showing the speaker state after the command was sent
         """
         base_cmd = {"request": "setSpeakerVolume", "requestID": "-1", "data": {"longIdentifier": None, "volume": None}}
         selected_speaker = self.find_speaker(id, name, keywords)
         base_cmd['data']['longIdentifier'] = selected_speaker.id
         if not selected_speaker.volume:
-            muted_speaker = self.muted_speakers.get(selected_speaker.id, None)
+            muted_speaker = self.muted_speakers.pop(selected_speaker.id, None)
             if muted_speaker:
                 base_cmd['data']['volume'] = muted_speaker.volume
-                del self.muted_speakers[selected_speaker.id]
             else:
                 base_cmd['data']['volume'] = self._parse_volume(default_volume)
-            self._get_result(base_cmd)
-        return self.get_speakers(ids=[selected_speaker.id])
+            selected_speaker = self._changed(selected_speaker, self._get_result(base_cmd),
+                                             volume=base_cmd['data']['volume'])
+        return self._speaker_state([selected_speaker], confirm)
 
-    def mute_some(self, *, ids=[], names=[], include_disconnected=False):
+    def mute_some(self, *, ids=[], names=[], include_disconnected=False, confirm=False):
         """
         Airfoil.mute_some will tell Airfoil to mute multiple speakers based on the names or ids that are
         given as parameters. You can call this method with zero, one, or both parameters.
@@ -1091,31 +1764,17 @@ class Airfoil(object):
         :param ids:     list of speaker ids, not case-sensitive
         :param names:   list of speaker names, not case-sensitive
         :param include_disconnected:
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:        list of Airfoil.speaker objects matching request
         """
-        if type(ids) is not list:
-            raise ValueError(f'ids must be a list of speaker ids, not \'{type(ids)}\'')
-        if type(names) is not list:
-            raise ValueError(f'names must be a list of speaker names, not \'{type(names)}\'')
-        self.get_speakers()
-        ids = [i.lower() for i in ids]
-        names = [n.lower() for n in names]
+        def mute(speaker, changes):
+            self.muted_speakers[speaker.id] = speaker
+            return {"request": "setSpeakerVolume", "requestID": "-1",
+                    "data": {"longIdentifier": speaker.id, "volume": 0}}
+        return self._group_cmd(self._select(ids, names, include_disconnected), 'mute', lambda s: {'volume': 0}, mute,
+                               confirm)
 
-        muted = []
-        base_cmd = {"request": "setSpeakerVolume", "requestID": "-1", "data": {"longIdentifier": None, "volume": 0}}
-        for speaker in self.speakers:
-            if (ids and speaker.id.lower() in ids) \
-                    or (names and speaker.name.lower() in names) \
-                    or (not ids and not names and (speaker.connected or include_disconnected)):
-                if speaker.volume:
-                    cmd = copy.deepcopy(base_cmd)
-                    cmd['data']['longIdentifier'] = speaker.id
-                    self.muted_speakers[speaker.id] = speaker
-                    self._get_result(cmd)
-                muted.append(speaker.id)
-        return self.get_speakers(ids=muted)
-
-    def unmute_some(self, *, ids=[], names=[], default_volume=1.0, include_disconnected=False):
+    def unmute_some(self, *, ids=[], names=[], default_volume=1.0, include_disconnected=False, confirm=False):
         """
         Airfoil.unmute_some will tell Airfoil to unmute multiple speakers based on the names or ids that are
         given as parameters. You can call this method with zero, one, or both parameters.
@@ -1137,73 +1796,138 @@ class Airfoil(object):
         :param ids:     list of speaker ids, not case-sensitive
         :param names:   list of speaker names, not case-sensitive
         :param include_disconnected:  boolean, default False, also unmute speakers that are disconnected
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:        list of Airfoil.speaker objects matching request
         """
-        if type(ids) is not list:
-            raise ValueError(f'ids must be a list of speaker ids, not \'{type(ids)}\'')
-        if type(names) is not list:
-            raise ValueError(f'names must be a list of speaker names, not \'{type(names)}\'')
-        self.get_speakers()
-        ids = [i.lower() for i in ids]
-        names = [n.lower() for n in names]
-        unmuted = []
-        base_cmd = {"request": "setSpeakerVolume", "requestID": "-1", "data": {"longIdentifier": None, "volume": 0}}
-        for speaker in self.speakers:
-            if (ids and speaker.id.lower() in ids) \
-                    or (names and speaker.name.lower() in names) \
-                    or (not ids and not names and (speaker.connected or include_disconnected)):
-                if not speaker.volume:
-                    cmd = copy.deepcopy(base_cmd)
-                    cmd['data']['longIdentifier'] = speaker.id
-                    if speaker.id in self.muted_speakers:
-                        volume = self.muted_speakers[speaker.id].volume
-                    else:
-                        volume = self._parse_volume(default_volume)
-                    cmd['data']['volume'] = volume
-                    self._get_result(cmd)
-                unmuted.append(speaker.id)
-        return self.get_speakers(ids=unmuted)
-
-    def mutes(self, *, ids=[], names=[], include_disconnected=False):
+        def target(speaker):
+            # one pop per speaker reads and forgets the saved volume in a single MuteStore transaction
+            muted_speaker = self.muted_speakers.pop(speaker.id, None)
+            if speaker.volume:
+                return {'volume': speaker.volume}
+            if muted_speaker:
+                return {'volume': muted_speaker.volume}
+            return {'volume': self._parse_volume(default_volume)}
+
+        def unmute(speaker, changes):
+            return {"request": "setSpeakerVolume", "requestID": "-1",
+                    "data": {"longIdentifier": speaker.id, "volume": changes['volume']}}
+        return self._group_cmd(self._select(ids, names, include_disconnected), 'unmute', target, unmute, confirm)
+
+    def mutes(self, *, ids=[], names=[], include_disconnected=False, confirm=False):
         """
         Airfoil.mutes is an alias for Airfoil.mute_some.
          See documentation for Airfoil.mute_some.
         :param ids:     list of speaker ids, not case-sensitive
         :param names:   list of speaker names, not case-sensitive
         :param include_disconnected:   boolean, default False, also mute speakers that are disconnected
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:        list of Airfoil.speaker objects matching request
         """
-        return self.mute_some(ids=ids, names=names, include_disconnected=include_disconnected)
+        return self.mute_some(ids=ids, names=names, include_disconnected=include_disconnected, confirm=confirm)
 
-    def unmutes(self, *, ids=[], names=[], default_volume=1.0, include_disconnected=False):
+    def unmutes(self, *, ids=[], names=[], default_volume=1.0, include_disconnected=False, confirm=False):
         """
         Airfoil.unmutes is an alias for Airfoil.unmute_some.
          See documentation for Airfoil.unmute_some.
         :param ids:     list of speaker ids, not case-sensitive
         :param names:   list of speaker names, not case-sensitive
         :param include_disconnected:    boolean, default False, also unmute speakers that are disconnected
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:                        list of Airfoil.speaker objects matching request
         """
         return self.unmute_some(ids=ids, names=names, default_volume=default_volume,
-                                include_disconnected=include_disconnected)
+                                include_disconnected=include_disconnected, confirm=confirm)
 
-    def mute_all(self, include_disconnected=False):
+    def mute_all(self, include_disconnected=False, confirm=False):
         """
         Airfoil.mute_all is an alias for Airfoil.mute_some called with no parameters
          See documentation for Airfoil.mute_some
         :param include_disconnected:    boolean, default False, also mute speakers that are disconnected
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:                        list of Airfoil.speaker objects matching request
         """
-        return self.mute_some(include_disconnected=include_disconnected)
+        return self.mute_some(include_disconnected=include_disconnected, confirm=confirm)
 
-    def unmute_all(self, default_volume=1.0, include_disconnected=False):
+    def unmute_all(self, default_volume=1.0, include_disconnected=False, confirm=False):
         """
         Airfoil.unmute_all is an alias for Airfoil.unmute_some called with no parameters
          See documentation for Airfoil.unmute_some
         :param include_disconnected:    boolean, default False, also unmute speakers that are disconnected
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
         :return:                        list of Airfoil.speaker objects matching request
         """
-        return self.unmute_some(default_volume=default_volume, include_disconnected=include_disconnected)
+        return self.unmute_some(default_volume=default_volume, include_disconnected=include_disconnected,
+                                confirm=confirm)
+
+    def apply_scene(self, scene, targets=None, state=None, confirm=False):
+        """
+        Airfoil.apply_scene brings Airfoil to the state described by a scene, sending only the commands needed to get
+        there from the current state. See remoteFoil.scenes.Scene for the scene document. The connects and
+        disconnects are sent at once, then the volume changes, like group commands, and the outcome of each command
+        is saved to self.results.
+        :param scene:   remoteFoil.scenes.Scene object, or a scene document
+        :param targets: speaker targets already resolved for this instance, as returned by SceneStore.resolve
+        :param state:   AirfoilState holding the current speakers, if they were just read. fetched if not given.
+        :param confirm: boolean, default False, read the state back from Airfoil instead of deriving it
+        :return:        tuple of the list of Scene.step objects that were sent, the speakers in the scene after the
+                        commands, and the speakers that did not reach their targets
+        """
+        from remoteFoil.airfoil_state import AirfoilState
+        from remoteFoil.scenes import Scene
+        if not isinstance(scene, Scene):
+            scene = Scene.parse(scene)
+        if state is None:
+            state = AirfoilState()
+            state.load_speakers(self.get_speakers())
+        if targets is None or any(id not in state.speakers for id in targets):
+            targets = scene.resolve(state)
+        steps = scene.diff(state, targets)
+
+        def target(step):
+            if step.action in ['connect', 'disconnect']:
+                return {'connected': step.action == 'connect'}
+            if step.action == 'mute':
+                speaker = step.speaker if step.value is None else step.speaker._replace(volume=step.value)
+                self.muted_speakers[speaker.id] = speaker
+                return {'volume': 0}
+            if step.action == 'unmute':
+                muted_speaker = self.muted_speakers.pop(step.speaker.id, None)
+                return {'volume': muted_speaker.volume if muted_speaker else step.value}
+            return {'volume': step.value}
+
+        def request(speaker, changes):
+            if 'connected' in changes:
+                return {"request": "connectToSpeaker" if changes['connected'] else "disconnectSpeaker",
+                        "requestID": "-1", "data": {"longIdentifier": speaker.id}}
+            return {"request": "setSpeakerVolume", "requestID": "-1",
+                    "data": {"longIdentifier": speaker.id, "volume": changes['volume']}}
+
+        # every speaker has at most one step in each phase. connects and disconnects are sent first, so a volume is
+        # set on a speaker that is already connected, and the commands of each phase are sent at once on the pool
+        results = []
+        for phase in [['connect', 'disconnect'], ['volume', 'mute', 'unmute']]:
+            batch = {step.speaker.id: step for step in steps if step.action in phase}
+            if not batch:
+                continue
+            self._group_cmd([state.speakers[id] for id in batch], 'scene', lambda s: target(batch[s.id]), request,
+                            False)
+            for result in self.results:
+                if result.status == 'changed':
+                    state.update_speaker(result.speaker.id, connected=result.speaker.connected,
+                                         volume=result.speaker.volume)
+            results += self.results
+        self.results = results
+        if scene.source:
+            current = self.get_current_source()
+            if scene.source.lower() != (current.source_name or '').lower():
+                source = self._lookup_source(unknown=scene.source)
+                if not source:
+                    raise ValueError(f'no source was found with name, id, or keywords: \'{scene.source}\'')
+                self.set_source(id=source.id)
+        if confirm:
+            state.load_speakers(self.get_speakers(fresh=True))
+        speakers = [s for s in state.get_speakers() if s.id in targets]
+        return steps, speakers, scene.missed(state, targets)
 
 
 
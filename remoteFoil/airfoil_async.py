@@ -0,0 +1,522 @@
+import asyncio, itertools, json, time
+from remoteFoil.airfoil import Airfoil, AirfoilTimeoutError, AirfoilCancelledError, REQUEST_TIMEOUT, RESYNCED, \
+    time_left, reconnect_delay, keepalive, relocate
+from remoteFoil.airfoil_state import AirfoilState, NOTIFICATIONS
+from remoteFoil.coalescer import COALESCE_WINDOW
+from remoteFoil.health import HostHealth
+from remoteFoil.mute_store import MuteStore
+from remoteFoil.source_catalog import SourceCatalog
+from remoteFoil.scenes import Scene
+
+HELLO = b"com.rogueamoeba.protocol.slipstreamremote\nmajorversion=1,minorversion=5\nOK\n"
+ACCEPTABLE_VERSION = "majorversion=1,minorversion=5"
+SOURCE_TYPES = {'audio_device': 'audioDevices', 'running_apps': 'runningApplications',
+                'recent_apps': 'recentApplications', 'system_audio': 'systemAudio'}
+
+
+class AsyncAirfoil(object):
+    """
+    AsyncAirfoil is an asyncio client for one instance of Airfoil. Unlike Airfoil, which opens a new connection for
+    every command, AsyncAirfoil keeps one subscribed Slipstream connection open and sends every command over it.
+    Replies are matched to their requests by requestID, so any number of commands can be in flight at the same time,
+    and the notifications that arrive on the connection keep AsyncAirfoil.state (an AirfoilState) up to date.
+
+    Speakers, sources and the current source are returned as the same namedtuples Airfoil uses. Speaker lookups
+    and the state returned after a command are read from the live state instead of being fetched again.
+
+    When the shared connection drops, AsyncAirfoil reconnects in the background with backoff (see reconnect_delay)
+    and subscribes again. The speakers in the reply are passed to AsyncAirfoil.state as a synthetic "resynced"
+    notification, so its listeners learn that notifications may have been missed. Set reconnect to False to only
+    reconnect on the next request.
+
+    Every request must be answered within request_timeout seconds and before the current remoteFoil.deadline, or it
+    raises AirfoilTimeoutError. Cancelling the task awaiting a request, or calling AsyncAirfoil.cancel, drops it.
+    How every call to the host went is recorded in AsyncAirfoil.health, a HostHealth. When its circuit opens, the
+    shared connection is dropped and reconnected in the background, which closes the circuit again once it succeeds.
+    """
+    speaker = Airfoil.speaker
+    source = Airfoil.source
+    current_source = Airfoil.current_source
+    get_keywords = Airfoil.get_keywords
+    _parse_volume = Airfoil._parse_volume
+
+    def __init__(self, ip, port, name, request_timeout=REQUEST_TIMEOUT):
+        self.ip = ip
+        self.port = port
+        self.name = name
+        self.request_timeout = request_timeout
+        self.reconnect = True
+        self.reconnect_task = None
+        self.subscribed = False
+        self.health = HostHealth()
+        self.state = AirfoilState()
+        self.catalog = SourceCatalog()
+        self.state.listeners.append(self.catalog.listener)
+        self.muted_speakers = MuteStore(ip)
+        self.reader, self.writer, self.read_task = None, None, None
+        self.pending = {}
+        self.volume_targets = {}
+        self.request_ids = itertools.count(1)
+        self.lock = asyncio.Lock()
+
+    @staticmethod
+    async def _read_message(reader):
+        # messages are framed as '<length>;<json>'. anything else before the length, like the line break after the
+        # previous message, is skipped
+        header = await reader.readuntil(b';')
+        num_bytes = int(''.join(ch for ch in header.decode() if ch.isdigit()))
+        return json.loads(await reader.readexactly(num_bytes))
+
+    def _create_cmd(self, base_cmd):
+        request_id = str(next(self.request_ids))
+        base_cmd = dict(base_cmd, requestID=request_id)
+        cmd = str(base_cmd).replace(': ', ':').replace(', ', ',')
+        return request_id, bytes(f'{len(cmd)};{cmd}\r\n', encoding='ascii')
+
+    async def _within(self, awaitable):
+        # wait for awaitable for up to request_timeout, or until the current deadline if that is sooner, and record
+        # the outcome in self.health. running out of a deadline set by the caller says nothing about the host
+        try:
+            timeout = time_left(self.request_timeout)
+        except AirfoilTimeoutError:
+            awaitable.close()
+            raise
+        started = time.time()
+        try:
+            result = await asyncio.wait_for(awaitable, timeout)
+        except (AirfoilCancelledError, AirfoilTimeoutError):
+            raise
+        except asyncio.TimeoutError:
+            error = AirfoilTimeoutError(f'timed out waiting for Airfoil at {self.ip}:{self.port}')
+            if timeout == self.request_timeout:
+                self._failed(error)
+            raise error
+        except OSError as e:
+            self._failed(e)
+            raise
+        self.health.success(time.time() - started)
+        return result
+
+    def _failed(self, error):
+        if self.health.failure(error) and self.writer:
+            # the circuit just opened: stop using the connection, and let the reconnect loop probe the host
+            self.writer.close()
+            self.read_task.cancel()
+            self._disconnected(ConnectionError(f'Airfoil at {self.ip}:{self.port} stopped answering'))
+        if self.health.opened is not None and self.reconnect and not self.reconnect_task:
+            self.reconnect_task = asyncio.ensure_future(self._reconnect())
+
+    async def _open(self):
+        async def handshake():
+            reader, writer = await asyncio.open_connection(self.ip, self.port)
+            # the shared connection carries the subscription, which can be quiet for hours
+            keepalive(writer.get_extra_info('socket'))
+            writer.write(HELLO)
+            try:
+                data = await reader.read(128)
+            except BaseException:
+                writer.close()
+                raise
+            if ACCEPTABLE_VERSION not in data.decode():
+                writer.close()
+                raise ConnectionError(f'Airfoil at {self.ip}:{self.port} does not support {ACCEPTABLE_VERSION}')
+            return reader, writer
+        return await self._within(handshake())
+
+    async def connect(self):
+        """
+        open the shared connection and subscribe to notifications, if that has not been done already. The speakers in
+        the reply to the subscribe request are loaded into AsyncAirfoil.state. Commands call this themselves, so it
+        only needs to be called directly to start mirroring state before the first command.
+        """
+        async with self.lock:
+            if self.writer:
+                return
+            self.reader, self.writer = await self._open()
+            self.read_task = asyncio.ensure_future(self._read_loop(self.reader))
+            try:
+                reply = await self.request({"request": "subscribe", "data": {"notifications": NOTIFICATIONS}},
+                                           connect=False)
+            except BaseException:
+                # a connection that never finished subscribing would look connected to the next request
+                if self.writer:
+                    self.writer.close()
+                    self.read_task.cancel()
+                    self._disconnected(ConnectionError('could not subscribe to Airfoil'))
+                raise
+            self.state.live = True
+            if 'speakers' in reply.get('data', {}):
+                if self.subscribed:
+                    self.state.handle({'request': RESYNCED, 'data': {'speakers': reply['data']['speakers']}})
+                else:
+                    self.state.load_speakers(reply['data']['speakers'])
+            self.subscribed = True
+
+    async def close(self):
+        """close the shared connection. Requests still waiting for a reply will raise ConnectionError."""
+        if self.reconnect_task:
+            self.reconnect_task.cancel()
+            self.reconnect_task = None
+        if self.writer:
+            self.writer.close()
+        if self.read_task:
+            self.read_task.cancel()
+        self._disconnected(ConnectionError('connection to Airfoil was closed'))
+
+    def cancel(self):
+        """fail every request still waiting for a reply with AirfoilCancelledError, keeping the connection open."""
+        pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(AirfoilCancelledError('request to Airfoil was cancelled'))
+
+    def _disconnected(self, error):
+        self.reader, self.writer, self.read_task = None, None, None
+        self.state.live = False
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.pending = {}
+
+    async def _read_loop(self, reader):
+        try:
+            while True:
+                message = await self._read_message(reader)
+                if 'replyID' in message:
+                    # replies to requests that timed out or were cancelled are no longer pending and are dropped
+                    future = self.pending.pop(message['replyID'], None)
+                    if future and not future.done():
+                        future.set_result(message)
+                else:
+                    self.state.handle(message)
+        except asyncio.CancelledError:
+            raise
+        except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+            if reader is self.reader:
+                self._disconnected(ConnectionError(f'lost connection to Airfoil: {e!r}'))
+                if self.reconnect and not self.reconnect_task:
+                    self.reconnect_task = asyncio.ensure_future(self._reconnect())
+
+    async def _reconnect(self):
+        attempt = 0
+        try:
+            while not self.writer:
+                await asyncio.sleep(reconnect_delay(attempt))
+                try:
+                    await self.connect()
+                except OSError as e:
+                    if isinstance(e, ConnectionRefusedError) and attempt:
+                        # like Airfoil.watch, look the port up again, since Airfoil moves to a new one on restart
+                        located = await asyncio.get_running_loop().run_in_executor(
+                            None, relocate, self.ip, self.name, self.request_timeout or REQUEST_TIMEOUT)
+                        if located:
+                            self.ip, self.port = located
+                    attempt += 1
+        finally:
+            self.reconnect_task = None
+
+    async def request(self, base_cmd, connect=True):
+        """
+        send a request over the shared connection and wait for the reply to it.
+        :param base_cmd:    dict, Slipstream request. requestID is filled in.
+        :return:            dict, the reply from Airfoil
+        """
+        if connect:
+            await self.connect()
+        request_id, cmd = self._create_cmd(base_cmd)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+
+        async def send():
+            self.writer.write(cmd)
+            await self.writer.drain()
+            return await future
+        try:
+            return await self._within(send())
+        finally:
+            # a request that timed out or was cancelled is dropped, and a late reply to it is ignored
+            self.pending.pop(request_id, None)
+
+    async def exchange(self, base_cmd, until):
+        """
+        send a request over a connection of its own and return the first message for which until(message) is true.
+        Used for requests whose replies would otherwise be mixed into the notifications on the shared connection.
+        """
+        reader, writer = await self._open()
+
+        async def receive():
+            _, cmd = self._create_cmd(base_cmd)
+            writer.write(cmd)
+            await writer.drain()
+            while True:
+                message = await self._read_message(reader)
+                if until(message):
+                    return message
+        try:
+            return await self._within(receive())
+        finally:
+            writer.close()
+
+    async def _get_result(self, base_cmd):
+        response = await self.request(base_cmd)
+        return response.get('data', {}).get('success', False)
+
+    async def get_speakers(self, ids=[], names=[], fresh=False):
+        """
+        AsyncAirfoil.get_speakers returns speakers from the live state. See documentation for Airfoil.get_speakers.
+        :param fresh:   boolean, default False, fetch the speaker list from Airfoil and reload the live state with it.
+        """
+        await self.connect()
+        if fresh:
+            base_cmd = {"request": "subscribe", "data": {"notifications": ["speakerListChanged"]}}
+            reply = await self.exchange(base_cmd, lambda m: 'speakers' in m.get('data', {}))
+            self.state.load_speakers(reply['data']['speakers'])
+        return self.state.get_speakers(ids=ids, names=names)
+
+    async def find_speaker(self, id=None, name=None, keywords=[], unknown=None):
+        """AsyncAirfoil.find_speaker works like Airfoil.find_speaker. See documentation for Airfoil.find_speaker."""
+        await self.connect()
+        return self.state.find_speaker(id=id, name=name, keywords=keywords, unknown=unknown)
+
+    async def get_sources(self, source_icon=False):
+        """AsyncAirfoil.get_sources works like Airfoil.get_sources. See documentation for Airfoil.get_sources."""
+        response = await self.request({"request": "getSourceList", "data": {"iconSize": 10, "scaleFactor": 1}})
+        data = response.get('data', {})
+        sources = []
+        for type, key in SOURCE_TYPES.items():
+            for src in data.get(key, []):
+                icon = src.get('icon', '') if source_icon else ''
+                sources.append(self.source(src['friendlyName'], src['identifier'], type,
+                                           self.get_keywords(src['friendlyName']), icon))
+        self.catalog.load([s._replace(icon='') for s in sources] if source_icon else sources)
+        return sources
+
+    async def _refresh_sources(self):
+        try:
+            await self.get_sources()
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.catalog.refreshing = False
+
+    async def find_source(self, unknown):
+        """
+        AsyncAirfoil.find_source returns the source matching unknown as a name, an id, or keywords, in that order.
+        Sources are looked up in AsyncAirfoil.catalog, a SourceCatalog that is loaded again when it is stale or when
+        the lookup misses. See documentation for SourceCatalog.
+        :return:    Airfoil.source object or None
+        """
+        loaded = self.catalog.loaded
+        if self.catalog.stale:
+            await self.get_sources()
+        elif self.catalog.refresh_due:
+            self.catalog.refreshing = True
+            asyncio.ensure_future(self._refresh_sources())
+        source = self.catalog.find(unknown=unknown)
+        if source is None and self.catalog.loaded == loaded:
+            await self.get_sources()
+            source = self.catalog.find(unknown=unknown)
+        return source
+
+    async def get_current_source(self, machine_icon=False, album_art=False, source_icon=False, track_meta=False,
+                                 fresh=False):
+        """
+        AsyncAirfoil.get_current_source works like Airfoil.get_current_source. The plain current source (without
+        images or track metadata) is kept in the live state until Airfoil reports that it changed.
+        :param fresh:   boolean, default False, fetch the current source from Airfoil even if the live state has it.
+        """
+        plain = not any([machine_icon, album_art, source_icon, track_meta])
+        await self.connect()
+        if plain and self.state.current_source and not fresh:
+            return self.state.current_source
+        requested = {"sourceName": "true", "bundleid": "true", "remoteControlAvailable": "true",
+                     "trackMetadataAvailable": "true" if track_meta else "false"}
+        if machine_icon:
+            requested['machineIconAndScreenshot'] = 300
+        if album_art:
+            requested['albumArt'] = 300
+        if source_icon:
+            requested['icon'] = 32
+        if track_meta:
+            requested.update(artist="true", album="true", title="true")
+        response = await self.request({"request": "getSourceMetadata",
+                                       "data": {"scaleFactor": 2, "requestedData": requested}})
+        meta = response.get('data', {}).get('metadata', {})
+        result = self.current_source(meta.get('sourceName'), meta.get('trackMetadataAvailable', False),
+                                     meta.get('remoteControlAvailable', False), meta.get('album', None),
+                                     meta.get('artist', None), meta.get('title', None), meta.get('albumArt', None),
+                                     meta.get('icon', None), meta.get('machineIconAndScreenshot', None))
+        if plain:
+            self.state.load_current_source(result)
+        return result
+
+    async def set_source(self, source):
+        """
+        AsyncAirfoil.set_source selects the given source.
+        :param source:  Airfoil.source object, as returned by get_sources or find_source
+        :return:        Airfoil.current_source object representing current source after sending command to Airfoil.
+        """
+        response = await self.request({"request": "selectSource",
+                                       "data": {"type": SOURCE_TYPES[source.type], "identifier": source.id}})
+        if not response.get('data', {}).get('success', False):
+            # the source may be gone since the catalog was loaded
+            self.catalog.invalidate()
+        self.state.current_source = None
+        return await self.get_current_source()
+
+    async def _media_cmd(self, kind):
+        return await self._get_result({"request": "remoteCommand", "data": {"commandName": kind}})
+
+    async def play_pause(self):
+        return await self._media_cmd("PlayPause")
+
+    async def next_track(self):
+        return await self._media_cmd("NextTrack")
+
+    async def last_track(self):
+        return await self._media_cmd("PreviousTrack")
+
+    async def _set_connected(self, speaker, connected):
+        if speaker.connected != connected:
+            request = "connectToSpeaker" if connected else "disconnectSpeaker"
+            if await self._get_result({"request": request, "data": {"longIdentifier": speaker.id}}):
+                self.state.update_speaker(speaker.id, connected=connected)
+        return self.state.speakers.get(speaker.id, speaker)
+
+    async def _set_volume(self, speaker, volume):
+        base_cmd = {"request": "setSpeakerVolume", "data": {"longIdentifier": speaker.id, "volume": volume}}
+        if await self._get_result(base_cmd):
+            self.state.update_speaker(speaker.id, volume=volume)
+        return self.state.speakers.get(speaker.id, speaker)
+
+    async def _coalesce_volume(self, speaker, volume, window):
+        # the first change for a speaker schedules a write after the window, later changes in the window only replace
+        # its target, and everyone waits for that one write
+        pending = self.volume_targets.get(speaker.id)
+        if not pending:
+            pending = self.volume_targets[speaker.id] = {'volume': volume}
+            pending['task'] = asyncio.ensure_future(self._flush_volume(speaker, window))
+        pending['volume'] = volume
+        return await asyncio.shield(pending['task'])
+
+    async def _flush_volume(self, speaker, window):
+        await asyncio.sleep(window)
+        volume = self.volume_targets.pop(speaker.id)['volume']
+        return await self._set_volume(self.state.speakers.get(speaker.id, speaker), volume)
+
+    async def _muted(self, fn, *args):
+        # MuteStore waits on a file lock shared with other processes, so it runs off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    async def _mute(self, speaker):
+        if speaker.volume:
+            await self._muted(self.muted_speakers.__setitem__, speaker.id, speaker)
+            return await self._set_volume(speaker, 0)
+        return speaker
+
+    async def _unmute(self, speaker, default_volume):
+        if not speaker.volume:
+            muted_speaker = await self._muted(self.muted_speakers.pop, speaker.id, None)
+            volume = muted_speaker.volume if muted_speaker else self._parse_volume(default_volume)
+            return await self._set_volume(speaker, volume)
+        return speaker
+
+    async def _toggle(self, speaker):
+        if speaker.connected:
+            speaker = await self._set_connected(speaker, False)
+            if speaker.connected:
+                return speaker
+        return await self._set_connected(speaker, True)
+
+    async def _fade(self, speaker, end_volume, seconds, ticks):
+        wait = seconds / ticks
+        volume = speaker.volume
+        increments = (end_volume - volume) / ticks
+        for i in range(0, ticks):
+            volume += increments
+            speaker = await self._set_volume(speaker, end_volume if i == ticks - 1 else round(volume, 6))
+            await asyncio.sleep(wait)
+        return speaker
+
+    async def _each(self, speakers, action):
+        # every command goes out on the shared connection before any reply is awaited
+        return list(await asyncio.gather(*[action(s) for s in speakers]))
+
+    async def connect_speakers(self, speakers):
+        """
+        AsyncAirfoil.connect_speakers connects the given speakers, sending the commands for all of them at once.
+        This and the other group methods take Airfoil.speaker objects, as returned by find_speaker or
+        AsyncAirfoil.state.select, and return the speakers' state after the command.
+        """
+        return await self._each(speakers, lambda s: self._set_connected(s, True))
+
+    async def disconnect_speakers(self, speakers):
+        return await self._each(speakers, lambda s: self._set_connected(s, False))
+
+    async def toggle_speakers(self, speakers):
+        return await self._each(speakers, self._toggle)
+
+    async def set_volumes(self, volume, speakers, coalesce=False):
+        """
+        :param coalesce:    boolean or float, default False. collapse this change with other changes to the same
+                            speakers made within COALESCE_WINDOW seconds (or this many seconds, if a number), so only
+                            the latest volume is sent. See remoteFoil.coalescer.VolumeCoalescer.
+        """
+        volume = self._parse_volume(volume)
+        if coalesce:
+            window = COALESCE_WINDOW if coalesce is True else float(coalesce)
+            return await self._each(speakers, lambda s: self._coalesce_volume(s, volume, window))
+        return await self._each(speakers, lambda s: self._set_volume(s, volume))
+
+    async def mute_some(self, speakers):
+        return await self._each(speakers, self._mute)
+
+    async def unmute_some(self, speakers, default_volume=1.0):
+        return await self._each(speakers, lambda s: self._unmute(s, default_volume))
+
+    async def fade_volumes(self, end_volume, seconds, speakers, ticks=10):
+        end_volume = self._parse_volume(end_volume)
+        return await self._each(speakers, lambda s: self._fade(s, end_volume, seconds, ticks))
+
+    async def _scene_step(self, step):
+        if step.action in ['connect', 'disconnect']:
+            return await self._set_connected(step.speaker, step.action == 'connect')
+        if step.action == 'volume':
+            return await self._set_volume(step.speaker, step.value)
+        if step.action == 'unmute':
+            return await self._unmute(step.speaker, step.value)
+        speaker = await self._mute(step.speaker)
+        if step.value is not None:
+            await self._muted(self.muted_speakers.__setitem__, speaker.id, speaker._replace(volume=step.value))
+        return speaker
+
+    async def _scene_source(self, source):
+        match = await self.find_source(source)
+        if not match:
+            raise ValueError(f'no source was found with name, id, or keywords: \'{source}\'')
+        return await self.set_source(match)
+
+    async def apply_scene(self, scene, targets=None):
+        """
+        AsyncAirfoil.apply_scene brings Airfoil to the state described by a Scene. Only the commands in Scene.diff
+        are sent, and they are all sent at once, together with the requests for the source if the scene changes it.
+        :param scene:   Scene object, or a scene document as described in Scene
+        :param targets: speaker targets already resolved for this instance, as returned by Scene.resolve or
+                        SceneStore.resolve. The scene is resolved against the live state if not given.
+        :return:        tuple of the list of Scene.step objects that were sent, the speakers in the scene after the
+                        commands, and the speakers that did not reach their targets
+        """
+        if not isinstance(scene, Scene):
+            scene = Scene.parse(scene)
+        await self.connect()
+        if targets is None or any(id not in self.state.speakers for id in targets):
+            targets = scene.resolve(self.state)
+        steps = scene.diff(self.state, targets)
+        jobs = [self._scene_step(step) for step in steps]
+        if scene.source:
+            current = self.state.current_source
+            if not current or scene.source.lower() != (current.source_name or '').lower():
+                jobs.append(self._scene_source(scene.source))
+        await asyncio.gather(*jobs)
+        speakers = [s for s in self.state.get_speakers() if s.id in targets]
+        return steps, speakers, scene.missed(self.state, targets)
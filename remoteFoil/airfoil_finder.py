@@ -1,5 +1,92 @@
-import zeroconf as zeroconf
+from remoteFoil import _zeroconf as zeroconf
+from remoteFoil._zeroconf import DNSIncoming, DNSOutgoing, DNSQuestion, ServiceStateChange, current_time_millis, \
+    _CLASS_IN, _CLASS_UNIQUE, _FLAGS_QR_QUERY, _MAX_MSG_ABSOLUTE, _MDNS_PORT, _TYPE_PTR, _TYPE_SRV
+import socket
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+
+RESOLVE_WORKERS = 8         # number of services that can be resolved at the same time
+RESOLVE_TIMEOUT = 3000      # milliseconds to wait for SRV, TXT and A records on each attempt
+RESOLVE_RETRIES = 5         # attempts after the first before giving up on a partially resolved service
+RESOLVE_BACKOFF = 0.5       # seconds before the first retry, doubled for each retry after that
+
+BROWSE_BURST = [150, 300]   # milliseconds between the queries sent in the initial burst when browsing starts
+BROWSE_DELAY = 1000         # milliseconds before the first query after the burst, doubled after each query
+BROWSE_MAX_DELAY = 60000    # milliseconds, upper limit for the time between queries once backed off
+UNICAST_TIMEOUT = 2         # seconds to wait for a host to answer a direct query before browsing for it instead
+UNICAST_RETRY = 0.5         # seconds between repeats of a direct query that has not been answered
+ENGINE_POLL = 0.25          # seconds the zeroconf engine waits on its sockets before checking if it was closed
+
+
+class SlipstreamBrowser(zeroconf.ServiceBrowser):
+    """
+    ServiceBrowser with a query schedule tuned for finding Airfoil quickly.
+    - the first query is sent as soon as the browser starts and asks for a unicast response (QU), so responders
+      answer us directly instead of waiting to aggregate a multicast reply.
+    - the first query is followed by a short burst in case it was lost, and then by queries that back off from
+      BROWSE_DELAY up to BROWSE_MAX_DELAY.
+    - PTR records that have been seen are kept in SlipstreamBrowser.known_answers, which is shared by every browser
+      in the process, and are sent with each query so responders do not repeat answers we already have. Instances
+      known from an earlier browser are reported to the new browser's listener straight away.
+    """
+    known_answers = {}
+
+    def update_record(self, zc, now, record):
+        super().update_record(zc, now, record)
+        if record.type == _TYPE_PTR and record.name == self.type:
+            key = record.alias.lower()
+            if record.is_expired(now):
+                self.known_answers.pop(key, None)
+            else:
+                self.known_answers[key] = record
+
+    def _known_answers(self, now):
+        return [r for r in list(self.known_answers.values()) if r.name == self.type and not r.is_stale(now)]
+
+    def _next_delay(self, queries):
+        if queries < len(BROWSE_BURST):
+            return BROWSE_BURST[queries]
+        return min(BROWSE_MAX_DELAY, BROWSE_DELAY * 2 ** (queries - len(BROWSE_BURST)))
+
+    def _report_known(self):
+        for record in self._known_answers(current_time_millis()):
+            key = record.alias.lower()
+            if key not in self.services:
+                self.services[key] = record
+                self._handlers_to_call.append(
+                    lambda zc, alias=record.alias: self._service_state_changed.fire(
+                        zeroconf=zc, service_type=self.type, name=alias, state_change=ServiceStateChange.Added))
+
+    def run(self):
+        self.zc.add_listener(self, DNSQuestion(self.type, _TYPE_PTR, _CLASS_IN))
+        self._report_known()
+        queries = 0
+
+        while True:
+            now = current_time_millis()
+            if len(self._handlers_to_call) == 0 and self.next_time > now:
+                self.zc.wait(self.next_time - now)
+            if self.zc.done or self.done:
+                return
+            now = current_time_millis()
+            if self.next_time <= now:
+                question = DNSQuestion(self.type, _TYPE_PTR, _CLASS_IN)
+                if queries == 0:
+                    # DNSEntry masks the unicast-response bit off, so it is set after the question is created
+                    question.class_ |= _CLASS_UNIQUE
+                out = DNSOutgoing(_FLAGS_QR_QUERY, multicast=self.multicast)
+                out.add_question(question)
+                for record in self._known_answers(now):
+                    out.add_answer_at_time(record, now)
+
+                self.zc.send(out, addr=self.addr, port=self.port)
+                self.next_time = now + self._next_delay(queries)
+                queries += 1
+
+            if len(self._handlers_to_call) > 0 and not self.zc.done:
+                handler = self._handlers_to_call.pop(0)
+                handler(self.zc)
 
 
 class AirfoilFinder(object):
@@ -7,12 +94,25 @@ class AirfoilFinder(object):
     airfoils = {}
 
     def __init__(self, on_add=None, on_remove=None):
-        self.zeroconf = zeroconf.Zeroconf()
-        self.browser = zeroconf.ServiceBrowser(self.zeroconf, self.domain, self)
         self.on_add = on_add
         self.on_remove = on_remove
+        self.closed = False
+        self.resolving = set()
+        self.lock = threading.Lock()
+        self.resolver = ThreadPoolExecutor(max_workers=RESOLVE_WORKERS, thread_name_prefix='airfoil-resolve')
+        self.zeroconf = zeroconf.Zeroconf()
+        # the engine only notices that zeroconf was closed when its select times out, which would hold up close()
+        self.zeroconf.engine.timeout = ENGINE_POLL
+        # only the listen socket is read. the respond sockets are bound to port 5353 too, so reading them as well
+        # would handle every multicast packet twice. answers to the unicast (QU) query are sent to port 5353, where
+        # the listen socket receives them, and any the system hands to a respond socket instead are answered again
+        # by the multicast queries that follow it
+        # the browser starts calling add_service as soon as it is created, so it has to be created last
+        self.browser = SlipstreamBrowser(self.zeroconf, self.domain, self)
 
     def remove_service(self, zeroconf, type, name):
+        with self.lock:
+            self.resolving.discard(name)
         name = name.split('.')[0].lower()
         print(f"\rAirfoil instance '{name}' was removed.")
         if name in self.airfoils:
@@ -21,7 +121,42 @@ class AirfoilFinder(object):
             self.on_remove(name)
 
     def add_service(self, zeroconf, type, name):
-        info = zeroconf.get_service_info(type, name)
+        """
+        Called on the browser thread when a new Airfoil instance is announced. Resolving the service can take up to
+        RESOLVE_TIMEOUT per attempt, so the work is handed to the resolver pool and the browser thread is released
+        right away to deliver the next add or remove event.
+        """
+        with self.lock:
+            if self.closed or name in self.resolving:
+                return
+            self.resolving.add(name)
+        self._submit(type, name, 0)
+
+    def _submit(self, type, name, attempt):
+        with self.lock:
+            if self.closed or name not in self.resolving:
+                return
+            self.resolver.submit(self._resolve, type, name, attempt)
+
+    def _resolve(self, type, name, attempt):
+        info = self.zeroconf.get_service_info(type, name, timeout=RESOLVE_TIMEOUT)
+        if info is None or not info.address or not info.port:
+            # a partial answer (SRV without its A record yet) or no answer at all. try again in the background
+            # without holding a resolver thread while we wait.
+            if attempt < RESOLVE_RETRIES:
+                retry = threading.Timer(RESOLVE_BACKOFF * 2 ** attempt, self._submit, (type, name, attempt + 1))
+                retry.daemon = True
+                retry.start()
+            else:
+                with self.lock:
+                    self.resolving.discard(name)
+                print(f"\rAirfoil instance '{name.split('.')[0].lower()}' could not be resolved.")
+            return
+
+        with self.lock:
+            if name not in self.resolving:  # removed while we were resolving it
+                return
+            self.resolving.discard(name)
         ip = '.'.join(str(i) for i in info.address)
         port = info.port
         name = name.split('.')[0].lower()
@@ -32,6 +167,12 @@ class AirfoilFinder(object):
             self.on_add(name, ip, port)
 
     def close(self):
+        with self.lock:
+            self.closed = True
+            self.resolving.clear()
+        self.resolver.shutdown(wait=False, cancel_futures=True)
+        for sock in self.zeroconf._respond_sockets:
+            self.zeroconf.engine.del_reader(sock)
         self.zeroconf.close()
 
     @staticmethod
@@ -81,15 +222,71 @@ class AirfoilFinder(object):
                                     '\n\t\t\t  Set a longer timeout or set timeout=None to avoid this.')
             time.sleep(0.25)
 
+    @staticmethod
+    def resolve_ip(ip, timeout=UNICAST_TIMEOUT):
+        """
+        ask the host at the given ipv4 address for its Airfoil instance directly, by sending a unicast mdns query to
+        port 5353 on that host instead of browsing the multicast group. The host answers the PTR query with the name
+        of its instance, and usually includes the SRV record with the port in the same reply. If it does not, the
+        SRV record is asked for separately.
+        :param ip: The ipv4 address as a string. (eg. '192.168.0.72')
+        :param timeout: int or float number of seconds to wait for an answer before raising TimeoutError
+        :return: (ip, port, name) tuple
+        """
+        deadline = time.time() + timeout
+        instance, port = None, None
+        question = (AirfoilFinder.domain, _TYPE_PTR)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            # replies to queries sent from a port other than 5353 come straight back to the sending socket
+            sock.bind(('', 0))
+            while time.time() < deadline:
+                out = DNSOutgoing(_FLAGS_QR_QUERY, multicast=False)
+                out.add_question(DNSQuestion(question[0], question[1], _CLASS_IN))
+                sock.sendto(out.packet(), (ip, _MDNS_PORT))
+                retry = min(deadline, time.time() + UNICAST_RETRY)
+                while time.time() < retry:
+                    sock.settimeout(retry - time.time())
+                    try:
+                        data, (addr, _) = sock.recvfrom(_MAX_MSG_ABSOLUTE)
+                    except socket.timeout:
+                        break
+                    msg = DNSIncoming(data)
+                    if addr != ip or not msg.valid or not msg.is_response():
+                        continue
+                    for record in msg.answers:
+                        if record.type == _TYPE_PTR and record.name == AirfoilFinder.domain:
+                            instance = record.alias
+                        elif record.type == _TYPE_SRV and record.name.endswith(AirfoilFinder.domain):
+                            instance, port = record.name, record.port
+                    if instance and port:
+                        airfoil = (ip, port, instance.split('.')[0].lower())
+                        AirfoilFinder.airfoils[airfoil[2]] = airfoil
+                        return airfoil
+                    if instance:
+                        question = (instance, _TYPE_SRV)
+                        break
+        raise TimeoutError(f'Timed out waiting for a direct answer from {ip}.')
+
     @staticmethod
     def get_airfoil_by_ip(ip, timeout=10):
         """
         find and return an instance of Airfoil on the network that matches the given ipv4 address.
+        the host is asked directly with a unicast query first, and the multicast browse is only used if it does not
+        answer within UNICAST_TIMEOUT.
         timeout defaults to 10 seconds but you can pass a longer timeout value or set timeout=None to disable.
         :param ip: The ipv4 address as a string. (eg. '192.168.0.72')
         :param timeout: None or int number of seconds to wait before timing out
         :return:
         """
+        for airfoil in list(AirfoilFinder.airfoils.values()):
+            if airfoil[0] == ip:
+                return airfoil
+        started = time.time()
+        try:
+            return AirfoilFinder.resolve_ip(ip, UNICAST_TIMEOUT if timeout is None else min(timeout, UNICAST_TIMEOUT))
+        except (TimeoutError, OSError):
+            if timeout:
+                timeout = max(timeout - (time.time() - started), 0.25)
         finder = AirfoilFinder()
         taken = 0
         while True:
@@ -0,0 +1,159 @@
+import time
+from remoteFoil.airfoil import Airfoil, RESYNCED
+
+NOTIFICATIONS = ["sourceMetadataChanged", "remoteControlChangedRequest", "speakerConnectedChanged",
+                 "speakerListChanged", "speakerNameChanged", "speakerPasswordChanged", "speakerVolumeChanged"]
+
+
+class AirfoilState(object):
+    """
+    AirfoilState is an in-process mirror of the speakers and current source of one Airfoil instance. It is loaded from
+    the reply to a subscribe request and then kept up to date from the notifications Airfoil sends on the subscribed
+    connection, so reads can be answered without asking Airfoil again.
+
+    - speakers are kept in the order Airfoil reported them, as Airfoil.speaker objects keyed by speaker id.
+    - version is incremented on every change, and updated holds the time.time() of the last change or reload.
+    - speakers_loaded and source_loaded hold the time.time() the speakers and current source were last read from
+      Airfoil in full, as opposed to being changed by a notification.
+    - callables in listeners are called with every notification after it has been applied to the mirror.
+    """
+    def __init__(self):
+        self.speakers = {}
+        self.current_source = None
+        self.version = 0
+        self.updated = 0.0
+        self.speakers_loaded = 0.0
+        self.source_loaded = 0.0
+        self.live = False
+        self.listeners = []
+
+    def _changed(self):
+        self.version += 1
+        self.updated = time.time()
+
+    @staticmethod
+    def parse_speaker(s):
+        """
+        AirfoilState.parse_speaker turns a speaker from a Slipstream message into an Airfoil.speaker object.
+        :param s:   dict, speaker as sent by Airfoil
+        :return:    Airfoil.speaker object
+        """
+        keywords = Airfoil.get_keywords(None, s.get('name'))
+        return Airfoil.speaker(s.get('name'), s.get('type'), s.get('longIdentifier'), s.get('volume'),
+                               s.get('connected'), s.get('password'), keywords)
+
+    def load_speakers(self, speakers):
+        """
+        replace every speaker in the mirror with the given list of speakers.
+        :param speakers:    list of speakers as sent by Airfoil, or list of Airfoil.speaker objects
+        """
+        parsed = [s if type(s) is Airfoil.speaker else self.parse_speaker(s) for s in speakers]
+        self.speakers = {s.id: s for s in parsed}
+        self._changed()
+        self.speakers_loaded = self.updated
+
+    def load_current_source(self, current_source):
+        """
+        replace the current source in the mirror.
+        :param current_source:  Airfoil.current_source object without images or track metadata
+        """
+        self.current_source = current_source
+        self._changed()
+        self.source_loaded = self.updated
+
+    def update_speaker(self, id, **changes):
+        """
+        change properties of one speaker in the mirror. Unknown speaker ids are ignored.
+        :param id:      speaker id, string
+        :param changes: Airfoil.speaker properties and their new values
+        :return:        the updated Airfoil.speaker object, or None if the speaker is not known
+        """
+        speaker = self.speakers.get(id)
+        if not speaker:
+            return None
+        if 'name' in changes:
+            changes['keywords'] = Airfoil.get_keywords(None, changes['name'])
+        speaker = speaker._replace(**changes)
+        self.speakers[id] = speaker
+        self._changed()
+        return speaker
+
+    def handle(self, message):
+        """
+        apply a notification from Airfoil to the mirror and pass it on to the listeners.
+        :param message: dict, notification as sent by Airfoil
+        """
+        kind = message.get('request')
+        data = message.get('data', {}) or {}
+        id = data.get('longIdentifier')
+        if 'speakers' in data:
+            if kind == RESYNCED:
+                # notifications were missed while the subscription was down, source changes among them
+                self.current_source = None
+            self.load_speakers(data['speakers'])
+        elif kind == 'speakerConnectedChanged':
+            self.update_speaker(id, connected=data.get('connected'))
+        elif kind == 'speakerVolumeChanged':
+            self.update_speaker(id, volume=data.get('volume'))
+        elif kind == 'speakerNameChanged':
+            self.update_speaker(id, name=data.get('name'))
+        elif kind == 'speakerPasswordChanged':
+            self.update_speaker(id, password=data.get('password'))
+        elif kind in ['sourceMetadataChanged', 'remoteControlChangedRequest']:
+            # the notification does not carry everything Airfoil.current_source holds; fetch it on next read
+            self.current_source = None
+            self._changed()
+        for listener in list(self.listeners):
+            listener(message)
+
+    def get_speakers(self, ids=[], names=[]):
+        """
+        AirfoilState.get_speakers works like Airfoil.get_speakers, but reads from the mirror.
+        :param ids:     list of speaker ids
+        :param names:   list of speaker names
+        :return:        list of Airfoil.speaker objects matching request
+        """
+        speakers = list(self.speakers.values())
+        if ids or names:
+            return [s for s in speakers if s.id in ids or s.name in names]
+        return speakers
+
+    def select(self, ids=[], names=[], include_disconnected=False):
+        """
+        AirfoilState.select returns the speakers a group command should act on, using the same rules as the group
+        methods of Airfoil: speakers matching ids or names (not case-sensitive), or if neither is given, every
+        connected speaker (and disconnected ones too with include_disconnected=True).
+        :return:    list of Airfoil.speaker objects
+        """
+        ids = [i.lower() for i in ids]
+        names = [n.lower() for n in names]
+        return [s for s in self.speakers.values()
+                if (ids and s.id.lower() in ids) or (names and s.name.lower() in names) or
+                (not ids and not names and (s.connected or include_disconnected))]
+
+    def find_speaker(self, id=None, name=None, keywords=[], unknown=None):
+        """
+        AirfoilState.find_speaker works like Airfoil.find_speaker, but reads from the mirror.
+        See documentation for Airfoil.find_speaker.
+        :return:    either an Airfoil.speaker object or None
+        """
+        speakers = list(self.speakers.values())
+        if [bool(name), bool(id), bool(keywords), bool(unknown)].count(True) != 1:
+            raise ValueError('must pass only one of the following: id, name, keywords, or unknown')
+        if unknown:
+            unknown = unknown.lower()
+            for kind in [dict(id=unknown), dict(name=unknown), dict(keywords=Airfoil.get_keywords(None, unknown))]:
+                try:
+                    return self.find_speaker(**kind)
+                except ValueError:
+                    pass
+            return None
+        selected_speaker = None
+        for speaker in speakers:
+            if (id and speaker.id.lower() == id.lower()) or (name and speaker.name.lower() == name.lower()) or \
+                    (keywords and all(kw.lower() in speaker.keywords for kw in keywords)):
+                selected_speaker = speaker
+        if not selected_speaker:
+            raise ValueError(f'no speakers were found with the specified id, name, or keywords:'
+                             f'\n\t\t\t{id or name or keywords}')
+        return selected_speaker
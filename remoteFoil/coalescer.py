@@ -0,0 +1,71 @@
+import contextvars, threading
+
+COALESCE_WINDOW = 0.05
+
+
+class VolumeCoalescer(object):
+    """
+    VolumeCoalescer collapses bursts of volume changes for the same speaker, like the ones a volume slider or a
+    repeated "turn it up" produces, into one. The first change for a speaker starts a short window, changes that
+    arrive during the window only replace the target, and when the window closes the latest target is sent with one
+    Airfoil.set_volume call. Every caller in the burst gets the result of that one call.
+
+        coalescer = VolumeCoalescer(Airfoil())
+        coalescer.set_volume(0.4, name='Kitchen')   # can be called from any number of threads
+    Airfoil.set_volume(..., coalesce=True) uses the VolumeCoalescer every Airfoil object keeps as Airfoil.coalescer.
+    """
+    def __init__(self, airfoil, window=COALESCE_WINDOW):
+        """
+        :param airfoil: Airfoil object to send the volume changes with
+        :param window:  float, seconds to wait for more changes after the first one for a speaker
+        """
+        self.airfoil = airfoil
+        self.window = window
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def set_volume(self, volume, *, id=None, name=None, keywords=[], confirm=False, window=None, wait=True):
+        """
+        VolumeCoalescer.set_volume works like Airfoil.set_volume, except that the change is sent together with any
+        other changes for the same speaker made within the window. Changes are matched by the speaker they resolve
+        to, so one asking for a speaker by name and one asking for it by id are sent together.
+        The change is sent with the contextvars of the first caller in the burst, so its deadline applies.
+        :param confirm: boolean, default False, read the state back from Airfoil if any caller in the burst asks to
+        :param window:  float, seconds to wait for more changes, if this change starts a burst. defaults to the
+                        window the coalescer was created with
+        :param wait:    boolean, default True, wait for the change to be sent. with wait=False, return right away.
+        :return:        the return value of Airfoil.set_volume for the latest target, or None if wait is False
+        """
+        if [bool(id), bool(name), bool(keywords)].count(True) != 1:
+            raise ValueError('must pass only one of the following: id, name, or keywords')
+        volume = self.airfoil._parse_volume(volume)
+        speaker_id = self.airfoil.find_speaker(id, name, keywords).id
+        key = speaker_id.lower()
+        with self.lock:
+            entry = self.pending.get(key)
+            if entry is None:
+                entry = self.pending[key] = {'done': threading.Event(), 'result': None, 'error': None,
+                                             'confirm': False}
+                context = contextvars.copy_context()
+                timer = threading.Timer(self.window if window is None else window, context.run,
+                                        (self._flush, key, speaker_id))
+                timer.daemon = True
+                timer.start()
+            entry['volume'] = volume
+            entry['confirm'] = entry['confirm'] or confirm
+        if not wait:
+            return None
+        entry['done'].wait()
+        if entry['error']:
+            raise entry['error']
+        return entry['result']
+
+    def _flush(self, key, speaker_id):
+        with self.lock:
+            entry = self.pending.pop(key)
+        try:
+            entry['result'] = self.airfoil.set_volume(entry['volume'], id=speaker_id, confirm=entry['confirm'])
+        except Exception as e:
+            entry['error'] = e
+        finally:
+            entry['done'].set()
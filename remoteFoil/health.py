@@ -0,0 +1,98 @@
+import time
+
+FAILURE_THRESHOLD = 3
+COOLDOWN = 5
+LATENCY_WEIGHT = 0.2
+
+
+class AirfoilUnavailableError(ConnectionError):
+    """raised instead of contacting an Airfoil host whose circuit breaker is open."""
+
+
+class HostHealth(object):
+    """
+    HostHealth tracks how the calls to one Airfoil host have been going, and works as a circuit breaker for it: after
+    FAILURE_THRESHOLD failures in a row the circuit opens, and callers that check HostHealth.available fail fast
+    instead of each waiting out a connect timeout on a host that is down. Once the circuit has been open for COOLDOWN
+    seconds, one caller per COOLDOWN is let through as a trial, and the first success closes the circuit again.
+
+    - last_success and last_failure hold the time.time() of the last call that succeeded or failed, and last_error
+      the error of the last failure.
+    - failures counts the failures since the last success.
+    - latency is an exponentially weighted moving average of the seconds successful calls took, with every new call
+      weighted LATENCY_WEIGHT.
+    """
+    def __init__(self, threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN):
+        """
+        :param threshold:   int, number of failures in a row that opens the circuit
+        :param cooldown:    int or float, seconds to fail fast after the circuit opens, and between trials
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.last_success = None
+        self.last_failure = None
+        self.last_error = None
+        self.failures = 0
+        self.latency = None
+        self.opened = None
+        self.trial = None
+
+    @property
+    def state(self):
+        """'closed' while calls go through, 'open' while they fail fast, and 'half-open' while a trial is allowed."""
+        if self.opened is None:
+            return 'closed'
+        return 'half-open' if not self.retry_in() else 'open'
+
+    def retry_in(self):
+        """:return: seconds until the next trial is allowed, 0 if one is allowed now or the circuit is closed"""
+        if self.opened is None:
+            return 0
+        return max(0.0, max(self.opened, self.trial or 0) + self.cooldown - time.time())
+
+    def available(self):
+        """
+        HostHealth.available tells a caller whether to contact the host. While the circuit is half-open, the first
+        caller to ask gets True and starts the trial, and everyone else gets False for another cooldown.
+        :return:    boolean
+        """
+        if self.opened is None:
+            return True
+        if self.retry_in():
+            return False
+        self.trial = time.time()
+        return True
+
+    def success(self, latency):
+        """
+        record a call that succeeded and close the circuit.
+        :param latency: float, seconds the call took
+        """
+        self.last_success = time.time()
+        self.failures = 0
+        self.opened, self.trial = None, None
+        self.latency = latency if self.latency is None else \
+            LATENCY_WEIGHT * latency + (1 - LATENCY_WEIGHT) * self.latency
+
+    def failure(self, error):
+        """
+        record a call that failed.
+        :param error:   the exception the call raised
+        :return:        True if this failure opened the circuit, False if it was already open or is still closed
+        """
+        self.last_failure = time.time()
+        self.last_error = error
+        self.failures += 1
+        if self.opened is None and self.failures >= self.threshold:
+            self.opened = self.last_failure
+            return True
+        if self.opened is not None and self.trial:
+            # a failed trial keeps the circuit open for another cooldown
+            self.opened, self.trial = self.last_failure, None
+        return False
+
+    def as_dict(self):
+        return {'state': self.state, 'failures': self.failures, 'last_success': self.last_success,
+                'last_failure': self.last_failure, 'last_error': str(self.last_error) if self.last_error else None,
+                'latency': round(self.latency, 4) if self.latency is not None else None,
+                'retry_in': round(self.retry_in(), 2)}
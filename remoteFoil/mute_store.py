@@ -0,0 +1,124 @@
+import contextlib, os
+from collections.abc import MutableMapping
+
+MUTES_FILE = os.environ.get('REMOTEFOIL_MUTES', os.path.join(os.path.expanduser('~'), '.remotefoil', 'mutes.db'))
+MUTES_TIMEOUT = 5
+
+
+class MuteStore(MutableMapping):
+    """
+    MuteStore keeps the speakers muted on one Airfoil instance, as they were before they were muted, in an SQLite
+    database shared by every process that uses the same file. A speaker muted by one cli call or server worker is
+    unmuted to its earlier volume by any other, instead of to the default volume.
+
+    It works like the dict Airfoil.muted_speakers used to be, mapping speaker id to Airfoil.speaker object:
+        store[speaker.id] = speaker         # remember a speaker before muting it
+        store.pop(speaker.id, None)         # take it back when unmuting, in one transaction
+    Speaker ids are not case-sensitive. With path set to an empty string, mutes are only kept in memory.
+    """
+    def __init__(self, airfoil, path=MUTES_FILE):
+        """
+        :param airfoil:     ip of the Airfoil instance the mutes are for. unlike its name, the ip is the same whether
+                            the instance was found by name or given by address, and unlike its port, it stays the same
+                            when Airfoil restarts
+        :param path:        path of the database file, or an empty string to keep mutes in memory only
+        """
+        self.airfoil = airfoil.lower()
+        self.path = path
+        self.memory = None if path else {}
+        self.created = False
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # sqlite3 is imported here, so importing remoteFoil does not pay for it
+        import sqlite3
+        if not self.created:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=MUTES_TIMEOUT, isolation_level=None)
+        try:
+            # take the write lock up front, so a read followed by a delete can't interleave with another process
+            db.execute('BEGIN IMMEDIATE')
+            if not self.created:
+                db.execute('CREATE TABLE IF NOT EXISTS mutes (airfoil TEXT, id TEXT, speaker TEXT, '
+                           'PRIMARY KEY (airfoil, id))')
+            yield db
+            db.execute('COMMIT')
+            self.created = True
+        except BaseException:
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            raise
+        finally:
+            db.close()
+
+    @staticmethod
+    def _dumps(speaker):
+        import json
+        return json.dumps(speaker._asdict())
+
+    @staticmethod
+    def _loads(data):
+        import json
+        from remoteFoil.airfoil import Airfoil
+        return Airfoil.speaker(**json.loads(data))
+
+    def __getitem__(self, id):
+        if self.memory is not None:
+            return self.memory[id.lower()]
+        with self._transaction() as db:
+            row = db.execute('SELECT speaker FROM mutes WHERE airfoil = ? AND id = ?',
+                             (self.airfoil, id.lower())).fetchone()
+        if row is None:
+            raise KeyError(id)
+        return self._loads(row[0])
+
+    def __setitem__(self, id, speaker):
+        if self.memory is not None:
+            self.memory[id.lower()] = speaker
+            return
+        with self._transaction() as db:
+            db.execute('INSERT OR REPLACE INTO mutes (airfoil, id, speaker) VALUES (?, ?, ?)',
+                       (self.airfoil, id.lower(), self._dumps(speaker)))
+
+    def __delitem__(self, id):
+        if self.memory is not None:
+            del self.memory[id.lower()]
+            return
+        with self._transaction() as db:
+            deleted = db.execute('DELETE FROM mutes WHERE airfoil = ? AND id = ?', (self.airfoil, id.lower()))
+        if not deleted.rowcount:
+            raise KeyError(id)
+
+    def pop(self, id, *default):
+        """
+        remove a speaker and return it, reading and deleting it in one transaction, so of two processes unmuting the
+        same speaker only one gets the stored speaker back.
+        """
+        if self.memory is not None:
+            return self.memory.pop(id.lower(), *default)
+        with self._transaction() as db:
+            row = db.execute('SELECT speaker FROM mutes WHERE airfoil = ? AND id = ?',
+                             (self.airfoil, id.lower())).fetchone()
+            if row is not None:
+                db.execute('DELETE FROM mutes WHERE airfoil = ? AND id = ?', (self.airfoil, id.lower()))
+        if row is not None:
+            return self._loads(row[0])
+        if default:
+            return default[0]
+        raise KeyError(id)
+
+    def _ids(self):
+        if self.memory is not None:
+            return list(self.memory)
+        with self._transaction() as db:
+            rows = db.execute('SELECT id FROM mutes WHERE airfoil = ? ORDER BY id', (self.airfoil,)).fetchall()
+        return [id for id, in rows]
+
+    def __iter__(self):
+        return iter(self._ids())
+
+    def __len__(self):
+        return len(self._ids())
+
+    def __repr__(self):
+        return f'MuteStore({self.airfoil!r}, {self.path!r})'
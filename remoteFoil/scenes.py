@@ -0,0 +1,224 @@
+import json, os
+from collections import namedtuple
+from remoteFoil.airfoil import Airfoil
+
+SCENE_TARGETS = ['connected', 'volume', 'muted']
+SCENES_FILE = os.environ.get('REMOTEFOIL_SCENES', os.path.join(os.path.expanduser('~'), '.remotefoil', 'scenes.json'))
+# notifications after which a speaker name or keywords may no longer resolve to the same speaker id
+INVALIDATING = ['speakerListChanged', 'speakerNameChanged']
+
+
+class Scene(object):
+    """
+    A Scene is a target state for one Airfoil instance: a source, and for any number of speakers whether they are
+    connected, their volume, and whether they are muted. Applying a scene only sends the commands needed to get from
+    the current state to the target, as computed by Scene.diff.
+
+    A scene is read from a document like this, where speakers are matched by name, id, or keywords, and every
+    property is optional:
+        {"source": "Spotify",
+         "speakers": {"Bedroom speaker": {"connected": true, "volume": "40%"},
+                      "kitchen": {"connected": true, "muted": true},
+                      "Office": {"connected": false}}}
+    A speaker with both muted and volume is muted, and unmuting it later restores that volume.
+    """
+    step = namedtuple('step', 'action speaker value')
+
+    def __init__(self, speakers=None, source=None):
+        """
+        :param speakers:    dict of speaker name, id, or keywords to a dict of targets for that speaker
+        :param source:      source name, id, or keywords, or None to leave the source as it is
+        """
+        self.speakers = speakers or {}
+        self.source = source
+
+    @classmethod
+    def parse(cls, doc):
+        """
+        Scene.parse checks a scene document and returns it as a Scene.
+        :param doc:     dict, decoded from JSON
+        :return:        Scene object
+        """
+        if not isinstance(doc, dict):
+            raise ValueError('a scene must be a JSON object')
+        unknown = [k for k in doc if k not in ['source', 'speakers']]
+        if unknown:
+            raise ValueError(f'unknown scene properties: {", ".join(unknown)}')
+        source = doc.get('source')
+        if source is not None and not isinstance(source, str):
+            raise ValueError('scene source must be the name, id, or keywords of a source')
+        speakers = {}
+        for speaker, targets in (doc.get('speakers') or {}).items():
+            if not isinstance(targets, dict):
+                raise ValueError(f'targets for speaker \'{speaker}\' must be a JSON object')
+            unknown = [k for k in targets if k not in SCENE_TARGETS]
+            if unknown:
+                raise ValueError(f'unknown targets for speaker \'{speaker}\': {", ".join(unknown)}')
+            targets = dict(targets)
+            for k in ['connected', 'muted']:
+                if k in targets and not isinstance(targets[k], bool):
+                    raise ValueError(f'{k} for speaker \'{speaker}\' must be true or false')
+            if 'volume' in targets:
+                targets['volume'] = Airfoil._parse_volume(None, targets['volume'])
+            speakers[speaker] = targets
+        return cls(speakers, source)
+
+    def resolve(self, state):
+        """
+        Scene.resolve matches the speakers of the scene to speakers in an AirfoilState.
+        :param state:   AirfoilState
+        :return:        dict of speaker id to the targets for that speaker
+        """
+        targets = {}
+        for speaker, target in self.speakers.items():
+            match = state.find_speaker(unknown=speaker)
+            if not match:
+                raise ValueError(f'No speaker found with name, id, or keywords: \'{speaker}\'')
+            targets[match.id] = target
+        return targets
+
+    def diff(self, state, targets):
+        """
+        Scene.diff returns the commands needed to bring the speakers in state to their targets.
+        :param state:   AirfoilState
+        :param targets: dict of speaker id to targets, as returned by Scene.resolve
+        :return:        list of Scene.step objects. action is one of connect, disconnect, volume, mute or unmute, and
+                        value is the volume to set, or for mute, the volume to restore on unmute.
+        """
+        steps = []
+        for id, target in targets.items():
+            speaker = state.speakers[id]
+            if 'connected' in target and target['connected'] != speaker.connected:
+                steps.append(self.step('connect' if target['connected'] else 'disconnect', speaker, None))
+            volume = target.get('volume')
+            if target.get('muted'):
+                if speaker.volume:
+                    steps.append(self.step('mute', speaker, volume))
+            elif volume is not None:
+                if volume != speaker.volume:
+                    steps.append(self.step('volume', speaker, volume))
+            elif target.get('muted') is False and not speaker.volume:
+                steps.append(self.step('unmute', speaker, 1.0))
+        return steps
+
+    def missed(self, state, targets):
+        """
+        Scene.missed returns the speakers in state that are not at their targets, such as after a command failed.
+        :return:    list of Airfoil.speaker objects
+        """
+        missed = []
+        for id, target in targets.items():
+            speaker = state.speakers.get(id)
+            if not speaker:
+                continue
+            volume = 0 if target.get('muted') else target.get('volume')
+            if ('connected' in target and target['connected'] != speaker.connected) or \
+                    (volume is not None and volume != speaker.volume) or \
+                    (target.get('muted') is False and not speaker.volume):
+                missed.append(speaker)
+        return missed
+
+
+class SceneStore(object):
+    """
+    SceneStore keeps named scenes, like "dinner" or "bedtime", in a JSON file. The speakers of a scene are resolved
+    to speaker ids once per Airfoil instance, and the resolved plan is saved next to the scene, so replaying a scene
+    does not look up every speaker again.
+
+    A plan is used as long as every speaker id in it still exists with the name it had when the plan was made. A
+    long-running process can also drop plans as soon as Airfoil reports speakerListChanged or speakerNameChanged,
+    by adding SceneStore.listener(airfoil_name) to the listeners of the AirfoilState it uses.
+    """
+    def __init__(self, path=SCENES_FILE):
+        self.path = path
+        self.scenes = {}
+        self.plans = {}
+        self.load()
+
+    def load(self):
+        """read scenes and plans from the file, if it exists."""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        self.scenes = data.get('scenes', {})
+        self.plans = data.get('plans', {})
+
+    def _write(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temp = self.path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump({'scenes': self.scenes, 'plans': self.plans}, f, indent=2)
+        os.replace(temp, self.path)
+
+    def names(self):
+        return sorted(self.scenes)
+
+    def get(self, name):
+        """
+        :param name:    scene name, not case-sensitive
+        :return:        Scene object
+        """
+        doc = self.scenes.get(name.lower())
+        if doc is None:
+            raise ValueError(f'no scene named \'{name}\'')
+        return Scene.parse(doc)
+
+    def save(self, name, doc):
+        """
+        save a scene document under name, replacing any scene with that name.
+        :param name:    scene name, not case-sensitive
+        :param doc:     scene document, see Scene
+        """
+        Scene.parse(doc)
+        name = name.lower()
+        self.scenes[name] = doc
+        self.plans = {k: v for k, v in self.plans.items() if v['scene'] != name}
+        self._write()
+
+    def delete(self, name):
+        name = name.lower()
+        if name not in self.scenes:
+            raise ValueError(f'no scene named \'{name}\'')
+        del self.scenes[name]
+        self.plans = {k: v for k, v in self.plans.items() if v['scene'] != name}
+        self._write()
+
+    def resolve(self, name, airfoil_name, state):
+        """
+        SceneStore.resolve returns a scene and the speaker targets it resolves to on one Airfoil instance, using the
+        saved plan if it is still valid for the speakers in state.
+        :param name:            scene name, not case-sensitive
+        :param airfoil_name:    name of the Airfoil instance the scene is for
+        :param state:           AirfoilState holding the speakers of that instance
+        :return:                tuple of Scene object and dict of speaker id to targets, as returned by Scene.resolve
+        """
+        scene = self.get(name)
+        key = f'{airfoil_name}/{name.lower()}'
+        plan = self.plans.get(key)
+        if plan and all(id in state.speakers and state.speakers[id].name == speaker_name
+                        for id, speaker_name in plan['names'].items()):
+            return scene, plan['targets']
+        targets = scene.resolve(state)
+        self.plans[key] = {'scene': name.lower(), 'airfoil': airfoil_name, 'targets': targets,
+                           'names': {id: state.speakers[id].name for id in targets}}
+        self._write()
+        return scene, targets
+
+    def invalidate(self, airfoil_name=None):
+        """drop the plans for one Airfoil instance, or for every instance if airfoil_name is None."""
+        plans = {k: v for k, v in self.plans.items() if airfoil_name is not None and v['airfoil'] != airfoil_name}
+        if plans != self.plans:
+            self.plans = plans
+            self._write()
+
+    def listener(self, airfoil_name):
+        """
+        :return:    a callable for AirfoilState.listeners that drops the plans for airfoil_name when its speakers are
+                    added, removed or renamed
+        """
+        def on_notification(message):
+            if message.get('request') in INVALIDATING:
+                self.invalidate(airfoil_name)
+        return on_notification
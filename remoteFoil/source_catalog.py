@@ -0,0 +1,101 @@
+import time
+
+SOURCES_TTL = 60
+# share of SOURCES_TTL after which a read still uses the catalog but starts a refresh in the background
+SOURCES_REFRESH = 0.5
+
+
+class SourceCatalog(object):
+    """
+    SourceCatalog keeps the sources of one Airfoil instance, as read with getSourceList, indexed by id, name and
+    keyword, so looking up a source to select does not download the whole list every time.
+
+    - the catalog is used for ttl seconds after it was loaded. Once it is older than SOURCES_REFRESH of that, reads
+      still use it, and refresh_due tells the owner to reload it in the background.
+    - invalidate drops it, so the next read loads it again. A lookup that misses also reloads it once, since the
+      source may have appeared after the catalog was loaded, like an application that was just started.
+    - version is incremented whenever a reload finds sources that differ from the ones already in the catalog.
+    """
+    def __init__(self, ttl=SOURCES_TTL):
+        """
+        :param ttl:     int or float, seconds the catalog is used for after it was loaded
+        """
+        self.ttl = ttl
+        self.sources = []
+        self.ids = {}
+        self.names = {}
+        self.keywords = {}
+        self.loaded = None
+        self.version = 0
+        self.refreshing = False
+
+    def load(self, sources):
+        """
+        replace the sources in the catalog.
+        :param sources:     list of Airfoil.source objects, in the order Airfoil reported them
+        """
+        if [s[:4] for s in sources] != [s[:4] for s in self.sources]:
+            self.version += 1
+        ids, names, keywords = {}, {}, {}
+        for source in sources:
+            # later sources win, like the loops over the whole list did
+            ids[source.id.lower()] = source
+            names[source.name.lower()] = source
+            for keyword in source.keywords:
+                keywords.setdefault(keyword, []).append(source)
+        self.sources, self.ids, self.names, self.keywords = list(sources), ids, names, keywords
+        self.loaded = time.monotonic()
+        self.refreshing = False
+
+    def invalidate(self):
+        """drop the catalog, so the next read loads the sources from Airfoil again."""
+        self.loaded = None
+
+    def age(self):
+        """:return: seconds since the catalog was loaded, or None if it is not loaded"""
+        return None if self.loaded is None else time.monotonic() - self.loaded
+
+    @property
+    def stale(self):
+        """True if the catalog has to be loaded before it can be used."""
+        age = self.age()
+        return age is None or age >= self.ttl
+
+    @property
+    def refresh_due(self):
+        """True if the catalog can still be used, but should be reloaded in the background."""
+        age = self.age()
+        return age is not None and not self.refreshing and self.ttl * SOURCES_REFRESH <= age < self.ttl
+
+    def find(self, id=None, name=None, keywords=[], unknown=None):
+        """
+        SourceCatalog.find returns the source with the id or name, or the last source matching all keywords. unknown
+        is tried as a name, an id, and keywords, in that order.
+        :param id:          source id, string, not case-sensitive
+        :param name:        source name, string, not case-sensitive
+        :param keywords:    list of strings, not case-sensitive
+        :param unknown:     source name, id, or keywords, string, not case-sensitive
+        :return:            Airfoil.source object, or None if no source matches
+        """
+        if unknown:
+            from remoteFoil.airfoil import Airfoil
+            return self.names.get(unknown.lower()) or self.ids.get(unknown.lower()) or \
+                self.find(keywords=Airfoil.get_keywords(None, unknown))
+        if id:
+            return self.ids.get(id.lower())
+        if name:
+            return self.names.get(name.lower())
+        if keywords:
+            keywords = [kw.lower() for kw in ([keywords] if isinstance(keywords, str) else keywords)]
+            matches = [s for s in self.keywords.get(keywords[0], []) if all(kw in s.keywords for kw in keywords)]
+            return matches[-1] if matches else None
+        return None
+
+    def listener(self, message):
+        """
+        SourceCatalog.listener can be added to the listeners of an AirfoilState. It drops the catalog after a
+        resubscribe, since Airfoil may have changed its sources while the subscription was down.
+        """
+        from remoteFoil.airfoil import RESYNCED
+        if message.get('request') == RESYNCED:
+            self.invalidate()
@@ -1,5 +1,7 @@
-import os
+import os, sys
+from itertools import zip_longest
 DEFAULT_WIDTH = 80
+MIN_COLUMN = 10
 
 def nones(n):
     return [None for _ in range(n)]
@@ -9,69 +11,150 @@ def bools(bool_check):
     return 'yes' if bool_check else 'no'
 
 
-def print_table(headers, rows, sizes):
-    def fit_to_term():
-        # find terminal width, then reduce largest column size by 1 until everything fits
-        try:
-            x = os.get_terminal_size()[0] - 2
-        except OSError:
-            x = DEFAULT_WIDTH
-        width = sum(short_sizes) + len(short_sizes) - 1
-        sizes = [s for s in short_sizes]
-        while width > x:
-            widest = max(sizes)
-            for n, size in enumerate(sizes):
-                if size == widest:
-                    sizes[n] -= 1
-                    width = sum(sizes) + len(sizes) - 1
-                    break
-        return sizes
-
-    output = []
-    template = ""
-
-    if type(rows[0]) is str:
+def terminal_width():
+    try:
+        return os.get_terminal_size()[0] - 2
+    except OSError:
+        return DEFAULT_WIDTH
+
+
+def fit_sizes(sizes, width):
+    """
+    fit_sizes shrinks column sizes in one pass so the columns, and the space after each one, fit in width. Columns
+    wider than MIN_COLUMN give up width in proportion to how much wider they are, so narrow columns like flags and
+    numbers keep their size. Only when that is not enough are all columns shrunk, down to one character each.
+    :param sizes:   list of column sizes
+    :param width:   int, characters available
+    :return:        list of column sizes
+    """
+    excess = sum(sizes) + len(sizes) - 1 - width
+    if excess <= 0:
+        return list(sizes)
+    spare = [s - min(s, MIN_COLUMN) for s in sizes]
+    if sum(spare) < excess:
+        spare = [s - 1 for s in sizes]
+        excess = min(excess, sum(spare))
+    if not excess:
+        # every column is already down to one character, there is nothing left to cut
+        return list(sizes)
+    cuts = [excess * s / sum(spare) for s in spare]
+    fitted = [s - int(cut) for s, cut in zip(sizes, cuts)]
+    # rounding every cut down leaves a few characters over, taken from the columns that were rounded down the most
+    over = sum(fitted) + len(fitted) - 1 - width
+    rounded = sorted([n for n in range(len(sizes)) if cuts[n] % 1], key=lambda n: int(cuts[n]) - cuts[n])
+    for n in rounded[:max(0, over)]:
+        fitted[n] -= 1
+    return fitted
+
+
+def _lines(row, sizes):
+    # a cell longer than its column wraps onto the next lines of the row
+    template = ''.join('{:<' + str(size) + '} ' for size in sizes)
+    cells = [[cell[i:i + size] for i in range(0, len(cell), size)] for cell, size in zip(row, sizes)]
+    return [template.format(*line) for line in zip_longest(*cells, fillvalue='')]
+
+
+def table_lines(headers, rows, sizes, width=None):
+    """
+    table_lines lays out a table like print_table does, and returns its lines instead of printing them.
+    :param width:   int, characters available, default None for the width of the terminal
+    :return:        list of strings
+    """
+    if rows and type(rows[0]) is str:
         rows = [rows, ]
-    short_sizes = []
 
     # automatically shrink columns to the minimum required for the longest data if not longer than
     #   specified size
-    for n, s in enumerate(sizes):
-        max_size = s
-        h_len = len(headers[n])
-        size = h_len if h_len < max_size else max_size
-        for r in rows:
-            s_len = len(r[n]) if len(r[n]) < max_size else max_size
-            size = s_len if s_len > size else size
-        short_sizes.append(size)
-
-    short_sizes = fit_to_term()
-
-    for size in short_sizes:
-        template += "{:<"+str(size)+"} "
-
-    def process_row(row):
-        while any(row):
-            line = []
-            rest = []
-            for n, s in enumerate(row):
-                line.append(s[:short_sizes[n]])
-                rest.append(s[short_sizes[n]:])
-            output.append(template.format(*line))
-            row = rest
-
-    process_row(headers)
-    dashes = ['-'*s for s in short_sizes]
-    process_row(dashes)
-
+    short_sizes = [min(max([len(headers[n])] + [len(r[n]) for r in rows]), s) for n, s in enumerate(sizes)]
+    short_sizes = fit_sizes(short_sizes, terminal_width() if width is None else width)
 
+    output = _lines(headers, short_sizes) + _lines(['-' * s for s in short_sizes], short_sizes)
     for row in rows:
-        process_row(row)
-    # print(output)
-    for o in output:
-        print(o)
+        output += _lines(row, short_sizes)
+    return output
 
 
+def print_table(headers, rows, sizes):
+    for line in table_lines(headers, rows, sizes):
+        print(line)
+
+
+class TableWriter(object):
+    """
+    TableWriter prints a table one row at a time, for rows that arrive over time, like events. The rows to come are
+    not known when the header is printed, so every column is as wide as its size, shrunk to fit the terminal, instead
+    of as wide as its longest cell.
+    """
+    def __init__(self, headers, sizes, width=None, file=None):
+        """
+        :param headers: list of column names
+        :param sizes:   list of column sizes
+        :param width:   int, characters available, default None for the width of the terminal
+        :param file:    file to print to, default None for sys.stdout
+        """
+        self.headers = headers
+        self.sizes = fit_sizes(sizes, terminal_width() if width is None else width)
+        self.file = file
+        self.started = False
+
+    def write(self, row):
+        """print one row, after the header if this is the first one."""
+        lines = _lines(row, self.sizes)
+        if not self.started:
+            lines = _lines(self.headers, self.sizes) + _lines(['-' * s for s in self.sizes], self.sizes) + lines
+            self.started = True
+        file = self.file or sys.stdout
+        file.write(''.join(line + '\n' for line in lines))
+        file.flush()
+
+
+class LiveTable(object):
+    """
+    LiveTable draws a table on a terminal and draws it again in place whenever it changes, for views that follow
+    changes as they happen. Each update only rewrites the lines that changed since the last one, with ANSI escape
+    codes, so the file has to be a terminal that understands them. Nothing else should be printed to the terminal
+    between updates.
+    """
+    def __init__(self, headers, sizes, file=None):
+        """
+        :param headers: list of column names
+        :param sizes:   list of column sizes, as for print_table
+        :param file:    terminal to draw on, default None for sys.stdout
+        """
+        self.headers = headers
+        self.sizes = sizes
+        self.file = file
+        self.lines = []
+
+    def update(self, rows, status=None):
+        """
+        draw the table with new rows.
+        :param rows:    list of rows, as for print_table
+        :param status:  string, default None, a line to show below the table
+        """
+        lines = table_lines(self.headers, rows, self.sizes)
+        if status is not None:
+            # a line longer than the terminal would wrap, and the lines of the table would no longer be where they
+            # were drawn
+            lines.append(status[:terminal_width()])
+        if lines == self.lines:
+            return
+        # back to the first line drawn last time, then down over the lines that did not change
+        out, unchanged = f'\x1b[{len(self.lines)}F' if self.lines else '', 0
+        for n, line in enumerate(lines):
+            if n < len(self.lines) and self.lines[n] == line:
+                unchanged += 1
+                continue
+            out += (f'\x1b[{unchanged}E' if unchanged else '') + '\x1b[2K' + line + '\n'
+            unchanged = 0
+        out += f'\x1b[{unchanged}E' if unchanged else ''
+        if len(lines) < len(self.lines):
+            out += '\x1b[J'
+        file = self.file or sys.stdout
+        file.write(out)
+        file.flush()
+        self.lines = lines
+
 
 #
 # header = ['name','id','keywords']
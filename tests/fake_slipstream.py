@@ -0,0 +1,168 @@
+import ast, json, socket, threading, time
+
+HELLO = b'com.rogueamoeba.protocol.slipstreamremote\nmajorversion=1,minorversion=5\nOK\n'
+SPEAKERS = [
+    {'name': 'Bedroom speaker', 'type': 'chromecast', 'longIdentifier': 'CC-1@Bedroom speaker', 'volume': 0.5,
+     'connected': True, 'password': False},
+    {'name': 'Office speaker', 'type': 'chromecast', 'longIdentifier': 'CC-2@Office speaker', 'volume': 0.0,
+     'connected': False, 'password': False},
+    {'name': 'Kitchen', 'type': 'airplay', 'longIdentifier': 'AP-3@Kitchen', 'volume': 1.0, 'connected': True,
+     'password': False},
+]
+SOURCES = {'audioDevices': [{'friendlyName': 'Microphone (USB)', 'identifier': 'usb-mic'}],
+           'runningApplications': [{'friendlyName': 'Spotify', 'identifier': 'spotify.exe'}],
+           'recentApplications': [],
+           'systemAudio': [{'friendlyName': 'System Audio', 'identifier': 'windows.systemaudio'}]}
+
+
+class FakeSlipstream(object):
+    """
+    FakeSlipstream is a local Slipstream server standing in for Airfoil, with the speakers in SPEAKERS and the sources
+    in SOURCES. It answers the requests Airfoil does, and sends the notifications Airfoil would to subscribed
+    connections. Tests change how it behaves with:
+    - hold:             set of request names that are never answered. 'hello' holds the handshake.
+    - drop:             set of request names that close the connection instead of being answered
+    - reject:           set of speaker ids whose commands are answered with success False
+    - delay:            dict of request name to seconds to wait before answering
+    - connect_delay:    seconds between accepting a connect or disconnect and notifying that it happened
+    - quiet:            True to send no notifications
+    - hello:            the reply to the handshake
+    log holds the names of the requests received, in order, and connections every connection that is open.
+    """
+    def __init__(self, connect_delay=0.0):
+        self.speakers = {s['longIdentifier']: dict(s) for s in SPEAKERS}
+        self.source = 'System Audio'
+        self.hold, self.drop, self.reject, self.delay = set(), set(), set(), {}
+        self.connect_delay = connect_delay
+        self.quiet = False
+        self.hello = HELLO
+        self.log = []
+        self.connections = []
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(50)
+        self.port = self.sock.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections.append(conn)
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _send(self, conn, message):
+        data = json.dumps(message)
+        try:
+            with self.lock:
+                conn.sendall(f'{len(data)};{data}'.encode())
+        except OSError:
+            pass
+
+    def notify(self, message):
+        """send a notification to every subscribed connection."""
+        if not self.quiet:
+            for conn in list(self.subscribers):
+                self._send(conn, message)
+
+    def _serve(self, conn):
+        try:
+            hello = b''
+            while not hello.endswith(b'OK\n'):
+                data = conn.recv(1)
+                if not data:
+                    return
+                hello += data
+            if 'hello' in self.hold:
+                return
+            conn.sendall(self.hello)
+            buffer = b''
+            while True:
+                data = conn.recv(4096)
+                if not data:
+                    return
+                buffer += data
+                while b';' in buffer:
+                    size, rest = buffer.split(b';', 1)
+                    if len(rest) < int(size):
+                        break
+                    # the client sends python literals rather than JSON
+                    self._handle(conn, ast.literal_eval(rest[:int(size)].decode()))
+                    buffer = rest[int(size):].lstrip(b'\r\n')
+        except OSError:
+            pass
+        finally:
+            if conn in self.subscribers:
+                self.subscribers.remove(conn)
+
+    def _handle(self, conn, cmd):
+        request, reply_id, data = cmd['request'], cmd['requestID'], cmd.get('data') or {}
+        self.log.append(request)
+        if request in self.hold:
+            return
+        if request in self.drop:
+            conn.shutdown(socket.SHUT_RDWR)
+            return
+        time.sleep(self.delay.get(request, 0))
+        id = data.get('longIdentifier')
+        success = id not in self.reject
+        if request == 'subscribe':
+            self.subscribers.append(conn)
+            self._send(conn, {'replyID': reply_id, 'data': {'speakers': [dict(s) for s in self.speakers.values()]}})
+        elif request in ('connectToSpeaker', 'disconnectSpeaker'):
+            self._send(conn, {'replyID': reply_id, 'data': {'success': success}})
+            if success:
+                threading.Thread(target=self._connected, args=(id, request == 'connectToSpeaker'), daemon=True).start()
+        elif request == 'setSpeakerVolume':
+            if success:
+                self.speakers[id]['volume'] = data['volume']
+            self._send(conn, {'replyID': reply_id, 'data': {'success': success}})
+            if success:
+                self.notify({'request': 'speakerVolumeChanged', 'requestID': '0',
+                             'data': {'longIdentifier': id, 'volume': data['volume']}})
+        elif request == 'getSourceList':
+            self._send(conn, {'replyID': reply_id, 'data': SOURCES})
+        elif request == 'getSourceMetadata':
+            self._send(conn, {'replyID': reply_id, 'data': {'metadata': {
+                'sourceName': self.source, 'remoteControlAvailable': self.source == 'Spotify',
+                'trackMetadataAvailable': False}}})
+        elif request == 'selectSource':
+            for source in [s for sources in SOURCES.values() for s in sources]:
+                if source['identifier'] == data['identifier']:
+                    self.source = source['friendlyName']
+            self._send(conn, {'replyID': reply_id, 'data': {'success': True}})
+            self.notify({'request': 'sourceMetadataChanged', 'requestID': '0', 'data': {}})
+        elif request == 'remoteCommand':
+            self._send(conn, {'replyID': reply_id, 'data': {'success': True}})
+
+    def _connected(self, id, connected):
+        time.sleep(self.connect_delay)
+        self.speakers[id]['connected'] = connected
+        self.notify({'request': 'speakerConnectedChanged', 'requestID': '0',
+                     'data': {'longIdentifier': id, 'connected': connected}})
+
+    def drop_subscribers(self):
+        """close every subscribed connection, like a network drop."""
+        for conn in list(self.subscribers):
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        """stop listening and close every connection, like Airfoil quitting."""
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        for conn in list(self.connections):
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.close()
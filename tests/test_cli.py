@@ -0,0 +1,62 @@
+import pytest
+from airfoil_cli import AirfoilCli, parse_args
+from remoteFoil.airfoil import Airfoil
+
+SPEAKERS = [Airfoil.speaker('Kitchen', 'airplay', 'AP-1', 1.0, True, False, ['kitchen']),
+            Airfoil.speaker('Den', 'airplay', 'AP-2', 0.5, False, False, ['den']),
+            Airfoil.speaker('Living Room', 'airplay', 'AP-3', 0.5, True, False, ['living', 'room'])]
+
+
+class FakeAirfoil(object):
+    # the parts of Airfoil the cli uses to pick speakers, counting how often the speakers are read
+    find_speaker = Airfoil.find_speaker
+    get_keywords = Airfoil.get_keywords
+    _parse_volume = Airfoil._parse_volume
+
+    def __init__(self):
+        self.reads = 0
+
+    def get_speakers(self, ids=[], names=[], fresh=False):
+        self.reads += 1
+        return list(SPEAKERS)
+
+
+def selected(*argv):
+    airfoil = FakeAirfoil()
+    cli = AirfoilCli(['cli'] + list(argv), lambda **kwargs: airfoil)
+    return [s.name for s in cli.speakers or []], airfoil.reads
+
+
+class TestCliSpeakers:
+    def test_named(self, capsys):
+        assert selected('den') == (['Den'], 1)
+        assert selected('speakers', 'den') == (['Den'], 1)
+        assert selected('kitchen', 'den') == (['Kitchen', 'Den'], 1)
+        # comma separated lists, and keyword groups the shell split at their spaces
+        assert selected('den,[living', 'room]') == (['Den', 'Living Room'], 1)
+        assert selected('ap-1,living_room') == (['Kitchen', 'Living Room'], 1)
+
+    def test_all(self, capsys):
+        # alone, speakers and all select the connected speakers, all with names adds those to them
+        assert selected('speakers') == (['Kitchen', 'Living Room'], 1)
+        assert selected('all') == (['Kitchen', 'Living Room'], 1)
+        assert selected('all', 'den') == (['Kitchen', 'Living Room', 'Den'], 1)
+        assert selected('all', 'kitchen') == (['Kitchen', 'Living Room'], 1)
+        assert selected('speakers', 'include_disconnected') == (['Kitchen', 'Den', 'Living Room'], 1)
+
+    def test_no_speakers(self, capsys):
+        assert selected('ip', '10.0.0.2', 'port', '52000') == ([], 0)
+
+    def test_unknown(self, capsys):
+        with pytest.raises(SystemExit):
+            selected('kitchen', 'garage')
+        assert '\'garage\' is not a recognized speaker' in capsys.readouterr().out
+
+
+class TestCliArgs:
+    def test_parse_args(self):
+        assert parse_args(['cli', '--Name', 'Office', '-I', '/timeout']) == ['cli', 'name', 'office', 'i', 'timeout']
+        # scene documents keep the case of speaker and source names
+        doc = '{"source": "Spotify", "speakers": {"Living Room": {"volume": "40%"}}}'
+        assert parse_args(['cli', 'scene', 'Evening', doc]) == ['cli', 'scene', 'evening', doc]
+        assert parse_args([' ' + doc]) == [' ' + doc]
@@ -0,0 +1,62 @@
+import threading, time
+import airfoil_cli
+from airfoil_cli import step_targets, step_chains, run_script
+
+
+class TestCliScript:
+    def test_step_targets(self):
+        assert step_targets(['kitchen', 'mute']) == (None, {'kitchen'})
+        assert step_targets(['-n', 'office', 'kitchen', 'volume', '40%']) == (('office', None, None), {'kitchen'})
+        assert step_targets(['-i', '10.0.0.2', '-p', '52000', 'speakers', 'kitchen,den', 'fade', '0.5', '3']) == \
+            ((None, '10.0.0.2', '52000'), {'kitchen', 'den'})
+        assert step_targets(['[living,room]', 'on']) == (None, {'living', 'room'})
+        # no speakers, all of them, or the instance as a whole
+        assert step_targets(['mute']) == (None, None)
+        assert step_targets(['all', 'mute']) == (None, None)
+        assert step_targets(['-n', 'office', 'play']) == (('office', None, None), None)
+        assert step_targets(['source', 'spotify']) == (None, None)
+
+    def test_step_chains(self):
+        steps = [['kitchen', 'mute'], ['den', 'on'], ['kitchen', 'volume', '50%'], ['patio', 'off'],
+                 ['den', 'fade', '0.2']]
+        assert step_chains(steps) == [[0, 2], [1, 4], [3]]
+        # different instances never share speakers, a step without an instance may be for any of them
+        steps = [['-n', 'a', 'kitchen', 'mute'], ['-n', 'b', 'kitchen', 'mute'], ['kitchen', 'on']]
+        assert step_chains(steps) == [[0, 1, 2]]
+        assert step_chains(steps[:2]) == [[0], [1]]
+        # a step on the whole instance joins every chain before it, and every step after it joins its chain
+        steps = [['kitchen', 'mute'], ['den', 'mute'], ['play'], ['patio', 'on']]
+        assert step_chains(steps) == [[0, 1, 2, 3]]
+        steps = [['-n', 'a', 'kitchen', 'mute'], ['-n', 'b', 'play'], ['-n', 'a', 'den', 'on']]
+        assert step_chains(steps) == [[0], [1], [2]]
+        assert step_chains([]) == []
+
+    def test_run_script(self, monkeypatch, capsys):
+        ran, lock = [], threading.Lock()
+
+        class FakeCli(object):
+            # records the steps it is created for, the first step of each speaker taking longest
+            def __init__(self, argv, new_airfoil):
+                time.sleep(0.2 if argv[-1] == 'mute' else 0)
+                with lock:
+                    ran.append(argv[1:])
+                print('ran', ' '.join(argv[1:]))
+                self.airfoil = None
+                if argv[1] == 'bad':
+                    raise SystemExit(2)
+        monkeypatch.setattr(airfoil_cli, 'AirfoilCli', FakeCli)
+
+        started = time.monotonic()
+        assert run_script(['kitchen mute', 'kitchen volume 50%', 'den mute', '# comment', '', 'den on']) == 0
+        assert time.monotonic() - started < 0.35
+        assert [step for step in ran if step[0] == 'kitchen'] == [['kitchen', 'mute'], ['kitchen', 'volume', '50%']]
+        assert [step for step in ran if step[0] == 'den'] == [['den', 'mute'], ['den', 'on']]
+        # output is printed in the order of the script, whatever order the steps finished in
+        assert capsys.readouterr().out.split('\n') == [
+            '> kitchen mute', 'ran kitchen mute', '> kitchen volume 50%', 'ran kitchen volume 50%',
+            '> den mute', 'ran den mute', '> den on', 'ran den on', '']
+
+        # a failed step skips the rest of its chain, the others finish, and the script stops
+        ran.clear()
+        assert run_script(['bad on', 'bad off', 'den on', 'wait 0', 'den off']) == 2
+        assert ran == [['bad', 'on'], ['den', 'on']] or ran == [['den', 'on'], ['bad', 'on']]
@@ -0,0 +1,62 @@
+import threading, time
+import pytest
+from airfoil_http import _coalesce
+from remoteFoil.airfoil import Airfoil, AirfoilTimeoutError, deadline, time_left
+from remoteFoil.coalescer import VolumeCoalescer
+
+KITCHEN = Airfoil.speaker('Kitchen', 'airplay', 'AP-3', 1.0, True, False, ['kitchen'])
+
+
+class FakeAirfoil(object):
+    # the parts of Airfoil that VolumeCoalescer uses, answering for one speaker without a network
+    _parse_volume = Airfoil._parse_volume
+
+    def __init__(self):
+        self.sent = []
+
+    def find_speaker(self, id=None, name=None, keywords=[]):
+        if (id or '').lower() == 'ap-3' or (name or '').lower() == 'kitchen' or keywords == ['kitchen']:
+            return KITCHEN
+        raise ValueError('no speaker')
+
+    def set_volume(self, volume, *, id=None, confirm=False):
+        time_left(None)
+        self.sent.append((id, volume))
+        return [KITCHEN._replace(volume=volume)]
+
+
+class TestCoalescer:
+    def test_collapse(self):
+        airfoil = FakeAirfoil()
+        coalescer = VolumeCoalescer(airfoil, window=0.1)
+        results = []
+
+        def change(volume, **kwargs):
+            results.append(coalescer.set_volume(volume, **kwargs))
+        threads = [threading.Thread(target=change, args=(v,), kwargs=k)
+                   for v, k in [(0.2, {'name': 'Kitchen'}), (0.3, {'id': 'AP-3'}), ('40%', {'keywords': ['kitchen']})]]
+        for thread in threads:
+            thread.start()
+            time.sleep(0.01)
+        for thread in threads:
+            thread.join(timeout=5)
+        # one write of the latest volume, whichever way the speaker was asked for, and every caller gets its result
+        assert airfoil.sent == [('AP-3', 0.4)]
+        assert results == [[KITCHEN._replace(volume=0.4)]] * 3
+        assert coalescer.pending == {}
+
+    def test_deadline(self):
+        coalescer = VolumeCoalescer(FakeAirfoil(), window=0.1)
+        with deadline(0.05):
+            with pytest.raises(AirfoilTimeoutError):
+                coalescer.set_volume(0.5, name='kitchen')
+        with pytest.raises(ValueError):
+            coalescer.set_volume(0.5, name='office')
+
+    def test_coalesce_argument(self):
+        assert _coalesce('true') is True and _coalesce('Yes') is True
+        assert _coalesce('false') is False and _coalesce('no') is False and _coalesce('') is False
+        assert _coalesce('0.2') == 0.2
+        for value in ['sometimes', '-1']:
+            with pytest.raises(ValueError):
+                _coalesce(value)
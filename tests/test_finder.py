@@ -0,0 +1,281 @@
+import socket, threading, time
+from types import SimpleNamespace
+import pytest
+from remoteFoil import airfoil_finder
+from remoteFoil._zeroconf import DNSIncoming, DNSOutgoing, DNSPointer, DNSService, _CLASS_IN, _CLASS_UNIQUE, _DNS_TTL, \
+    _FLAGS_AA, _FLAGS_QR_RESPONSE, _TYPE_PTR, _TYPE_SRV, current_time_millis
+from remoteFoil.airfoil_finder import AirfoilFinder, SlipstreamBrowser
+
+DOMAIN = AirfoilFinder.domain
+
+
+class FakeZeroconf(object):
+    # answers get_service_info like zeroconf would, after delay seconds, with partial answers first for some services
+    def __init__(self, delay=0.0, partial=None):
+        self.delay = delay
+        self.partial = dict(partial or {})
+        self.asked = []
+        self.engine = SimpleNamespace(timeout=None, del_reader=lambda sock: None)
+        self._respond_sockets = []
+        self.closed = False
+
+    def get_service_info(self, type, name, timeout=None):
+        self.asked.append(name)
+        time.sleep(self.delay)
+        if self.partial.get(name):
+            self.partial[name] -= 1
+            return SimpleNamespace(address=None, port=None)
+        return SimpleNamespace(address=bytes([10, 0, 0, len(self.asked)]), port=5000 + len(self.asked))
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def finder(monkeypatch):
+    monkeypatch.setattr(AirfoilFinder, 'airfoils', {})
+    monkeypatch.setattr(airfoil_finder, 'RESOLVE_BACKOFF', 0.01)
+    monkeypatch.setattr(airfoil_finder, 'SlipstreamBrowser', lambda zc, type, listener: None)
+    finders = []
+
+    def new_finder(zc, on_add=None):
+        monkeypatch.setattr(airfoil_finder.zeroconf, 'Zeroconf', lambda: zc)
+        finders.append(AirfoilFinder(on_add=on_add))
+        return finders[-1]
+    yield new_finder
+    for finder in finders:
+        finder.close()
+
+
+def wait_for(condition, seconds=2):
+    ends = time.monotonic() + seconds
+    while not condition() and time.monotonic() < ends:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestResolve:
+    def test_concurrent(self, finder):
+        zc = FakeZeroconf(delay=0.3)
+        added = []
+        f = finder(zc, on_add=lambda name, ip, port: added.append(name))
+        started = time.monotonic()
+        for i in range(6):
+            f.add_service(zc, DOMAIN, f'Host{i}.{DOMAIN}')
+        # the browser thread is not held up while services resolve
+        assert time.monotonic() - started < 0.1
+        assert wait_for(lambda: len(f.airfoils) == 6)
+        assert time.monotonic() - started < 0.6
+        assert sorted(added) == [f'host{i}' for i in range(6)]
+
+    def test_once(self, finder):
+        zc = FakeZeroconf(delay=0.1)
+        f = finder(zc)
+        for _ in range(3):
+            f.add_service(zc, DOMAIN, f'Office.{DOMAIN}')
+        assert wait_for(lambda: 'office' in f.airfoils)
+        time.sleep(0.1)
+        assert zc.asked == [f'Office.{DOMAIN}']
+        ip, port, name = f.airfoils['office']
+        assert (ip, port, name) == ('10.0.0.1', 5001, 'office')
+
+    def test_retry(self, finder):
+        zc = FakeZeroconf(partial={f'Office.{DOMAIN}': 2})
+        f = finder(zc)
+        f.add_service(zc, DOMAIN, f'Office.{DOMAIN}')
+        # a partial answer is asked again after a backoff, without holding a resolver thread
+        assert wait_for(lambda: 'office' in f.airfoils)
+        assert zc.asked == [f'Office.{DOMAIN}'] * 3
+
+    def test_give_up(self, finder, monkeypatch, capsys):
+        monkeypatch.setattr(airfoil_finder, 'RESOLVE_RETRIES', 2)
+        zc = FakeZeroconf(partial={f'Office.{DOMAIN}': 10})
+        f = finder(zc)
+        f.add_service(zc, DOMAIN, f'Office.{DOMAIN}')
+        assert wait_for(lambda: not f.resolving)
+        assert len(zc.asked) == 3 and not f.airfoils
+        assert 'could not be resolved' in capsys.readouterr().out
+
+    def test_removed(self, finder):
+        zc = FakeZeroconf(delay=0.2)
+        f = finder(zc)
+        f.add_service(zc, DOMAIN, f'Office.{DOMAIN}')
+        f.remove_service(zc, DOMAIN, f'Office.{DOMAIN}')
+        time.sleep(0.3)
+        # a service removed while it was being resolved is not added once its answer arrives
+        assert not f.airfoils and not f.resolving
+
+    def test_close(self, finder):
+        zc = FakeZeroconf(delay=0.2)
+        f = finder(zc)
+        f.add_service(zc, DOMAIN, f'Office.{DOMAIN}')
+        started = time.monotonic()
+        f.close()
+        assert time.monotonic() - started < 0.1 and zc.closed
+        f.add_service(zc, DOMAIN, f'Kitchen.{DOMAIN}')
+        time.sleep(0.3)
+        assert zc.asked == [f'Office.{DOMAIN}'] and not f.airfoils
+
+
+class FakeEngine(object):
+    # the parts of Zeroconf a browser uses, keeping the queries it sends
+    def __init__(self):
+        self.done = False
+        self.sent = []
+
+    def add_listener(self, listener, question):
+        pass
+
+    def remove_listener(self, listener):
+        pass
+
+    def wait(self, ms):
+        time.sleep(min(ms, 10) / 1000)
+
+    def send(self, out, addr=None, port=None):
+        self.sent.append((time.monotonic(), out))
+
+
+class Listener(object):
+    def __init__(self):
+        self.added = []
+
+    def add_service(self, zc, type, name):
+        self.added.append(name)
+
+    def remove_service(self, zc, type, name):
+        pass
+
+
+@pytest.fixture
+def browse(monkeypatch):
+    monkeypatch.setattr(SlipstreamBrowser, 'known_answers', {})
+    engines = []
+
+    def new_browser(listener):
+        engines.append(FakeEngine())
+        return SlipstreamBrowser(engines[-1], DOMAIN, listener), engines[-1]
+    yield new_browser
+    for engine in engines:
+        engine.done = True
+
+
+class TestBrowse:
+    def test_schedule(self):
+        delays = [SlipstreamBrowser._next_delay(None, queries) for queries in range(10)]
+        assert delays == [150, 300, 1000, 2000, 4000, 8000, 16000, 32000, 60000, 60000]
+
+    def test_queries(self, browse, monkeypatch):
+        monkeypatch.setattr(airfoil_finder, 'BROWSE_BURST', [50, 100])
+        monkeypatch.setattr(airfoil_finder, 'BROWSE_DELAY', 200)
+        started = time.monotonic()
+        browser, engine = browse(Listener())
+        time.sleep(0.55)
+        times = [t - started for t, _ in engine.sent]
+        gaps = [b - a for a, b in zip(times, times[1:])]
+        # one query straight away, a burst, and then backing off
+        assert len(times) == 4 and times[0] < 0.05
+        assert 0.04 < gaps[0] < 0.1 and 0.09 < gaps[1] < 0.15 and 0.19 < gaps[2] < 0.25
+        # only the first query asks for a unicast answer
+        classes = [out.questions[0].class_ for _, out in engine.sent]
+        assert classes[0] & _CLASS_UNIQUE and not any(c & _CLASS_UNIQUE for c in classes[1:])
+
+    def test_known_answers(self, browse, monkeypatch):
+        monkeypatch.setattr(airfoil_finder, 'BROWSE_BURST', [50, 50])
+        listener = Listener()
+        browser, engine = browse(listener)
+        time.sleep(0.02)
+        record = DNSPointer(DOMAIN, _TYPE_PTR, _CLASS_IN, _DNS_TTL, f'Office.{DOMAIN}')
+        browser.update_record(engine, current_time_millis(), record)
+        assert wait_for(lambda: len(engine.sent) == 2)
+        # queries after an instance was seen carry it as a known answer, so it is not sent again
+        assert [len(out.answers) for _, out in engine.sent] == [0, 1]
+        assert listener.added == [f'Office.{DOMAIN}']
+        # and a browser started later reports it, and sends it with its first query
+        other = Listener()
+        browser, engine = browse(other)
+        assert wait_for(lambda: other.added and engine.sent)
+        assert other.added == [f'Office.{DOMAIN}']
+        assert [r.alias for r, _ in engine.sent[0][1].answers] == [f'Office.{DOMAIN}']
+
+
+class FakeResponder(object):
+    # answers unicast mdns queries for one Airfoil instance, the way the host running it would
+    def __init__(self, port, with_srv=True, ignore=0):
+        self.port = port
+        self.with_srv = with_srv
+        self.ignore = ignore
+        self.questions = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        instance = f'Office.{DOMAIN}'
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(9000)
+            except OSError:
+                return
+            question = DNSIncoming(data).questions[0]
+            self.questions.append((question.name, question.type))
+            if len(self.questions) <= self.ignore:
+                continue
+            out = DNSOutgoing(_FLAGS_QR_RESPONSE | _FLAGS_AA, multicast=False)
+            if question.type == _TYPE_PTR:
+                out.add_answer_at_time(DNSPointer(DOMAIN, _TYPE_PTR, _CLASS_IN, _DNS_TTL, instance), 0)
+            if question.type == _TYPE_SRV or self.with_srv:
+                out.add_answer_at_time(DNSService(instance, _TYPE_SRV, _CLASS_IN, _DNS_TTL, 0, 0, self.port,
+                                                  'office.local.'), 0)
+            self.sock.sendto(out.packet(), addr)
+
+    def close(self):
+        self.sock.close()
+
+
+@pytest.fixture
+def responder(monkeypatch):
+    monkeypatch.setattr(AirfoilFinder, 'airfoils', {})
+    monkeypatch.setattr(airfoil_finder, 'UNICAST_RETRY', 0.1)
+    responders = []
+
+    def new_responder(**kwargs):
+        responders.append(FakeResponder(52000, **kwargs))
+        monkeypatch.setattr(airfoil_finder, '_MDNS_PORT', responders[-1].sock.getsockname()[1])
+        return responders[-1]
+    yield new_responder
+    for responder in responders:
+        responder.close()
+
+
+class TestUnicast:
+    def test_one_reply(self, responder):
+        r = responder()
+        assert AirfoilFinder.resolve_ip('127.0.0.1') == ('127.0.0.1', 52000, 'office')
+        assert r.questions == [(DOMAIN, _TYPE_PTR)]
+        assert AirfoilFinder.airfoils == {'office': ('127.0.0.1', 52000, 'office')}
+
+    def test_srv_query(self, responder):
+        # a host that only answers the PTR question is asked for the SRV record separately
+        r = responder(with_srv=False)
+        assert AirfoilFinder.resolve_ip('127.0.0.1') == ('127.0.0.1', 52000, 'office')
+        assert r.questions == [(DOMAIN, _TYPE_PTR), (f'Office.{DOMAIN}', _TYPE_SRV)]
+
+    def test_lost_query(self, responder):
+        r = responder(ignore=1)
+        assert AirfoilFinder.resolve_ip('127.0.0.1') == ('127.0.0.1', 52000, 'office')
+        assert len(r.questions) == 2
+
+    def test_no_answer(self, responder):
+        responder(ignore=100)
+        started = time.monotonic()
+        with pytest.raises(TimeoutError):
+            AirfoilFinder.resolve_ip('127.0.0.1', timeout=0.35)
+        assert time.monotonic() - started < 0.6
+
+    def test_get_airfoil_by_ip(self, responder):
+        r = responder()
+        assert AirfoilFinder.get_airfoil_by_ip('127.0.0.1') == ('127.0.0.1', 52000, 'office')
+        # found again without asking
+        assert AirfoilFinder.get_airfoil_by_ip('127.0.0.1') == ('127.0.0.1', 52000, 'office')
+        assert len(r.questions) == 1
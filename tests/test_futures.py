@@ -0,0 +1,87 @@
+import threading, time
+from concurrent.futures import wait
+import pytest
+from remoteFoil.airfoil import Airfoil, AirfoilCancelledError, AirfoilTimeoutError
+from tests.fake_slipstream import FakeSlipstream
+
+
+@pytest.fixture
+def fake():
+    fake = FakeSlipstream(connect_delay=0.2)
+    yield fake
+    fake.close()
+
+
+def airfoil(fake):
+    return Airfoil(ip='127.0.0.1', port=fake.port, request_timeout=2)
+
+
+def following(a):
+    # the thread following the subscription for the futures ends once none of them is pending
+    for _ in range(50):
+        if a.confirmations.thread is None:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+class TestFutures:
+    def test_connect_future(self, fake):
+        a = airfoil(fake)
+        started = time.monotonic()
+        future = a.connect_future(name='office speaker')
+        assert not future.done()
+        speaker = future.result(timeout=2)
+        # resolved by the notification, not by the reply to the command
+        assert time.monotonic() - started >= 0.2
+        assert (speaker.name, speaker.connected) == ('Office speaker', True)
+        assert fake.log == ['subscribe', 'subscribe', 'connectToSpeaker']
+        assert not following(a)
+
+    def test_already_connected(self, fake):
+        a = airfoil(fake)
+        future = a.connect_future(name='kitchen')
+        assert future.done() and future.result().connected
+        assert fake.log == ['subscribe']
+
+    def test_disconnect_futures(self, fake):
+        a = airfoil(fake)
+        futures = a.disconnect_futures()
+        done, not_done = wait(futures, timeout=2)
+        assert not not_done
+        assert [(f.result().name, f.result().connected) for f in futures] == [
+            ('Bedroom speaker', False), ('Office speaker', False), ('Kitchen', False)]
+        # the speaker that was disconnected already is not sent a command
+        assert fake.log.count('disconnectSpeaker') == 2 and fake.log.count('subscribe') == 2
+
+    def test_rejected(self, fake):
+        a = airfoil(fake)
+        fake.reject.add('CC-2@Office speaker')
+        speaker = a.connect_future(name='office speaker').result(timeout=2)
+        # a command Airfoil did not accept resolves the future with the speaker as it was
+        assert not speaker.connected
+        assert not following(a)
+
+    def test_timeout(self, fake):
+        a = airfoil(fake)
+        fake.quiet = True
+        future = a.connect_future(name='office speaker', timeout=0.3)
+        with pytest.raises(AirfoilTimeoutError):
+            future.result(timeout=2)
+        assert not following(a)
+
+    def test_subscription_lost(self, fake):
+        a = airfoil(fake)
+        fake.connect_delay = 5
+        future = a.connect_future(name='office speaker')
+        fake.drop_subscribers()
+        with pytest.raises(ConnectionError):
+            future.result(timeout=2)
+
+    def test_cancel(self, fake):
+        a = airfoil(fake)
+        fake.connect_delay = 5
+        future = a.connect_future(name='office speaker')
+        threading.Timer(0.1, a.cancel).start()
+        with pytest.raises(AirfoilCancelledError):
+            future.result(timeout=2)
@@ -0,0 +1,94 @@
+import time
+import pytest
+from remoteFoil.airfoil import Airfoil, AirfoilTimeoutError, deadline
+from tests.fake_slipstream import FakeSlipstream
+
+
+@pytest.fixture
+def fake():
+    fake = FakeSlipstream()
+    yield fake
+    fake.close()
+
+
+def airfoil(fake, **kwargs):
+    return Airfoil(ip='127.0.0.1', port=fake.port, **kwargs)
+
+
+class TestDerivedState:
+    def test_no_readback(self, fake):
+        a = airfoil(fake)
+        speakers = a.connect_speakers(names=['Office speaker'])
+        # the state returned comes from the reply, so the speakers are only read to find the one to connect
+        assert [(s.name, s.connected) for s in speakers] == [('Office speaker', True)]
+        assert fake.log == ['subscribe', 'connectToSpeaker']
+        assert [(s.name, s.volume) for s in a.set_volume(0.3, name='kitchen')] == [('Kitchen', 0.3)]
+        assert fake.log[2:] == ['subscribe', 'setSpeakerVolume']
+
+    def test_confirm(self, fake):
+        a = airfoil(fake)
+        speakers = a.set_volume(0.3, name='kitchen', confirm=True)
+        assert [(s.name, s.volume) for s in speakers] == [('Kitchen', 0.3)]
+        assert fake.log == ['subscribe', 'setSpeakerVolume', 'subscribe']
+
+    def test_rejected(self, fake):
+        a = airfoil(fake)
+        fake.reject.add('AP-3@Kitchen')
+        assert [s.volume for s in a.set_volume(0.3, name='kitchen')] == [1.0]
+
+    def test_set_source(self, fake):
+        a = airfoil(fake)
+        source = a.set_source(name='spotify')
+        assert source.source_name == 'Spotify' and source.source_controllable is None
+        assert 'getSourceMetadata' not in fake.log
+
+
+class TestNoOps:
+    def test_connect_all(self, fake):
+        a = airfoil(fake)
+        speakers = a.connect_all()
+        # only the speaker that is not connected yet is sent a command
+        assert fake.log == ['subscribe', 'connectToSpeaker']
+        assert [(r.speaker.name, r.status) for r in a.results] == [
+            ('Bedroom speaker', 'skipped'), ('Office speaker', 'changed'), ('Kitchen', 'skipped')]
+        assert all(s.connected for s in speakers)
+
+    def test_set_volume_all(self, fake):
+        a = airfoil(fake)
+        speakers = a.set_volume_all(1.0)
+        assert fake.log == ['subscribe', 'setSpeakerVolume']
+        assert [(s.name, s.volume) for s in speakers] == [('Bedroom speaker', 1.0), ('Kitchen', 1.0)]
+        assert [r.status for r in a.results] == ['changed', 'skipped']
+
+    def test_failed(self, fake):
+        a = airfoil(fake)
+        fake.reject.add('CC-1@Bedroom speaker')
+        a.disconnect_all()
+        assert [(r.speaker.name, r.speaker.connected, r.status) for r in a.results] == [
+            ('Bedroom speaker', True, 'failed'), ('Office speaker', False, 'skipped'), ('Kitchen', False, 'changed')]
+
+
+class TestConcurrency:
+    def timed(self, fake, max_concurrency, volume):
+        a = airfoil(fake, max_concurrency=max_concurrency)
+        a.get_speakers()
+        started = time.monotonic()
+        a.set_volume_all(volume, include_disconnected=True)
+        assert [r.status for r in a.results] == ['changed'] * 3
+        return time.monotonic() - started
+
+    def test_parallel(self, fake):
+        fake.delay['setSpeakerVolume'] = 0.3
+        # each command has its own connection, so slow replies do not wait for each other
+        assert self.timed(fake, 4, 0.2) < 0.6
+        assert self.timed(fake, 1, 0.4) >= 0.9
+
+    def test_deadline(self, fake):
+        a = airfoil(fake)
+        fake.hold.add('setSpeakerVolume')
+        started = time.monotonic()
+        # the caller's deadline applies to the commands sent from the pool threads
+        with pytest.raises(AirfoilTimeoutError):
+            with deadline(0.3):
+                a.set_volume_all(0.2)
+        assert time.monotonic() - started < 2
@@ -0,0 +1,25 @@
+import time
+from remoteFoil.health import HostHealth
+
+
+class TestHealth:
+    def test_breaker(self):
+        health = HostHealth(threshold=2, cooldown=0.05)
+        assert health.available()
+        assert not health.failure(OSError('refused'))
+        assert health.failure(OSError('refused'))
+        assert health.state == 'open' and not health.available()
+        time.sleep(0.06)
+        assert health.state == 'half-open'
+        assert health.available()
+        assert not health.available()
+        health.failure(OSError('refused'))
+        assert health.state == 'open' and health.failures == 3
+        health.success(0.1)
+        assert health.state == 'closed' and health.available() and health.failures == 0
+
+    def test_latency(self):
+        health = HostHealth()
+        health.success(1.0)
+        health.success(0.0)
+        assert health.as_dict()['latency'] == 0.8
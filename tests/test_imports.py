@@ -0,0 +1,18 @@
+import os, subprocess, sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFERRED = ['remoteFoil.airfoil_finder', 'remoteFoil._zeroconf', 'netifaces', 'json', 'concurrent.futures']
+
+
+def imported(module):
+    code = f'import sys, {module}; print(",".join(m for m in {DEFERRED!r} if m in sys.modules))'
+    return subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True,
+                          check=True).stdout.strip()
+
+
+class TestImports:
+    def test_package_defers_discovery(self):
+        assert imported('remoteFoil') == ''
+
+    def test_cli_defers_discovery(self):
+        assert imported('airfoil_cli') == ''
@@ -0,0 +1,46 @@
+import multiprocessing
+import pytest
+from remoteFoil.airfoil import Airfoil
+from remoteFoil.mute_store import MuteStore
+
+AIRFOIL = '192.168.1.20'
+SPEAKER = Airfoil.speaker('Kitchen', 'airplay', 'AP-3', 0.6, True, False, ['kitchen'])
+
+
+def unmute(path, results):
+    # Airfoil.speaker can't be pickled, so only the volume goes back to the test
+    speaker = MuteStore(AIRFOIL, path).pop('AP-3', None)
+    results.put(speaker.volume if speaker else None)
+
+
+class TestMuteStore:
+    def test_shared(self, tmp_path):
+        path = str(tmp_path / 'mutes.db')
+        MuteStore(AIRFOIL, path)['AP-3'] = SPEAKER
+        store = MuteStore(AIRFOIL, path)
+        assert 'ap-3' in store
+        assert store['AP-3'] == SPEAKER
+        assert list(store) == ['ap-3']
+        assert len(MuteStore('192.168.1.21', path)) == 0
+        assert store.pop('AP-3') == SPEAKER
+        assert store.pop('AP-3', None) is None
+        with pytest.raises(KeyError):
+            del store['AP-3']
+
+    def test_pop_once(self, tmp_path):
+        path = str(tmp_path / 'mutes.db')
+        MuteStore(AIRFOIL, path)['AP-3'] = SPEAKER
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=unmute, args=(path, results)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        volumes = [results.get(timeout=10) for _ in workers]
+        for worker in workers:
+            worker.join(timeout=10)
+        assert sorted(volumes, key=bool) == [None, None, None, 0.6]
+
+    def test_memory(self):
+        store = MuteStore(AIRFOIL, '')
+        store['AP-3'] = SPEAKER
+        assert store.pop('ap-3') is SPEAKER
+        assert not store
@@ -0,0 +1,77 @@
+import threading, time
+import pytest
+from remoteFoil.airfoil import Airfoil, AirfoilCancelledError, AirfoilTimeoutError, deadline
+from tests.fake_slipstream import FakeSlipstream
+
+
+@pytest.fixture
+def fake():
+    fake = FakeSlipstream()
+    yield fake
+    fake.close()
+
+
+def airfoil(fake, **kwargs):
+    return Airfoil(ip='127.0.0.1', port=fake.port, **kwargs)
+
+
+def cancel_after(airfoil, seconds):
+    timer = threading.Timer(seconds, airfoil.cancel)
+    timer.start()
+    return timer
+
+
+class TestRequests:
+    def test_reply(self, fake):
+        a = airfoil(fake)
+        assert [s.name for s in a.get_speakers()] == ['Bedroom speaker', 'Office speaker', 'Kitchen']
+        assert fake.log == ['subscribe']
+
+    def test_request_timeout(self, fake):
+        a = airfoil(fake, request_timeout=0.3)
+        fake.hold.add('subscribe')
+        started = time.monotonic()
+        with pytest.raises(AirfoilTimeoutError):
+            a.get_speakers()
+        assert 0.25 < time.monotonic() - started < 2
+
+    def test_deadline(self, fake):
+        a = airfoil(fake, request_timeout=None)
+        fake.hold.add('connectToSpeaker')
+        started = time.monotonic()
+        with pytest.raises(AirfoilTimeoutError):
+            with deadline(0.3):
+                a.connect_speakers(names=['Office speaker'])
+        assert time.monotonic() - started < 2
+        # the deadline only applies inside the with block
+        fake.hold.clear()
+        assert [s.connected for s in a.connect_speakers(names=['Office speaker'])] == [True]
+
+    def test_cancel(self, fake):
+        a = airfoil(fake, request_timeout=None)
+        fake.hold.add('subscribe')
+        cancel_after(a, 0.2)
+        with pytest.raises(AirfoilCancelledError):
+            a.get_speakers()
+        assert not a.sockets and not a.cancelled
+
+    def test_cancel_during_handshake(self, fake):
+        a = airfoil(fake, request_timeout=None)
+        fake.hold.add('hello')
+        cancel_after(a, 0.2)
+        with pytest.raises(AirfoilCancelledError):
+            a.get_speakers()
+        assert fake.log == []
+
+    def test_refused_handshake(self, fake):
+        a = airfoil(fake)
+        fake.hello = b'com.rogueamoeba.protocol.slipstreamremote\nmajorversion=2,minorversion=0\nOK\n'
+        with pytest.raises(ConnectionError) as error:
+            a.get_speakers()
+        assert not isinstance(error.value, AirfoilCancelledError)
+
+    def test_closed(self, fake):
+        a = airfoil(fake)
+        fake.drop.add('subscribe')
+        with pytest.raises(ConnectionError):
+            a.get_speakers()
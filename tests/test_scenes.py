@@ -0,0 +1,60 @@
+import pytest
+from remoteFoil.airfoil_state import AirfoilState
+from remoteFoil.scenes import Scene, SceneStore
+
+SPEAKERS = [
+    {'name': 'Bedroom speaker', 'type': 'chromecast', 'longIdentifier': 'CC-1', 'volume': 0.5, 'connected': True,
+     'password': False},
+    {'name': 'Office speaker', 'type': 'chromecast', 'longIdentifier': 'CC-2', 'volume': 0.0, 'connected': False,
+     'password': False},
+    {'name': 'Kitchen', 'type': 'airplay', 'longIdentifier': 'AP-3', 'volume': 1.0, 'connected': True,
+     'password': False}]
+
+
+class TestScenes:
+    def state(self):
+        state = AirfoilState()
+        state.load_speakers(SPEAKERS)
+        return state
+
+    def test_parse(self):
+        scene = Scene.parse({'source': 'Spotify', 'speakers': {'kitchen': {'volume': '40%', 'muted': False}}})
+        assert scene.source == 'Spotify'
+        assert scene.speakers == {'kitchen': {'volume': 0.4, 'muted': False}}
+        for doc in [[], {'speakers': {'kitchen': {'loud': True}}}, {'speakers': {'kitchen': {'connected': 'yes'}}},
+                    {'speakers': {'kitchen': True}}, {'source': 1}, {'lights': 'off'}]:
+            with pytest.raises(ValueError):
+                Scene.parse(doc)
+
+    def test_diff(self):
+        state = self.state()
+        scene = Scene.parse({'speakers': {'office': {'connected': True, 'volume': 0.4},
+                                          'bedroom speaker': {'connected': True, 'volume': 0.5},
+                                          'kitchen': {'muted': True, 'volume': 0.7}}})
+        targets = scene.resolve(state)
+        steps = [(s.action, s.speaker.id, s.value) for s in scene.diff(state, targets)]
+        assert steps == [('connect', 'CC-2', None), ('volume', 'CC-2', 0.4), ('mute', 'AP-3', 0.7)]
+        assert [s.id for s in scene.missed(state, targets)] == ['CC-2', 'AP-3']
+        state.update_speaker('CC-2', connected=True, volume=0.4)
+        state.update_speaker('AP-3', volume=0)
+        assert scene.diff(state, targets) == []
+        assert scene.missed(state, targets) == []
+
+    def test_resolve_unknown_speaker(self):
+        with pytest.raises(ValueError):
+            Scene.parse({'speakers': {'garage': {'connected': True}}}).resolve(self.state())
+
+    def test_store_plans(self, tmp_path):
+        path = str(tmp_path / 'scenes.json')
+        state = self.state()
+        store = SceneStore(path)
+        store.save('Dinner', {'speakers': {'kitchen': {'volume': 0.3}}})
+        scene, targets = store.resolve('dinner', 'server', state)
+        assert targets == {'AP-3': {'volume': 0.3}}
+        assert SceneStore(path).plans['server/dinner']['targets'] == targets
+
+        state.update_speaker('AP-3', name='Porch')
+        with pytest.raises(ValueError):
+            store.resolve('dinner', 'server', state)    # plan no longer matches, and kitchen is gone
+        store.listener('server')({'request': 'speakerListChanged'})
+        assert store.plans == {}
@@ -0,0 +1,47 @@
+import time
+from remoteFoil.airfoil import Airfoil, RESYNCED
+from remoteFoil.source_catalog import SourceCatalog
+
+SOURCES = [Airfoil.source('Spotify', 'spotify.exe', 'running_apps', ['spotify'], ''),
+           Airfoil.source('Microphone (USB)', 'usb-mic', 'audio_device', ['microphone', 'usb'], ''),
+           Airfoil.source('Spotify', 'recent-spotify.exe', 'recent_apps', ['spotify'], ''),
+           Airfoil.source('System Audio', 'windows.systemaudio', 'system_audio', ['system', 'audio'], '')]
+
+
+class TestSourceCatalog:
+    def test_find(self):
+        catalog = SourceCatalog()
+        catalog.load(SOURCES)
+        assert catalog.find(id='USB-MIC') is SOURCES[1]
+        assert catalog.find(name='system audio') is SOURCES[3]
+        # like the loops over the whole list, the last match wins
+        assert catalog.find(name='spotify') is SOURCES[2]
+        assert catalog.find(keywords=['USB', 'microphone']) is SOURCES[1]
+        assert catalog.find(keywords='audio') is SOURCES[3]
+        assert catalog.find(unknown='spotify.exe') is SOURCES[0]
+        assert catalog.find(unknown='Microphone USB') is SOURCES[1]
+        assert catalog.find(name='winamp') is None
+        assert catalog.find(keywords=['usb', 'audio']) is None
+
+    def test_expiry(self):
+        catalog = SourceCatalog(ttl=0.2)
+        assert catalog.stale and not catalog.refresh_due
+        catalog.load(SOURCES)
+        assert not catalog.stale and not catalog.refresh_due
+        time.sleep(0.12)
+        assert not catalog.stale and catalog.refresh_due
+        catalog.refreshing = True
+        assert not catalog.refresh_due
+        time.sleep(0.1)
+        assert catalog.stale
+        catalog.load(SOURCES)
+        catalog.listener({'request': RESYNCED, 'data': {}})
+        assert catalog.stale
+
+    def test_version(self):
+        catalog = SourceCatalog()
+        catalog.load(SOURCES)
+        catalog.load([s._replace(icon='base64') for s in SOURCES])
+        assert catalog.version == 1
+        catalog.load(SOURCES[:2])
+        assert catalog.version == 2
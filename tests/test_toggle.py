@@ -0,0 +1,59 @@
+import time
+import pytest
+from remoteFoil.airfoil import Airfoil
+from tests.fake_slipstream import FakeSlipstream
+
+
+@pytest.fixture
+def fake():
+    fake = FakeSlipstream(connect_delay=0.2)
+    yield fake
+    fake.close()
+
+
+def connected(fake):
+    return {id: s['connected'] for id, s in fake.speakers.items()}
+
+
+class TestToggle:
+    def test_phases(self, fake):
+        a = Airfoil(ip='127.0.0.1', port=fake.port, request_timeout=2)
+        started = time.monotonic()
+        speakers = a.toggle_all()
+        # each phase waits for Airfoil to report its speakers changed before the next one starts
+        assert time.monotonic() - started >= 0.4
+        commands = [r for r in fake.log if r != 'subscribe']
+        assert commands == ['disconnectSpeaker'] * 2 + ['connectToSpeaker'] * 2
+        assert [(s.name, s.connected) for s in speakers] == [('Bedroom speaker', True), ('Kitchen', True)]
+        assert [r.status for r in a.results] == ['changed', 'changed']
+        assert connected(fake) == {'CC-1@Bedroom speaker': True, 'CC-2@Office speaker': False, 'AP-3@Kitchen': True}
+
+    def test_include_disconnected(self, fake):
+        a = Airfoil(ip='127.0.0.1', port=fake.port, request_timeout=2)
+        speakers = a.toggle_all(include_disconnected=True)
+        assert [s.connected for s in speakers] == [True, True, True]
+        assert fake.log.count('disconnectSpeaker') == 2 and fake.log.count('connectToSpeaker') == 3
+
+    def test_failed(self, fake):
+        a = Airfoil(ip='127.0.0.1', port=fake.port, request_timeout=2)
+        fake.reject.add('CC-1@Bedroom speaker')
+        speakers = a.toggle_all()
+        # a speaker that did not disconnect is not connected again, the others carry on
+        assert [(r.speaker.name, r.status) for r in a.results] == [('Bedroom speaker', 'failed'),
+                                                                    ('Kitchen', 'changed')]
+        assert [s.connected for s in speakers] == [True, True]
+        assert fake.log.count('connectToSpeaker') == 1
+
+    def test_toggle_speaker(self, fake):
+        a = Airfoil(ip='127.0.0.1', port=fake.port, request_timeout=2)
+        assert [(s.name, s.connected) for s in a.toggle_speaker(name='office speaker')] == [('Office speaker', True)]
+        assert fake.log == ['subscribe', 'connectToSpeaker']
+        fake.reject.add('AP-3@Kitchen')
+        assert a.toggle_speaker(name='kitchen') == []
+
+    def test_subscription_closed(self, fake):
+        a = Airfoil(ip='127.0.0.1', port=fake.port, request_timeout=2)
+        fake.drop.add('subscribe')
+        with pytest.raises(ConnectionError):
+            a.toggle_all()
+        assert 'disconnectSpeaker' not in fake.log
@@ -1,5 +1,6 @@
+import io
 import pytest
-from remoteFoil.utils import nones, bools, print_table
+from remoteFoil.utils import nones, bools, print_table, fit_sizes, TableWriter, LiveTable
 
 
 class TestUtils:
@@ -40,4 +41,36 @@ class TestUtils:
         with pytest.raises(TypeError):
             print_table(headers)
 
+    def test_fit_sizes(self):
+        assert fit_sizes([1, 6, 20], 80) == [1, 6, 20]
+        # only the part of a column wider than 10 is given up, in proportion
+        assert fit_sizes([1, 15, 30], 40) == [1, 13, 24]
+        assert fit_sizes([30, 30], 20) == [9, 10]
+        assert fit_sizes([5, 5, 5], 2) == [1, 1, 1]
+        assert fit_sizes([1, 1, 1], 2) == [1, 1, 1]
+        assert fit_sizes([1, 1], 1) == [1, 1]
+        assert fit_sizes([], 0) == []
 
+    def test_table_writer(self):
+        out = io.StringIO()
+        table = TableWriter(['a', 'b'], (3, 4), width=80, file=out)
+        table.write(['1', 'two'])
+        table.write(['2', 'three'])
+        assert out.getvalue() == 'a   b    \n' \
+                                 '--- ---- \n' \
+                                 '1   two  \n' \
+                                 '2   thre \n' \
+                                 '    e    \n'
+
+    def test_live_table(self):
+        out = io.StringIO()
+        table = LiveTable(['a', 'b'], (5, 5), file=out)
+        table.update([['1', 'x'], ['2', 'y']], 'first')
+        assert out.getvalue() == '\x1b[2Ka b \n\x1b[2K- - \n\x1b[2K1 x \n\x1b[2K2 y \n\x1b[2Kfirst\n'
+        out.seek(0), out.truncate()
+        table.update([['1', 'x'], ['2', 'z']], 'first')
+        # back up over the table, skip the three lines that did not change, and rewrite the one that did
+        assert out.getvalue() == '\x1b[5F\x1b[3E\x1b[2K2 z \n\x1b[1E'
+        out.seek(0), out.truncate()
+        table.update([['1', 'x']])
+        assert out.getvalue() == '\x1b[5F\x1b[3E\x1b[J'
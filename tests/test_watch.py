@@ -0,0 +1,117 @@
+import asyncio, threading, time
+import pytest
+import remoteFoil.airfoil
+from remoteFoil.airfoil import Airfoil, AirfoilCancelledError, RESYNCED, deadline
+from remoteFoil.airfoil_async import AsyncAirfoil
+from remoteFoil.airfoil_finder import AirfoilFinder
+from remoteFoil.airfoil_state import AirfoilState
+from tests.fake_slipstream import FakeSlipstream
+
+
+@pytest.fixture
+def fakes(monkeypatch):
+    # reconnect quickly, and look instances up among the fakes instead of on the network
+    monkeypatch.setattr(remoteFoil.airfoil, 'RECONNECT_BACKOFF', 0.05)
+    fakes = [FakeSlipstream()]
+    monkeypatch.setattr(AirfoilFinder, 'resolve_ip', staticmethod(
+        lambda ip, timeout=None: (ip, fakes[-1].port, ip)))
+    yield fakes
+    for fake in fakes:
+        fake.close()
+
+
+def restart(fakes):
+    # Airfoil listens on a new port after it restarts
+    fakes[-1].close()
+    fakes.append(FakeSlipstream())
+
+
+def after(seconds, fn, *args, **kwargs):
+    timer = threading.Timer(seconds, fn, args, kwargs)
+    timer.start()
+    return timer
+
+
+def kinds(messages):
+    return [m.get('request') or 'reply' for m in messages]
+
+
+class TestWatch:
+    def test_notifications(self, fakes):
+        a = Airfoil(ip='127.0.0.1', port=fakes[0].port)
+        b = Airfoil(ip='127.0.0.1', port=fakes[0].port)
+        after(0.3, b.set_volume, 0.25, name='kitchen')
+        started = time.monotonic()
+        with deadline(0.8):
+            messages = list(a.watch())
+        # the generator ends at the deadline instead of raising
+        assert 0.7 < time.monotonic() - started < 2
+        assert kinds(messages) == ['reply', 'speakerVolumeChanged']
+        assert messages[1]['data'] == {'longIdentifier': 'AP-3@Kitchen', 'volume': 0.25}
+
+    def test_resubscribe(self, fakes):
+        a = Airfoil(ip='127.0.0.1', port=fakes[0].port)
+        a.state = AirfoilState()
+        lives = []
+        after(0.3, fakes[0].drop_subscribers)
+        with deadline(3):
+            for message in a.watch():
+                lives.append(a.state.live)
+                a.state.handle(message)
+                a.state.live = True
+                if message.get('request') == RESYNCED:
+                    break
+        # missed notifications are made up for by the full speaker list, and the state is not live in between
+        assert len(message['data']['speakers']) == 3
+        assert lives == [False, False]
+        assert fakes[0].log == ['subscribe', 'subscribe']
+
+    def test_relocate(self, fakes):
+        a = Airfoil(ip='127.0.0.1', port=fakes[0].port)
+        after(0.3, restart, fakes)
+        with deadline(5):
+            messages = []
+            for message in a.watch():
+                messages.append(message)
+                if message.get('request') == RESYNCED:
+                    break
+        assert kinds(messages) == ['reply', RESYNCED]
+        assert a.port == fakes[1].port != fakes[0].port
+
+    def test_no_reconnect(self, fakes):
+        a = Airfoil(ip='127.0.0.1', port=fakes[0].port)
+        after(0.3, fakes[0].drop_subscribers)
+        with pytest.raises(ConnectionError):
+            with deadline(3):
+                list(a.watch(reconnect=False))
+
+    def test_cancel(self, fakes):
+        a = Airfoil(ip='127.0.0.1', port=fakes[0].port)
+        after(0.3, a.cancel)
+        with pytest.raises(AirfoilCancelledError):
+            with deadline(3):
+                list(a.watch())
+        # cancel also ends the wait between reconnects
+        fakes[0].close()
+        after(0.3, a.cancel)
+        with pytest.raises(AirfoilCancelledError):
+            with deadline(3):
+                list(a.watch())
+
+    def test_async_relocate(self, fakes):
+        async def main():
+            a = AsyncAirfoil('127.0.0.1', fakes[0].port, '127.0.0.1')
+            events = []
+            a.state.listeners.append(lambda message: events.append(message.get('request')))
+            await a.get_speakers()
+            restart(fakes)
+            for _ in range(100):
+                if RESYNCED in events:
+                    break
+                await asyncio.sleep(0.05)
+            speakers = await a.get_speakers(fresh=True)
+            await a.close()
+            return a.port, events, speakers
+        port, events, speakers = asyncio.run(main())
+        assert port == fakes[1].port
+        assert RESYNCED in events and len(speakers) == 3